@@ -0,0 +1,167 @@
+# availability.py
+"""
+Индекс занятости: для каждого дня — отсортированный список интервалов
+[начало, конец) в минутах от полуночи, загруженный из bookings и обновляемый
+при бронировании/отмене. Отвечает на «свободные начала для даты D и
+длительности M» без обращения к БД.
+
+Когда заявки пишут несколько процессов (supervisor.py), индекс каждого видит
+только свои брони, поэтому дни перечитываются из БД раз в ttl секунд; от двойной
+брони защищает проверка пересечений в транзакции записи (db.BookingWriter).
+"""
+
+import bisect
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import db
+
+logger = logging.getLogger("booking-bot.availability")
+
+SELECT_BUSY_SQL = """
+SELECT date, time, duration_min
+FROM bookings
+WHERE date IN ({placeholders}) AND COALESCE(status, 'submitted') != 'cancelled'
+"""
+
+
+def to_minutes(timestr: str) -> Optional[int]:
+    try:
+        h, m = timestr.split(":", 1)
+        return int(h) * 60 + int(m)
+    except (AttributeError, ValueError):
+        return None
+
+
+class AvailabilityIndex:
+    def __init__(self, slot_start: int, slot_end: int, work_end: int, step_min: int = 60, ttl: float = 0.0):
+        """
+        slot_start/slot_end — первый и последний час начала сеанса,
+        work_end — час, к которому сеанс должен закончиться,
+        ttl — через сколько секунд день перечитывается из БД (0 — никогда).
+        """
+        self.configure(slot_start, slot_end, work_end, step_min)
+        self.ttl = ttl
+        # date -> [(start, end), ...], отсортировано по start
+        self._days: Dict[str, List[Tuple[int, int]]] = {}
+        self._loaded: Set[str] = set()
+        # date -> monotonic-время загрузки (для ttl)
+        self._loaded_at: Dict[str, float] = {}
+        # date -> версия; меняется при каждом изменении дня (ключ для кэшей клавиатур)
+        self.versions: Dict[str, int] = {}
+
+    def configure(self, slot_start: int, slot_end: int, work_end: int, step_min: int = 60) -> None:
+        self.starts = list(range(slot_start * 60, slot_end * 60 + 1, step_min))
+        self.work_end = work_end * 60
+
+    # -------------------------------------------------------------------------
+    # Загрузка из БД
+    # -------------------------------------------------------------------------
+    async def ensure_loaded(self, dates: Iterable[str]) -> None:
+        dates = list(dict.fromkeys(dates))
+        now = time.monotonic()
+        if self.ttl:
+            for d in dates:
+                if d in self._loaded and now - self._loaded_at[d] > self.ttl:
+                    # день могли забронировать другие процессы — перечитаем
+                    self._loaded.discard(d)
+        missing = [d for d in dates if d not in self._loaded]
+        if not missing:
+            return
+        sql = SELECT_BUSY_SQL.format(placeholders=",".join("?" * len(missing)))
+        async with db.pool.acquire() as conn:
+            cur = await conn.execute(sql, missing)
+            rows = await cur.fetchall()
+        # день мог загрузить параллельный вызов (и уже что-то зарезервировать) — его не трогаем
+        claimed = {d for d in missing if d not in self._loaded}
+        for date in claimed:
+            self._loaded.add(date)
+            self._loaded_at[date] = now
+            self._days[date] = []
+            self._bump(date)
+        for date, timestr, duration in rows:
+            if date in claimed:
+                self._add(date, timestr, duration or 60)
+
+    def forget(self, date: str) -> None:
+        """Сбрасывает день; при следующем запросе он перечитается из БД."""
+        self._loaded.discard(date)
+        self._days.pop(date, None)
+        self._bump(date)
+
+    # -------------------------------------------------------------------------
+    # Запросы
+    # -------------------------------------------------------------------------
+    def _overlaps(self, intervals: List[Tuple[int, int]], start: int, end: int) -> bool:
+        # кандидаты — интервалы, начавшиеся до конца нового
+        i = bisect.bisect_left(intervals, (end,))
+        while i > 0:
+            i -= 1
+            if intervals[i][1] > start:
+                return True
+        return False
+
+    def is_free(self, date: str, timestr: str, duration_min: int) -> bool:
+        start = to_minutes(timestr)
+        if start is None:
+            return False
+        end = start + duration_min
+        if end > self.work_end:
+            return False
+        return not self._overlaps(self._days.get(date, ()), start, end)
+
+    def free_starts(self, date: str, duration_min: int) -> List[str]:
+        intervals = self._days.get(date, [])
+        result = []
+        for start in self.starts:
+            end = start + duration_min
+            if end > self.work_end:
+                break
+            if not self._overlaps(intervals, start, end):
+                result.append(f"{start // 60:02d}:{start % 60:02d}")
+        return result
+
+    def has_free(self, date: str, duration_min: int) -> bool:
+        intervals = self._days.get(date, [])
+        for start in self.starts:
+            end = start + duration_min
+            if end > self.work_end:
+                return False
+            if not self._overlaps(intervals, start, end):
+                return True
+        return False
+
+    # -------------------------------------------------------------------------
+    # Изменения
+    # -------------------------------------------------------------------------
+    def _bump(self, date: str) -> None:
+        self.versions[date] = self.versions.get(date, 0) + 1
+
+    def _add(self, date: str, timestr: str, duration_min: int) -> None:
+        start = to_minutes(timestr)
+        if start is None:
+            return
+        bisect.insort(self._days.setdefault(date, []), (start, start + duration_min))
+        self._bump(date)
+
+    def reserve(self, date: str, timestr: str, duration_min: int) -> bool:
+        """
+        Проверка и резервирование без await между ними — атомарно в рамках event loop.
+        День должен быть загружен (ensure_loaded).
+        """
+        if not self.is_free(date, timestr, duration_min):
+            return False
+        self._add(date, timestr, duration_min)
+        return True
+
+    def release(self, date: str, timestr: str, duration_min: int) -> None:
+        start = to_minutes(timestr)
+        intervals = self._days.get(date)
+        if start is None or not intervals:
+            return
+        try:
+            intervals.remove((start, start + duration_min))
+        except ValueError:
+            return
+        self._bump(date)
@@ -0,0 +1,112 @@
+# bench_webhook.py
+"""
+Локальный прогон webhook-режима: поднимает fake_bot_api.FakeBotAPI вместо
+Telegram, webhook-приложение бота (main.build_webhook_app) и отправляет на него
+синтетические апдейты /start от разных пользователей.
+
+Пример:
+    python bench_webhook.py --updates 5000 --concurrency 200
+
+Печатает скорость приёма апдейтов (HTTP) и скорость полной обработки
+(до ответного sendMessage/sendPhoto в fake API).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import aiohttp
+
+from fake_bot_api import FakeBotAPI
+
+BENCH_TOKEN = "123456:BENCHMARK"
+BENCH_SECRET = "bench-secret"
+
+
+def start_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"},
+            "text": "/start",
+        },
+    }
+
+
+async def run(updates: int, concurrency: int, port: int) -> None:
+    fake = FakeBotAPI()
+    await fake.start()
+
+    # main читает настройки при импорте — окружение готовим заранее
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "TELEGRAM_API_URL": fake.url,
+        "WEBHOOK_SECRET": BENCH_SECRET,
+        "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="bench-"), "bot.db"),
+        "MEDIA_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="bench-"), "media_cache.json"),
+    })
+    import main
+
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    await main.init_db()
+    await main.notifier.start()
+    main.outbox.start()
+    runner = aiohttp.web.AppRunner(main.build_webhook_app())
+    await runner.setup()
+    await aiohttp.web.TCPSite(runner, "127.0.0.1", port).start()
+    url = f"http://127.0.0.1:{port}{main.WEBHOOK_PATH}"
+
+    replies = lambda: fake.calls["sendMessage"] + fake.calls["sendPhoto"]
+    sem = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def post(session: aiohttp.ClientSession, i: int) -> None:
+        nonlocal errors
+        async with sem:
+            async with session.post(
+                url,
+                json=start_update(i, 1_000_000 + i),
+                headers={"X-Telegram-Bot-Api-Secret-Token": BENCH_SECRET},
+            ) as resp:
+                if resp.status != 200:
+                    errors += 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, i) for i in range(updates)))
+    accepted = time.perf_counter() - started
+    while replies() < updates - errors:
+        await asyncio.sleep(0.01)
+    processed = time.perf_counter() - started
+
+    print(f"updates:            {updates} (HTTP errors: {errors})")
+    print(f"accepted in:        {accepted:.2f}s  ({updates / accepted:.0f} updates/s)")
+    print(f"processed in:       {processed:.2f}s  ({updates / processed:.0f} updates/s)")
+    print(f"Bot API calls:      {dict(fake.calls)}")
+
+    await runner.cleanup()
+    await main.outbox.stop()
+    await main.notifier.stop()
+    await main.close_db()
+    await fake.stop()
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="Webhook throughput against a fake Bot API")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.concurrency, args.port))
+
+
+if __name__ == "__main__":
+    cli()
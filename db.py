@@ -1,7 +1,107 @@
-import aiosqlite
+import asyncio
+import os
+import logging
+import sqlite3
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import aiosqlite
+
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+
+logger = logging.getLogger("booking-bot.db")
+
+# Применяются к каждому соединению пула
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # ~16 МБ страничного кэша на соединение
+    "PRAGMA mmap_size=134217728",    # 128 МБ
+)
+# Размер кэша подготовленных выражений sqlite3 на соединение
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionPool:
+    """
+    Долгоживущие соединения с bot.db: одно для записи (SQLite всё равно пишет
+    последовательно, так не ловим SQLITE_BUSY) и несколько для чтения (WAL).
+    Подготовленные выражения кэшируются sqlite3 внутри каждого соединения,
+    поэтому SQL держим в константах модуля.
+    """
+
+    def __init__(self, path: str = DB_PATH, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = max(1, size)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all: List[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        self._all.append(conn)
+        return conn
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self.is_open:
+                return
+            writer = await self._connect()
+            for _ in range(self.size):
+                self._readers.put_nowait(await self._connect())
+            self._writer = writer
+
+    async def close(self) -> None:
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._write_lock:
+                self._writer = None
+            for conn in self._all:
+                await conn.close()
+            self._all = []
+            self._readers = asyncio.Queue()
+
+    async def interrupt_write(self) -> None:
+        """Прерывает запрос, который выполняется (или ждёт блокировку) на соединении записи."""
+        if self._writer is not None:
+            await self._writer.interrupt()
+
+    @asynccontextmanager
+    async def acquire(self, write: bool = False) -> AsyncIterator[aiosqlite.Connection]:
+        if not self.is_open:
+            await self.open()
+        if write:
+            async with self._write_lock:
+                yield self._writer
+            return
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
 
-DB_PATH = "bot.db"
+pool = ConnectionPool()
+
+
+async def close_db(timeout: Optional[float] = None):
+    """timeout — сколько секунд ждать, пока writer допишет очередь (None — без ограничения)."""
+    await writer.stop(timeout)
+    await pool.close()
 
 BOOKINGS_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS bookings (
@@ -19,46 +119,557 @@ CREATE TABLE IF NOT EXISTS bookings (
 );
 """
 
-# Попытка добавить недостающие колонки при апгрейде старых баз (тихая миграция)
-MIGRATIONS = [
-    "ALTER TABLE bookings ADD COLUMN service TEXT",
-    "ALTER TABLE bookings ADD COLUMN duration_min INTEGER",
-    "ALTER TABLE bookings ADD COLUMN price INTEGER",
-    "ALTER TABLE bookings ADD COLUMN comment TEXT",
-    "ALTER TABLE bookings ADD COLUMN date TEXT",
-    "ALTER TABLE bookings ADD COLUMN time TEXT",
-    "ALTER TABLE bookings ADD COLUMN status TEXT DEFAULT 'submitted'",
-    "ALTER TABLE bookings ADD COLUMN created_at TEXT"
+# Состояния FSM (см. fsm_storage.SQLiteStorage)
+FSM_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS fsm_data (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT,
+    updated_at TEXT
+);
+"""
+
+# Transactional outbox: уведомления админам пишутся в одной транзакции с заявкой
+# и доставляются фоном (outbox.OutboxDispatcher) — at-least-once, переживает рестарты
+OUTBOX_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT,
+    delivered_at TEXT
+);
+"""
+OUTBOX_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (next_attempt_at, id) WHERE status = 'pending'"
+
+# Напоминания клиентам о сеансе (reminders.ReminderScheduler): по строке на заявку
+# и смещение ("24h", "2h"), создаются в одной транзакции с заявкой
+REMINDERS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS reminders (
+    booking_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    lang TEXT,
+    due_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    sent_at TEXT,
+    PRIMARY KEY (booking_id, kind)
+);
+"""
+REMINDERS_INDEX_SQL = "CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders (due_at) WHERE status = 'pending'"
+
+# Сводки для /stats (stats.py): счётчики по дню сеанса, услуге, длительности и часу начала.
+# Обновляются в той же транзакции, что и заявка (вставка — writer, отмена — cancel_booking),
+# так что отчёт за месяц читает сотни строк сводки, а не всю таблицу bookings
+BOOKING_STATS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS booking_stats (
+    day TEXT NOT NULL,
+    service TEXT NOT NULL,
+    duration_min INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    booked INTEGER NOT NULL DEFAULT 0,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    revenue INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, service, duration_min, hour)
+) WITHOUT ROWID;
+"""
+# Идущий пересчёт сводок (не больше одной строки): заявки с id в (done_id, upto_id]
+# ещё не учтены — их отмену сводка не трогает, пересчёт прочтёт актуальный статус
+STATS_BACKFILL_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stats_backfill (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    done_id INTEGER NOT NULL,
+    upto_id INTEGER NOT NULL
+);
+"""
+
+# Индексы: история пользователя (keyset-пагинация), занятость по дате/времени, статусы
+BOOKINGS_INDEXES_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_bookings_user_id ON bookings (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_date_time ON bookings (date, time)",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings (status)",
+)
+
+INSERT_BOOKING_SQL = """
+INSERT INTO bookings (user_id, username, service, duration_min, price, comment, date, time, status, created_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_OUTBOX_SQL = "INSERT INTO outbox (chat_id, text, created_at) VALUES (?, ?, ?)"
+SELECT_OUTBOX_SQL = """
+SELECT id, chat_id, text, attempts
+FROM outbox
+WHERE status = 'pending' AND next_attempt_at <= ?
+ORDER BY next_attempt_at, id
+LIMIT ?
+"""
+OUTBOX_DELIVERED_SQL = "UPDATE outbox SET status = 'delivered', attempts = attempts + 1, delivered_at = ? WHERE id = ?"
+OUTBOX_RETRY_SQL = "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?"
+OUTBOX_DEFER_SQL = "UPDATE outbox SET next_attempt_at = ? WHERE id = ?"
+OUTBOX_FAILED_SQL = "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?"
+
+INSERT_REMINDER_SQL = """
+INSERT OR IGNORE INTO reminders (booking_id, kind, chat_id, lang, due_at)
+VALUES (?, ?, ?, ?, ?)
+"""
+# диапазон по частичному индексу: расписание на ближайшие часы для кучи планировщика
+SELECT_REMINDER_SCHEDULE_SQL = """
+SELECT due_at, booking_id, kind
+FROM reminders
+WHERE status = 'pending' AND due_at >= ? AND due_at < ?
+"""
+SELECT_DUE_REMINDERS_SQL = """
+SELECT r.booking_id, r.kind, r.chat_id, r.lang, r.attempts,
+       b.service, b.duration_min, b.date, b.time, b.status
+FROM reminders r
+JOIN bookings b ON b.id = r.booking_id
+WHERE r.status = 'pending' AND r.due_at <= ?
+ORDER BY r.due_at
+LIMIT ?
+"""
+REMINDER_SENT_SQL = "UPDATE reminders SET status = 'sent', attempts = attempts + 1, sent_at = ? WHERE booking_id = ? AND kind = ?"
+REMINDER_RETRY_SQL = "UPDATE reminders SET attempts = ?, due_at = ?, last_error = ? WHERE booking_id = ? AND kind = ?"
+REMINDER_FAILED_SQL = "UPDATE reminders SET status = 'failed', attempts = ?, last_error = ? WHERE booking_id = ? AND kind = ?"
+REMINDER_SKIPPED_SQL = "UPDATE reminders SET status = ? WHERE booking_id = ? AND kind = ?"
+CANCEL_REMINDERS_SQL = "UPDATE reminders SET status = 'cancelled' WHERE booking_id = ? AND status = 'pending'"
+
+UPSERT_STATS_SQL = """
+INSERT INTO booking_stats (day, service, duration_min, hour, booked, cancelled, revenue)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, service, duration_min, hour) DO UPDATE SET
+    booked = booked + excluded.booked,
+    cancelled = cancelled + excluded.cancelled,
+    revenue = revenue + excluded.revenue
+"""
+SELECT_STATS_SQL = """
+SELECT day, service, duration_min, hour, booked, cancelled, revenue
+FROM booking_stats
+WHERE day BETWEEN ? AND ?
+"""
+SELECT_STATS_BACKFILL_SQL = "SELECT done_id, upto_id FROM stats_backfill WHERE id = 1"
+# в пустой базе пересчитывать нечего — строка состояния не создаётся
+START_STATS_BACKFILL_SQL = """
+INSERT OR REPLACE INTO stats_backfill (id, done_id, upto_id)
+SELECT 1, 0, max_id FROM (SELECT MAX(id) AS max_id FROM bookings) WHERE max_id IS NOT NULL
+"""
+SELECT_STATS_SOURCE_SQL = """
+SELECT id, service, duration_min, price, date, time, status
+FROM bookings
+WHERE id > ? AND id <= ?
+ORDER BY id
+LIMIT ?
+"""
+
+# занятость дней пачки — проверка пересечений перед вставкой (несколько процессов)
+SELECT_BUSY_DAYS_SQL = """
+SELECT date, time, duration_min
+FROM bookings
+WHERE date IN ({placeholders}) AND COALESCE(status, 'submitted') != 'cancelled'
+"""
+
+LAST_BOOKING_ID_SQL = "SELECT seq FROM sqlite_sequence WHERE name = 'bookings'"
+
+SELECT_USER_BOOKINGS_SQL = """
+SELECT id, service, duration_min, price, date, time, status, created_at
+FROM bookings
+WHERE user_id = ? AND id < ?
+ORDER BY id DESC
+LIMIT ?
+"""
+
+# Больше любого rowid: первая страница истории
+MAX_BOOKING_ID = 2 ** 63 - 1
+
+
+# -----------------------------------------------------------------------------
+# Схема: версионные миграции
+# -----------------------------------------------------------------------------
+# Колонки, которых нет в самых старых базах (до них bookings хранила только пользователя)
+BOOKINGS_LEGACY_COLUMNS = (
+    ("service", "TEXT"),
+    ("duration_min", "INTEGER"),
+    ("price", "INTEGER"),
+    ("comment", "TEXT"),
+    ("date", "TEXT"),
+    ("time", "TEXT"),
+    ("status", "TEXT DEFAULT 'submitted'"),
+    ("created_at", "TEXT"),
+)
+
+
+async def _add_legacy_booking_columns(db: aiosqlite.Connection) -> None:
+    cur = await db.execute("PRAGMA table_info(bookings)")
+    existing = {row[1] for row in await cur.fetchall()}
+    for column, decl in BOOKINGS_LEGACY_COLUMNS:
+        if column not in existing:
+            await db.execute(f"ALTER TABLE bookings ADD COLUMN {column} {decl}")
+
+
+# Шаг миграции — SQL-выражение или async-функция от соединения.
+# Шаги идемпотентны (IF NOT EXISTS, проверка колонок): базы, созданные до появления
+# версий (user_version = 0), проходят все миграции без ошибок.
+MigrationStep = Union[str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+# Порядок не меняется, новые миграции — только в конец; номер версии = позиция в списке
+MIGRATIONS: List[Tuple[str, Tuple[MigrationStep, ...]]] = [
+    ("bookings", (BOOKINGS_TABLE_SQL, _add_legacy_booking_columns)),
+    ("bookings indexes", BOOKINGS_INDEXES_SQL),
+    ("fsm_data", (FSM_TABLE_SQL,)),
+    ("outbox", (OUTBOX_TABLE_SQL, OUTBOX_INDEX_SQL)),
+    ("reminders", (REMINDERS_TABLE_SQL, REMINDERS_INDEX_SQL)),
+    # сводки по уже существующим заявкам досчитает фоновый пересчёт (stats.StatsBackfill)
+    ("booking_stats", (BOOKING_STATS_TABLE_SQL, STATS_BACKFILL_TABLE_SQL, START_STATS_BACKFILL_SQL)),
 ]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def _schema_version(db: aiosqlite.Connection) -> int:
+    cur = await db.execute("PRAGMA user_version")
+    row = await cur.fetchone()
+    return row[0]
 
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(BOOKINGS_TABLE_SQL)
-        await db.commit()
+    """Доводит схему до SCHEMA_VERSION; на актуальной базе — одно чтение PRAGMA user_version."""
+    async with pool.acquire(write=True) as db:
+        version = await _schema_version(db)
+        if version >= SCHEMA_VERSION:
+            if version > SCHEMA_VERSION:
+                logger.warning("Database schema v%s is newer than this code (v%s)", version, SCHEMA_VERSION)
+            return
+        # все недостающие миграции и новая версия — одной транзакцией: база либо
+        # целиком на новой схеме, либо не тронута
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # пока ждали блокировку, схему мог обновить другой процесс
+            version = await _schema_version(db)
+            for number in range(version + 1, SCHEMA_VERSION + 1):
+                name, steps = MIGRATIONS[number - 1]
+                for step in steps:
+                    if isinstance(step, str):
+                        await db.execute(step)
+                    else:
+                        await step(db)
+                logger.info("Applied migration %s: %s", number, name)
+            # PRAGMA не принимает параметры; значение — наша константа
+            await db.execute(f"PRAGMA user_version = {max(version, SCHEMA_VERSION)}")
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
 
-        # Пытаемся безопасно добавить колонки, если их нет (игнорируем ошибки)
-        cur = await db.execute("PRAGMA table_info(bookings)")
-        rows = await cur.fetchall()
-        existing = {r[1] for r in rows}
-        cols_to_try = {
-            "service": "ALTER TABLE bookings ADD COLUMN service TEXT",
-            "duration_min": "ALTER TABLE bookings ADD COLUMN duration_min INTEGER",
-            "price": "ALTER TABLE bookings ADD COLUMN price INTEGER",
-            "comment": "ALTER TABLE bookings ADD COLUMN comment TEXT",
-            "date": "ALTER TABLE bookings ADD COLUMN date TEXT",
-            "time": "ALTER TABLE bookings ADD COLUMN time TEXT",
-            "status": "ALTER TABLE bookings ADD COLUMN status TEXT",
-            "created_at": "ALTER TABLE bookings ADD COLUMN created_at TEXT"
-        }
-        for col, sql in cols_to_try.items():
-            if col not in existing:
+
+# -----------------------------------------------------------------------------
+# Групповая запись заявок
+# -----------------------------------------------------------------------------
+class SlotConflictError(Exception):
+    """Время заявки пересекается с уже сохранённой (её записал другой процесс)."""
+
+
+def _interval(time_str: str, duration_min: Optional[int]) -> Optional[Tuple[int, int]]:
+    # (начало, конец) в минутах от полуночи
+    try:
+        h, m = time_str.split(":", 1)
+        start = int(h) * 60 + int(m)
+    except (AttributeError, ValueError):
+        return None
+    return start, start + (duration_min or 60)
+
+
+@dataclass(eq=False)
+class BookingGroup:
+    """
+    Заявки, которые должны попасть в базу атомарно (например, вся корзина),
+    вместе с уведомлениями о них для outbox и напоминаниями клиенту.
+    reminders — (номер строки в rows, kind, due_at, lang): id заявки известен только после вставки.
+    """
+    rows: List[Tuple[Any, ...]]
+    outbox: List[Tuple[Any, ...]] = field(default_factory=list)
+    reminders: List[Tuple[int, str, float, Optional[str]]] = field(default_factory=list)
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class BookingWriter:
+    """
+    Принимает вставки заявок через asyncio-очередь и пишет их пачками: всё, что
+    накопилось за flush_interval секунд (или max_batch строк), уходит одной
+    транзакцией — один fsync на пачку вместо одного на заявку. Обычно пачка
+    вставляется одним executemany; если он падает, пачка повторяется по группам,
+    каждая в своём SAVEPOINT, так что ошибка одной группы не откатывает чужие.
+    """
+
+    def __init__(self, pool: ConnectionPool, flush_interval: float = 0.005, max_batch: int = 200):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # проверять пересечения с сохранёнными заявками в транзакции записи: нужно, когда
+        # пишут несколько процессов и availability одного не видит брони других
+        self.check_conflicts = False
+        self.queue: "asyncio.Queue[BookingGroup]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # взводится после коммита пачки с уведомлениями — будит доставку outbox
+        self.outbox_event = asyncio.Event()
+        # вызываются после коммита со списком новых напоминаний [(due_at, booking_id, kind)]
+        self.reminder_listeners: List[Callable[[List[Tuple[float, int, str]]], None]] = []
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Дописывает всё, что уже в очереди, и останавливает фоновую задачу.
+        Не успели за timeout (например, база занята другим процессом) — незакоммиченная
+        пачка откатится при закрытии соединения, ждущие заявки получат ошибку.
+        """
+        if self._task is None:
+            return
+        join = asyncio.ensure_future(self.queue.join())
+        await asyncio.wait({join}, timeout=timeout)
+        if not join.done():
+            join.cancel()
+            logger.warning("Booking writer not drained on shutdown, %d groups not written", self.queue.qsize())
+            # иначе закрытие соединения ждало бы, пока запрос дождётся busy_timeout
+            await pool.interrupt_write()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        while not self.queue.empty():
+            group = self.queue.get_nowait()
+            self.queue.task_done()
+            if not group.future.done():
+                group.future.set_exception(RuntimeError("booking writer stopped"))
+
+    async def submit(
+        self,
+        rows: List[Tuple[Any, ...]],
+        outbox: Optional[List[Tuple[Any, ...]]] = None,
+        reminders: Optional[List[Tuple[int, str, float, Optional[str]]]] = None,
+    ) -> List[int]:
+        """
+        Ставит группу строк (и строк outbox, и напоминаний) в очередь и ждёт коммита.
+        Возвращает id вставленных заявок.
+        """
+        self.start()
+        group = BookingGroup(rows=rows, outbox=outbox or [], reminders=reminders or [])
+        self.queue.put_nowait(group)
+        return await group.future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0].rows)
+            deadline = loop.time() + self.flush_interval
+            while size < self.max_batch:
                 try:
-                    await db.execute(sql)
-                except Exception:
-                    # возможны ошибки при повторной миграции — игнорируем
-                    pass
-        await db.commit()
+                    # то, что уже в очереди, забираем без ожидания: под нагрузкой
+                    # wait_for может истечь раньше, чем готовый get() успеет выполниться
+                    group = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        group = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                batch.append(group)
+                size += len(group.rows)
+            try:
+                await self._write(batch)
+            except asyncio.CancelledError:
+                # остановка по таймауту посреди записи — пачка не закоммичена
+                for group in batch:
+                    if not group.future.done():
+                        group.future.set_exception(RuntimeError("booking writer stopped"))
+                raise
+            except Exception as e:
+                logger.exception("Booking batch of %d rows failed", size)
+                for group in batch:
+                    if not group.future.done():
+                        group.future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write(self, batch: List[BookingGroup]) -> None:
+        async with self.pool.acquire(write=True) as db:
+            # IMMEDIATE: блокировка записи берётся сразу, и проверка пересечений
+            # видит всё, что закоммитили другие процессы до вставки
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                try:
+                    results = await self._insert_checked(db, batch, self._insert_batch)
+                except sqlite3.DatabaseError:
+                    # какая-то группа не вставилась — повторяем по группам, с изоляцией ошибок
+                    logger.warning("Bulk insert of %d groups failed, retrying group by group", len(batch))
+                    await db.rollback()
+                    await db.execute("BEGIN IMMEDIATE")
+                    results = await self._insert_checked(db, batch, self._insert_groups)
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+        if any(group.outbox for group in batch):
+            self.outbox_event.set()
+        scheduled = [
+            (due_at, booking_id, kind)
+            for group, result in results
+            if not isinstance(result, Exception)
+            for booking_id, kind, _, _, due_at in _reminder_rows(group, result)
+        ]
+        if scheduled:
+            for listener in self.reminder_listeners:
+                listener(scheduled)
+        # futures завершаем только после коммита
+        for group, result in results:
+            if group.future.done():
+                continue
+            if isinstance(result, Exception):
+                group.future.set_exception(result)
+            else:
+                group.future.set_result(result)
+
+    async def _insert_checked(self, db: aiosqlite.Connection, batch: List[BookingGroup], insert) -> List[Tuple[BookingGroup, Any]]:
+        """insert(db, группы) для групп без пересечений; для остальных — SlotConflictError."""
+        conflicts = await self._find_conflicts(db, batch) if self.check_conflicts else []
+        if not conflicts:
+            return await insert(db, batch)
+        accepted = [group for group in batch if group not in conflicts]
+        results = await insert(db, accepted) if accepted else []
+        for group in conflicts:
+            results.append((group, SlotConflictError("slot is already booked")))
+        return results
+
+    async def _find_conflicts(self, db: aiosqlite.Connection, batch: List[BookingGroup]) -> List[BookingGroup]:
+        """Группы, чьи заявки пересекаются с сохранёнными или с более ранними группами пачки."""
+        dates = list(dict.fromkeys(row[6] for group in batch for row in group.rows))
+        cur = await db.execute(SELECT_BUSY_DAYS_SQL.format(placeholders=",".join("?" * len(dates))), dates)
+        busy: Dict[str, List[Tuple[int, int]]] = {}
+        for date, time_str, duration in await cur.fetchall():
+            interval = _interval(time_str, duration)
+            if interval:
+                busy.setdefault(date, []).append(interval)
+        conflicts: List[BookingGroup] = []
+        for group in batch:
+            # строка INSERT_BOOKING_SQL: duration_min — [3], date — [6], time — [7]
+            intervals = [(row[6], _interval(row[7], row[3])) for row in group.rows]
+            if any(
+                interval and any(s < interval[1] and interval[0] < e for s, e in busy.get(date, ()))
+                for date, interval in intervals
+            ):
+                conflicts.append(group)
+                continue
+            for date, interval in intervals:
+                if interval:
+                    busy.setdefault(date, []).append(interval)
+        return conflicts
+
+    async def _insert_batch(self, db: aiosqlite.Connection, batch: List[BookingGroup]) -> List[Tuple[BookingGroup, Any]]:
+        """
+        Вся пачка одним executemany: число обращений к потоку SQLite не зависит
+        от размера пачки (под нагрузкой каждое из них ждёт свободного event loop).
+        Пишет только writer, поэтому id новых строк идут подряд до seq из sqlite_sequence.
+        """
+        rows = [row for group in batch for row in group.rows]
+        await db.executemany(INSERT_BOOKING_SQL, rows)
+        cur = await db.execute(LAST_BOOKING_ID_SQL)
+        (last_id,) = await cur.fetchone()
+        outbox = [row for group in batch for row in group.outbox]
+        if outbox:
+            await db.executemany(INSERT_OUTBOX_SQL, outbox)
+        next_id = last_id - len(rows) + 1
+        results: List[Tuple[BookingGroup, Any]] = []
+        reminders: List[Tuple[Any, ...]] = []
+        for group in batch:
+            ids = list(range(next_id, next_id + len(group.rows)))
+            results.append((group, ids))
+            reminders.extend(_reminder_rows(group, ids))
+            next_id += len(group.rows)
+        if reminders:
+            await db.executemany(INSERT_REMINDER_SQL, reminders)
+        await db.executemany(UPSERT_STATS_SQL, _stats_deltas(_stats_source(row) for row in rows))
+        return results
+
+    async def _insert_groups(self, db: aiosqlite.Connection, batch: List[BookingGroup]) -> List[Tuple[BookingGroup, Any]]:
+        results: List[Tuple[BookingGroup, Any]] = []
+        for group in batch:
+            await db.execute("SAVEPOINT booking_group")
+            try:
+                ids = []
+                for row in group.rows:
+                    cur = await db.execute(INSERT_BOOKING_SQL, row)
+                    ids.append(cur.lastrowid)
+                if group.outbox:
+                    await db.executemany(INSERT_OUTBOX_SQL, group.outbox)
+                if group.reminders:
+                    await db.executemany(INSERT_REMINDER_SQL, _reminder_rows(group, ids))
+                await db.executemany(UPSERT_STATS_SQL, _stats_deltas(_stats_source(row) for row in group.rows))
+                await db.execute("RELEASE booking_group")
+                results.append((group, ids))
+            except Exception as e:
+                await db.execute("ROLLBACK TO booking_group")
+                await db.execute("RELEASE booking_group")
+                results.append((group, e))
+        return results
+
+
+def _reminder_rows(group: BookingGroup, ids: List[int]) -> List[Tuple[Any, ...]]:
+    # (booking_id, kind, chat_id, lang, due_at); chat_id — user_id заявки (личный чат)
+    return [(ids[index], kind, group.rows[index][0], lang, due_at) for index, kind, due_at, lang in group.reminders]
+
+
+def _stats_source(row: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    # строка INSERT_BOOKING_SQL -> (service, duration_min, price, date, time, status)
+    return row[2], row[3], row[4], row[6], row[7], row[8]
+
+
+def _stats_key(service: Optional[str], duration_min: Optional[int], date: Optional[str], time_str: Optional[str]) -> Tuple[str, str, int, int]:
+    # (day, service, duration_min, hour); час -1 — время не разобрать (старые заявки)
+    interval = _interval(time_str, duration_min)
+    return date or "", service or "", duration_min or 0, interval[0] // 60 if interval else -1
+
+
+def _stats_deltas(rows: Iterable[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+    """(service, duration_min, price, date, time, status) -> приращения для UPSERT_STATS_SQL, по строке на ключ."""
+    deltas: Dict[Tuple[str, str, int, int], List[int]] = {}
+    for service, duration_min, price, date, time_str, status in rows:
+        delta = deltas.setdefault(_stats_key(service, duration_min, date, time_str), [0, 0, 0])
+        delta[0] += 1
+        if status == "cancelled":
+            delta[1] += 1
+        else:
+            delta[2] += price or 0
+    return [(*key, *delta) for key, delta in deltas.items()]
+
+
+writer = BookingWriter(
+    pool,
+    flush_interval=float(os.getenv("DB_FLUSH_INTERVAL", "0.005")),
+    max_batch=int(os.getenv("DB_FLUSH_MAX_ROWS", "200")),
+)
+
+
+def _booking_row(item: Dict[str, Any], created_at: str) -> Tuple[Any, ...]:
+    return (
+        item["user_id"],
+        item.get("username", ""),
+        item["service"],
+        item["duration_min"],
+        item["price"],
+        item.get("comment", ""),
+        item["date"],
+        item["time"],
+        item.get("status", "submitted"),
+        created_at,
+    )
 
 
 async def add_booking(
@@ -72,24 +683,252 @@ async def add_booking(
     time: str,
     status: str = "submitted",
 ):
+    ids = await add_bookings([{
+        "user_id": user_id,
+        "username": username,
+        "service": service,
+        "duration_min": duration_min,
+        "price": price,
+        "comment": comment,
+        "date": date,
+        "time": time,
+        "status": status,
+    }])
+    return ids[0]
+
+
+async def add_bookings(
+    items: Iterable[Dict[str, Any]],
+    notify: Iterable[Tuple[int, str]] = (),
+    reminders: Iterable[Tuple[int, str, float, Optional[str]]] = (),
+) -> List[int]:
+    """
+    Атомарно сохраняет несколько заявок (оформление корзины).
+    items — словари с ключами как у add_booking;
+    notify — пары (chat_id, text) для outbox, пишутся в той же транзакции;
+    reminders — (номер заявки в items, kind, due_at, lang) — напоминания клиенту.
+    """
     created_at = datetime.utcnow().isoformat() + "Z"
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO bookings (user_id, username, service, duration_min, price, comment, date, time, status, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, username, service, duration_min, price, comment, date, time, status, created_at)
+    rows = [_booking_row(item, created_at) for item in items]
+    if not rows:
+        return []
+    outbox = [(chat_id, text, created_at) for chat_id, text in notify]
+    return await writer.submit(rows, outbox, list(reminders))
+
+
+async def cancel_booking(booking_id: int) -> Optional[Tuple[str, str, int]]:
+    """Отменяет заявку. Возвращает (date, time, duration_min) или None, если отменять нечего."""
+    async with pool.acquire(write=True) as db:
+        # IMMEDIATE: состояние пересчёта сводок не должно поменяться до коммита
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = await db.execute(
+                "SELECT date, time, duration_min, status, service, price FROM bookings WHERE id = ?", (booking_id,)
+            )
+            row = await cur.fetchone()
+            if not row or row[3] == "cancelled":
+                await db.rollback()
+                return None
+            date, time_str, duration_min, _, service, price = row
+            await db.execute("UPDATE bookings SET status = 'cancelled' WHERE id = ?", (booking_id,))
+            await db.execute(CANCEL_REMINDERS_SQL, (booking_id,))
+            cur = await db.execute(SELECT_STATS_BACKFILL_SQL)
+            backfill = await cur.fetchone()
+            if backfill is None or not backfill[0] < booking_id <= backfill[1]:
+                await db.execute(UPSERT_STATS_SQL, (*_stats_key(service, duration_min, date, time_str), 0, 1, -(price or 0)))
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    return date, time_str, duration_min or 60
+
+
+async def get_bookings_by_user(user_id: int, before_id: Optional[int] = None, limit: int = 10):
+    """
+    Страница истории заявок пользователя, от новых к старым.
+    before_id — id последней заявки предыдущей страницы (None — первая страница).
+    Keyset по индексу (user_id, id): стоимость страницы не зависит от длины истории.
+    """
+    async with pool.acquire() as db:
+        cur = await db.execute(
+            SELECT_USER_BOOKINGS_SQL,
+            (user_id, before_id if before_id is not None else MAX_BOOKING_ID, limit),
         )
+        return await cur.fetchall()
+
+
+# -----------------------------------------------------------------------------
+# Выгрузка (export.py)
+# -----------------------------------------------------------------------------
+EXPORT_COLUMNS = (
+    "id", "user_id", "username", "service", "duration_min", "price",
+    "comment", "date", "time", "status", "created_at",
+)
+
+
+async def iter_bookings(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    service: Optional[str] = None,
+    chunk_size: int = 1000,
+) -> AsyncIterator[List[Tuple[Any, ...]]]:
+    """
+    Заявки (колонки EXPORT_COLUMNS) по возрастанию id, кусками по chunk_size строк.
+    Keyset по id: соединение берётся из пула на один кусок, поэтому долгая выгрузка
+    не держит читающую транзакцию (WAL не растёт) и не занимает читателя надолго.
+    """
+    conditions = ["id > ?"]
+    params: List[Any] = []
+    if date_from:
+        conditions.append("date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("date <= ?")
+        params.append(date_to)
+    if status:
+        conditions.append("COALESCE(status, 'submitted') = ?")
+        params.append(status)
+    if service:
+        conditions.append("service = ?")
+        params.append(service)
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM bookings WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+    last_id = 0
+    while True:
+        async with pool.acquire() as db:
+            cur = await db.execute(sql, (last_id, *params, chunk_size))
+            rows = await cur.fetchall()
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+# -----------------------------------------------------------------------------
+# Сводки (stats.py)
+# -----------------------------------------------------------------------------
+async def fetch_stats(since_day: str, until_day: str) -> Tuple[List[Tuple[Any, ...]], Optional[Tuple[int, int]]]:
+    """
+    Строки сводки (day, service, duration_min, hour, booked, cancelled, revenue) с дня since_day
+    по until_day включительно и состояние пересчёта (done_id, upto_id) — None, если сводка полная.
+    """
+    async with pool.acquire() as db:
+        cur = await db.execute(SELECT_STATS_SQL, (since_day, until_day))
+        rows = await cur.fetchall()
+        cur = await db.execute(SELECT_STATS_BACKFILL_SQL)
+        return rows, await cur.fetchone()
+
+
+async def start_stats_backfill() -> None:
+    """Обнуляет сводки и ставит пересчёт всех заявок; заявки новее текущих учитываются сразу."""
+    async with pool.acquire(write=True) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            await db.execute("DELETE FROM booking_stats")
+            await db.execute(START_STATS_BACKFILL_SQL)
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+
+async def stats_backfill_step(batch_size: int = 5000) -> Optional[Tuple[int, int]]:
+    """
+    Учитывает в сводках следующую пачку заявок (одна короткая транзакция записи).
+    Возвращает (done_id, upto_id) после шага; None — пересчёт не нужен или закончен.
+    """
+    async with pool.acquire(write=True) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = await db.execute(SELECT_STATS_BACKFILL_SQL)
+            state = await cur.fetchone()
+            if state is None:
+                await db.rollback()
+                return None
+            done_id, upto_id = state
+            cur = await db.execute(SELECT_STATS_SOURCE_SQL, (done_id, upto_id, batch_size))
+            rows = await cur.fetchall()
+            if rows:
+                await db.executemany(UPSERT_STATS_SQL, _stats_deltas(row[1:] for row in rows))
+            if len(rows) < batch_size:
+                await db.execute("DELETE FROM stats_backfill")
+                state = None
+            else:
+                state = (rows[-1][0], upto_id)
+                await db.execute("UPDATE stats_backfill SET done_id = ? WHERE id = 1", (state[0],))
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    return state
+
+
+# -----------------------------------------------------------------------------
+# Outbox
+# -----------------------------------------------------------------------------
+async def fetch_outbox(now: float, limit: int = 100) -> List[Tuple[int, int, str, int]]:
+    """Недоставленные уведомления, чья очередь подошла: (id, chat_id, text, attempts)."""
+    async with pool.acquire() as db:
+        cur = await db.execute(SELECT_OUTBOX_SQL, (now, limit))
+        return await cur.fetchall()
+
+
+async def update_outbox(
+    delivered: Iterable[int] = (),
+    retry: Iterable[Tuple[int, float, str, int]] = (),
+    failed: Iterable[Tuple[int, str, int]] = (),
+    deferred: Iterable[Tuple[float, int]] = (),
+) -> None:
+    """
+    Итоги доставки одной транзакцией.
+    retry — (attempts, next_attempt_at, error, id), failed — (attempts, error, id),
+    deferred — (next_attempt_at, id): отложены без попытки (digest-режим).
+    """
+    delivered_at = datetime.utcnow().isoformat() + "Z"
+    async with pool.acquire(write=True) as db:
+        await db.executemany(OUTBOX_DELIVERED_SQL, [(delivered_at, i) for i in delivered])
+        await db.executemany(OUTBOX_RETRY_SQL, list(retry))
+        await db.executemany(OUTBOX_FAILED_SQL, list(failed))
+        await db.executemany(OUTBOX_DEFER_SQL, list(deferred))
         await db.commit()
 
 
-async def get_bookings_by_user(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT id, service, duration_min, price, date, time, status, created_at
-            FROM bookings
-            WHERE user_id = ?
-            ORDER BY id DESC
-        """, (user_id,))
+# -----------------------------------------------------------------------------
+# Напоминания
+# -----------------------------------------------------------------------------
+async def fetch_reminder_schedule(start: float, end: float) -> List[Tuple[float, int, str]]:
+    """Ожидающие напоминания со сроком в [start, end): (due_at, booking_id, kind)."""
+    async with pool.acquire() as db:
+        cur = await db.execute(SELECT_REMINDER_SCHEDULE_SQL, (start, end))
+        return await cur.fetchall()
+
+
+async def fetch_due_reminders(now: float, limit: int = 100) -> List[Tuple[Any, ...]]:
+    """
+    Напоминания, срок которых наступил, вместе с заявкой:
+    (booking_id, kind, chat_id, lang, attempts, service, duration_min, date, time, booking_status).
+    """
+    async with pool.acquire() as db:
+        cur = await db.execute(SELECT_DUE_REMINDERS_SQL, (now, limit))
         return await cur.fetchall()
+
+
+async def update_reminders(
+    sent: Iterable[Tuple[int, str]] = (),
+    retry: Iterable[Tuple[int, float, str, int, str]] = (),
+    failed: Iterable[Tuple[int, str, int, str]] = (),
+    skipped: Iterable[Tuple[str, int, str]] = (),
+) -> None:
+    """
+    Итоги отправки одной транзакцией. sent — (booking_id, kind);
+    retry — (attempts, due_at, error, booking_id, kind), failed — (attempts, error, booking_id, kind),
+    skipped — (status, booking_id, kind): заявку отменили или сеанс уже прошёл.
+    """
+    sent_at = datetime.utcnow().isoformat() + "Z"
+    async with pool.acquire(write=True) as db:
+        await db.executemany(REMINDER_SENT_SQL, [(sent_at, booking_id, kind) for booking_id, kind in sent])
+        await db.executemany(REMINDER_RETRY_SQL, list(retry))
+        await db.executemany(REMINDER_FAILED_SQL, list(failed))
+        await db.executemany(REMINDER_SKIPPED_SQL, list(skipped))
+        await db.commit()
@@ -0,0 +1,156 @@
+# export.py
+"""
+Выгрузка заявок из bot.db в CSV или JSONL (со сжатием gzip).
+
+Заявки читаются кусками по EXPORT_CHUNK_SIZE строк (db.iter_bookings) и сразу
+пишутся в gzip-поток на диск, поэтому память не зависит от размера таблицы.
+Фильтры: диапазон дат сеанса, статус, услуга. В CSV значения, начинающиеся
+с "=", "+", "-", "@", табуляции или перевода каретки, предваряются апострофом,
+чтобы редактор таблиц не счёл их формулой.
+
+В боте — команда администратора, файл приходит документом:
+    /export jsonl 2026-01-01 2026-01-31 status=submitted service=classic
+
+Из консоли (рядом с bot.db или с DB_PATH):
+    python export.py --format csv --from 2026-01-01 --status cancelled -o cancelled.csv.gz
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, BinaryIO, Optional, Sequence, Tuple
+
+import db
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+FORMATS = ("csv", "jsonl")
+# с этих символов табличные редакторы начинают формулу
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+EXPORT_USAGE = "/export [csv|jsonl] [from YYYY-MM-DD] [to YYYY-MM-DD] [status=…] [service=…]"
+
+
+@dataclass(frozen=True)
+class ExportFilter:
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    status: Optional[str] = None
+    service: Optional[str] = None
+
+
+def _iso_date(value: str) -> str:
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"bad date {value!r}, expected YYYY-MM-DD") from None
+
+
+def parse_export_args(args: str) -> Tuple[str, ExportFilter]:
+    """
+    "jsonl 2026-01-01 2026-01-31 status=cancelled service=classic" -> ("jsonl", ExportFilter(...)).
+    Первая дата — начало диапазона, вторая — конец; всё необязательно. ValueError — непонятный аргумент.
+    """
+    fmt = "csv"
+    dates = []
+    options = {}
+    for token in args.split():
+        if token.lower() in FORMATS:
+            fmt = token.lower()
+        elif "=" in token:
+            key, _, value = token.partition("=")
+            if key not in ("status", "service") or not value:
+                raise ValueError(f"unknown filter {token!r}")
+            options[key] = value
+        else:
+            dates.append(_iso_date(token))
+    if len(dates) > 2:
+        raise ValueError("at most two dates: from and to")
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    return fmt, ExportFilter(date_from, date_to, options.get("status"), options.get("service"))
+
+
+def _csv_safe(row: Sequence[Any]) -> Tuple[Any, ...]:
+    """Имя пользователя и комментарий вводит клиент: "=HYPERLINK(...)" не должен стать формулой."""
+    return tuple("'" + v if isinstance(v, str) and v.startswith(FORMULA_PREFIXES) else v for v in row)
+
+
+def export_filename(fmt: str, compress: bool = True) -> str:
+    return f"bookings-{datetime.now():%Y%m%d-%H%M%S}.{fmt}" + (".gz" if compress else "")
+
+
+async def write_export(
+    out: BinaryIO,
+    fmt: str,
+    flt: ExportFilter = ExportFilter(),
+    compress: bool = True,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> int:
+    """Пишет заявки в out (out не закрывается). Возвращает число строк."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported export format {fmt!r}")
+    stream = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6) if compress else out
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    writer = csv.writer(text) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(db.EXPORT_COLUMNS)
+    count = 0
+    async for rows in db.iter_bookings(flt.date_from, flt.date_to, flt.status, flt.service, chunk_size):
+        if writer is not None:
+            writer.writerows(map(_csv_safe, rows))
+        else:
+            text.write("".join(
+                json.dumps(dict(zip(db.EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows
+            ))
+        count += len(rows)
+    text.flush()
+    # out остаётся открытым: detach вместо close, GzipFile.close дописывает только хвост gzip
+    text.detach()
+    if compress:
+        stream.close()
+    return count
+
+
+async def export_to_file(path: str, fmt: str, flt: ExportFilter = ExportFilter(), compress: bool = True) -> int:
+    with open(path, "wb") as f:
+        return await write_export(f, fmt, flt, compress)
+
+
+def _date_arg(value: str) -> str:
+    try:
+        return _iso_date(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="Export bookings from bot.db as CSV or JSONL")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--from", dest="date_from", type=_date_arg, help="first session date, YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", type=_date_arg, help="last session date, YYYY-MM-DD")
+    parser.add_argument("--status")
+    parser.add_argument("--service")
+    parser.add_argument("--no-gzip", dest="compress", action="store_false")
+    parser.add_argument("-o", "--output", help="output file (default: bookings-<timestamp>.<format>[.gz])")
+    args = parser.parse_args()
+    path = args.output or export_filename(args.format, args.compress)
+    flt = ExportFilter(args.date_from, args.date_to, args.status, args.service)
+
+    async def run() -> int:
+        try:
+            return await export_to_file(path, args.format, flt, args.compress)
+        finally:
+            await db.close_db()
+
+    count = asyncio.run(run())
+    print(f"{count} bookings -> {path} ({os.path.getsize(path) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    cli()
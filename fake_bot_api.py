@@ -0,0 +1,127 @@
+# fake_bot_api.py
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Отвечает на POST /bot<token>/<method> правдоподобными результатами
+(Message для send*/edit*, True для остального) и считает вызовы по методам.
+Бот подключается к ней через TELEGRAM_API_URL=http://127.0.0.1:<port>.
+
+Умеет имитировать сеть и лимиты Telegram: latency/jitter — задержка ответа,
+flood_ratio — доля send*/edit*, на которые отвечаем 429 Too Many Requests.
+Последнее сообщение в каждом чате сохраняется в last (по нему нагрузочный
+тест «нажимает» кнопки).
+"""
+
+import asyncio
+import itertools
+import random
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+# Методы, которые возвращают Message
+MESSAGE_METHODS = {
+    "sendMessage",
+    "sendPhoto",
+    "sendDocument",
+    "editMessageText",
+    "editMessageCaption",
+    "editMessageMedia",
+    "editMessageReplyMarkup",
+}
+PHOTO_METHODS = {"sendPhoto", "editMessageMedia"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, flood_ratio: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_ratio = flood_ratio
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.flooded: Counter = Counter()
+        # chat_id -> последнее отправленное/отредактированное сообщение
+        self.last: Dict[int, Dict[str, Any]] = {}
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        # Telegram принимает фото до 10 МБ — лимит aiohttp по умолчанию (1 МБ) мал
+        self.app = web.Application(client_max_size=50 * 1024 * 1024)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self, port: int = 0) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        # port=0 — берём тот, что выдала ОС
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        return {k: v for k, v in form.items() if isinstance(v, str)}
+
+    def _photo(self) -> list:
+        n = next(self._file_ids)
+        return [{"file_id": f"fake-file-{n}", "file_unique_id": f"fake-unique-{n}", "width": 1280, "height": 853}]
+
+    def result_for(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+        if method == "getUpdates":
+            return []
+        if method not in MESSAGE_METHODS:
+            return True
+        chat_id = int(params.get("chat_id") or 0)
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        message: Dict[str, Any] = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        if method in PHOTO_METHODS or method == "editMessageCaption":
+            message["photo"] = self._photo()
+            message["caption"] = params.get("caption", "")
+        elif method == "sendDocument":
+            message["document"] = {"file_id": "fake-doc", "file_unique_id": "fake-doc"}
+        else:
+            message["text"] = params.get("text", "")
+        if params.get("reply_markup"):
+            markup = params["reply_markup"]
+            message["reply_markup"] = json.loads(markup) if isinstance(markup, str) else markup
+        self.last[chat_id] = message
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if method in MESSAGE_METHODS and self.flood_ratio and random.random() < self.flood_ratio:
+            self.flooded[method] += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+        return web.json_response({"ok": True, "result": self.result_for(method, params)})
@@ -0,0 +1,165 @@
+# fsm_storage.py
+"""
+Персистентное FSM-хранилище aiogram поверх bot.db.
+
+Состояние и данные пользователя держатся в горячем in-memory кэше; изменения
+помечаются «грязными» и сбрасываются в SQLite одной транзакцией через
+flush_delay секунд. Несколько update_data/set_state одного хендлера (и разных
+пользователей за это окно) превращаются в одну запись.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import db
+from metrics import FSM_SECONDS
+
+logger = logging.getLogger("booking-bot.fsm")
+
+
+SELECT_SQL = "SELECT state, data FROM fsm_data WHERE key = ?"
+UPSERT_SQL = """
+INSERT INTO fsm_data (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+"""
+DELETE_SQL = "DELETE FROM fsm_data WHERE key = ?"
+
+
+class _Record:
+    __slots__ = ("state", "data")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, pool: Optional[db.ConnectionPool] = None, flush_delay: float = 0.05, max_cached: int = 10000):
+        self.pool = pool or db.pool
+        self.flush_delay = flush_delay
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self._flushing = False
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    # -------------------------------------------------------------------------
+    # Кэш
+    # -------------------------------------------------------------------------
+    async def _record(self, k: str) -> _Record:
+        rec = self._cache.get(k)
+        if rec is not None:
+            self._cache.move_to_end(k)
+            return rec
+        async with self.pool.acquire() as conn:
+            cur = await conn.execute(SELECT_SQL, (k,))
+            row = await cur.fetchone()
+        loaded = _Record(row[0], json.loads(row[1]) if row and row[1] else {}) if row else _Record(None, {})
+        # пока ждали SELECT, запись могла появиться из параллельного хендлера
+        rec = self._cache.setdefault(k, loaded)
+        self._evict()
+        return rec
+
+    def _evict(self) -> None:
+        # выбрасываем самые старые «чистые» записи
+        while len(self._cache) > self.max_cached:
+            for k in self._cache:
+                if k not in self._dirty:
+                    del self._cache[k]
+                    break
+            else:
+                return
+
+    def _mark_dirty(self, k: str) -> None:
+        self._dirty.add(k)
+        # пока идёт сброс, новые изменения копятся и уходят следующей пачкой
+        if self._flush_handle is None and not self._flushing:
+            self._schedule_flush(self.flush_delay)
+
+    def _schedule_flush(self, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()))
+
+    # -------------------------------------------------------------------------
+    # BaseStorage
+    # -------------------------------------------------------------------------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self._key(key)
+        rec = await self._record(k)
+        rec.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(k)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self._key(key)
+        rec = await self._record(k)
+        rec.data = data.copy()
+        self._mark_dirty(k)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(self._key(key))).data.copy()
+
+    async def flush(self) -> None:
+        """Сбрасывает все грязные записи одной транзакцией."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._flush_lock:
+            self._flushing = True
+            try:
+                await self._flush_dirty()
+            finally:
+                self._flushing = False
+        # накопилось за время записи — следующая пачка
+        if self._dirty and self._flush_handle is None:
+            self._schedule_flush(self.flush_delay)
+
+    async def _flush_dirty(self) -> None:
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        now = datetime.utcnow().isoformat() + "Z"
+        upserts = []
+        deletes = []
+        for k in keys:
+            rec = self._cache.get(k)
+            if rec is None:
+                continue
+            if rec.state is None and not rec.data:
+                deletes.append((k,))
+            else:
+                upserts.append((k, rec.state, json.dumps(rec.data, ensure_ascii=False), now))
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire(write=True) as conn:
+                if upserts:
+                    await conn.executemany(UPSERT_SQL, upserts)
+                if deletes:
+                    await conn.executemany(DELETE_SQL, deletes)
+                await conn.commit()
+            FSM_SECONDS.observe(time.perf_counter() - started, "flush")
+        except Exception:
+            logger.exception("Failed to flush %d FSM records, will retry", len(keys))
+            self._dirty |= keys
+            if self._flush_handle is None:
+                self._schedule_flush(1.0)
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        await self.flush()
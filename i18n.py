@@ -0,0 +1,194 @@
+# i18n.py
+"""
+Каталог переводов: locales/<lang>.json → плоские таблицы строк.
+
+Формат файла локали:
+    {
+      "_meta": {"name": "🇬🇧 English", "fallback": "ru", "order": 1},
+      "text": {"choose_service": "Choose a massage type:", ...},
+      "services": {"classic": {"title": "...", "desc": "..."}, ...},
+      "durations": {"30": "30 min", ...}
+    }
+
+При загрузке всё сворачивается в один dict на язык с ключами
+"choose_service", "svc.classic.title", "dur.30" и т.д.; недостающие ключи
+заполняются по цепочке fallback (de → en → ru), так что поиск в хендлерах —
+один TEXT[lang][key] без ветвлений. Плейсхолдеры — str.format ("{username}").
+
+Перезагрузка подменяет таблицы целиком: ссылка catalog.tables остаётся той же,
+а битый файл не трогает уже загруженные переводы.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger("booking-bot.i18n")
+
+LOCALES_DIR = os.path.join(os.path.dirname(__file__), "locales")
+
+
+class CatalogError(Exception):
+    """Файлы локалей не удалось собрать в каталог."""
+
+
+def _placeholders(template: str) -> Set[str]:
+    try:
+        return {field for _, field, _, _ in Formatter().parse(template) if field}
+    except ValueError:
+        # непарная скобка — str.format упадёт на этой строке, сообщим при проверке
+        return {"<invalid>"}
+
+
+def _section(value: Any, what: str) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        raise CatalogError(f"{what}: expected an object, got {type(value).__name__}")
+    return value
+
+
+def _flatten(raw: Dict[str, Any]) -> Dict[str, str]:
+    # raw — разобранный JSON из файла: проверяем форму каждого уровня, а не только строки
+    _section(raw, "locale")
+    _section(raw.get("_meta") or {}, "_meta")
+    flat: Dict[str, str] = {}
+    for key, value in _section(raw.get("text") or {}, "text").items():
+        flat[key] = value
+    for svc_key, fields in _section(raw.get("services") or {}, "services").items():
+        for field, value in _section(fields, f"services.{svc_key}").items():
+            flat[f"svc.{svc_key}.{field}"] = value
+    for minutes, label in _section(raw.get("durations") or {}, "durations").items():
+        flat[f"dur.{minutes}"] = label
+    for key, value in flat.items():
+        if not isinstance(value, str):
+            raise CatalogError(f"{key}: expected a string, got {type(value).__name__}")
+    return flat
+
+
+class Catalog:
+    def __init__(self, path: str = LOCALES_DIR, default_lang: str = "ru"):
+        self.path = path
+        self.default_lang = default_lang
+        # lang -> {ключ -> строка}; сам dict живёт всё время работы, языки в нём подменяются
+        self.tables: Dict[str, Dict[str, str]] = {}
+        # lang -> подпись на кнопке выбора языка
+        self.names: Dict[str, str] = {}
+        # языки в порядке кнопок
+        self.languages: List[str] = []
+        self._mtimes: Dict[str, float] = {}
+        self._callbacks: List[Callable[[], None]] = []
+
+    # -------------------------------------------------------------------------
+    # Загрузка
+    # -------------------------------------------------------------------------
+    def _scan(self) -> Dict[str, float]:
+        return {
+            name: os.stat(os.path.join(self.path, name)).st_mtime
+            for name in os.listdir(self.path)
+            if name.endswith(".json")
+        }
+
+    def _read(self, mtimes: Dict[str, float]) -> Dict[str, Dict[str, Any]]:
+        raw: Dict[str, Dict[str, Any]] = {}
+        for name in mtimes:
+            lang = name[:-len(".json")]
+            try:
+                with open(os.path.join(self.path, name), encoding="utf-8") as f:
+                    raw[lang] = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CatalogError(f"{name}: {e}") from e
+        if self.default_lang not in raw:
+            raise CatalogError(f"default locale {self.default_lang}.json not found in {self.path}")
+        return raw
+
+    def _chain(self, lang: str, raw: Dict[str, Dict[str, Any]]) -> List[str]:
+        chain = [lang]
+        while chain[-1] != self.default_lang:
+            fallback = (raw[chain[-1]].get("_meta") or {}).get("fallback") or self.default_lang
+            if fallback not in raw or fallback in chain:
+                raise CatalogError(f"{lang}: bad fallback chain {' -> '.join(chain + [fallback])}")
+            chain.append(fallback)
+        return chain
+
+    def compile(self, raw: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, str]], Dict[str, str], List[str]]:
+        flat: Dict[str, Dict[str, str]] = {}
+        for lang, data in raw.items():
+            try:
+                flat[lang] = _flatten(data)
+            except CatalogError as e:
+                raise CatalogError(f"{lang}.json: {e}") from e
+        base = flat[self.default_lang]
+        tables: Dict[str, Dict[str, str]] = {}
+        for lang in raw:
+            table: Dict[str, str] = {}
+            # от дальнего fallback к самому языку — ближние переводы перекрывают
+            for source in reversed(self._chain(lang, raw)):
+                table.update(flat[source])
+            for key, value in flat[lang].items():
+                if key in base and _placeholders(value) != _placeholders(base[key]):
+                    logger.warning("Locale %s: placeholders of %r differ from %s", lang, key, self.default_lang)
+            tables[lang] = {sys.intern(key): value for key, value in table.items()}
+        meta = {lang: data.get("_meta") or {} for lang, data in raw.items()}
+        names = {lang: meta[lang].get("name", lang) for lang in raw}
+        languages = sorted(raw, key=lambda lang: (meta[lang].get("order", 100), lang))
+        return tables, names, languages
+
+    def load(self) -> None:
+        """Читает и компилирует все локали. При ошибке бросает CatalogError, старые таблицы не меняются."""
+        try:
+            mtimes = self._scan()
+        except OSError as e:
+            raise CatalogError(f"{self.path}: {e}") from e
+        tables, names, languages = self.compile(self._read(mtimes))
+        # подмена без await между шагами — хендлеры видят либо старый, либо новый каталог
+        for lang in set(self.tables) - set(tables):
+            del self.tables[lang]
+        self.tables.update(tables)
+        self.names = names
+        self.languages = languages
+        self._mtimes = mtimes
+        logger.info("Loaded locales: %s", ", ".join(languages))
+        for callback in self._callbacks:
+            callback()
+
+    def reload(self) -> bool:
+        try:
+            self.load()
+        except CatalogError as e:
+            logger.error("Locales not reloaded, keeping the previous ones: %s", e)
+            return False
+        return True
+
+    def on_reload(self, callback: Callable[[], None]) -> None:
+        """callback() после каждой успешной загрузки (например, сброс кэша клавиатур)."""
+        self._callbacks.append(callback)
+
+    async def watch(self, interval: float) -> None:
+        """Перечитывает локали, когда меняется любой файл в каталоге."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = self._scan() != self._mtimes
+            except OSError:
+                continue
+            if not changed:
+                continue
+            try:
+                self.reload()
+            except Exception:
+                # ошибка в подписчике on_reload не должна останавливать слежение за файлами
+                logger.exception("Locale watcher failed to reload %s", self.path)
+
+    # -------------------------------------------------------------------------
+    # Поиск
+    # -------------------------------------------------------------------------
+    def lang(self, lang: Optional[str]) -> str:
+        return lang if lang in self.tables else self.default_lang
+
+    def t(self, lang: str, key: str, **kwargs: Any) -> str:
+        """Строка с подстановкой; неизвестный язык — язык по умолчанию, неизвестный ключ — сам ключ."""
+        text = self.tables.get(lang, self.tables[self.default_lang]).get(key, key)
+        return text.format(**kwargs) if kwargs else text
@@ -0,0 +1,184 @@
+# imaging.py
+"""
+Подготовка картинок из images/ к отправке в Telegram.
+
+Telegram всё равно ужимает фото до 1280 (2560) px по большей стороне, так что
+отправлять исходники по несколько мегабайт — лишнее время загрузки, особенно
+с мобильного интернета у пользователя. При старте (или заранее: python imaging.py)
+для каждой картинки строится вариант: уменьшение до IMAGE_MAX_SIDE, progressive
+JPEG (или WebP), без EXIF и прочих метаданных. Варианты лежат в IMAGE_CACHE_DIR,
+имя включает sha1 исходника и параметры, поэтому пересборка нужна только для
+изменившихся файлов.
+
+Pillow — необязательная зависимость: без него бот отправляет исходники.
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Set, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - зависит от окружения
+    Image = None
+    ImageOps = None
+
+from media import file_sha1
+
+logger = logging.getLogger("booking-bot.imaging")
+
+BASE_DIR = os.path.dirname(__file__)
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(BASE_DIR, "runtime", "images"))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "82"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg")    # jpeg | webp
+
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# недописанные временные файлы старше этого (упавший процесс) удаляются при очистке кэша
+STALE_TMP_AGE = 3600.0
+
+# (исходник, вариант, байт до, байт после)
+VariantReport = Tuple[str, str, int, int]
+
+
+class ImageOptimizer:
+    def __init__(
+        self,
+        cache_dir: str = IMAGE_CACHE_DIR,
+        max_side: int = IMAGE_MAX_SIDE,
+        quality: int = IMAGE_QUALITY,
+        fmt: str = IMAGE_FORMAT,
+    ):
+        if fmt not in ("jpeg", "webp"):
+            raise ValueError(f"unsupported image format {fmt!r}")
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.quality = quality
+        self.fmt = fmt
+        # имена файлов вариантов, актуальных для текущих исходников
+        self._current: Set[str] = set()
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def variant_path(self, source: str, digest: str) -> str:
+        stem = os.path.splitext(os.path.basename(source))[0]
+        ext = "jpg" if self.fmt == "jpeg" else "webp"
+        return os.path.join(self.cache_dir, f"{stem}.{digest[:16]}.{self.max_side}q{self.quality}.{ext}")
+
+    def _render(self, source: str, target: str) -> None:
+        with Image.open(source) as img:
+            # поворот из EXIF применяем к пикселям — сами метаданные в вариант не попадут
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+            # каталог общий для процессов (supervisor.py, webhook-реплики): у каждого свой
+            # временный файл, готовый вариант появляется атомарно
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=os.path.basename(target) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    if self.fmt == "jpeg":
+                        img.save(f, "JPEG", quality=self.quality, optimize=True, progressive=True)
+                    else:
+                        img.save(f, "WEBP", quality=self.quality, method=6)
+                os.replace(tmp, target)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+
+    def optimize(self, source: str, build: bool = True) -> VariantReport:
+        """
+        Строит (или находит готовый) вариант картинки.
+        Если вариант не меньше исходника (или его нет, а build=False), возвращает исходник как «вариант».
+        """
+        digest = file_sha1(source)
+        target = self.variant_path(source, digest)
+        # вариант храним, даже если он не пригодился, — чтобы не пересобирать его на каждом старте
+        self._current.add(os.path.basename(target))
+        if not os.path.exists(target):
+            if not build:
+                size = os.path.getsize(source)
+                return source, source, size, size
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._render(source, target)
+        before, after = os.path.getsize(source), os.path.getsize(target)
+        if after >= before:
+            return source, source, before, before
+        return source, target, before, after
+
+    def prepare_dir(self, image_dir: str, build: bool = True) -> List[VariantReport]:
+        """
+        Варианты для всех картинок каталога; старые варианты из кэша удаляются.
+        build=False — только найти готовые варианты: кэш строит и чистит один процесс.
+        """
+        if not self.available:
+            logger.warning("Pillow is not installed, images are sent unoptimized")
+            return []
+        reports: List[VariantReport] = []
+        self._current = set()
+        for name in sorted(os.listdir(image_dir)):
+            if not name.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            source = os.path.join(image_dir, name)
+            try:
+                reports.append(self.optimize(source, build))
+            except Exception:
+                logger.exception("Failed to optimize %s, sending it as is", source)
+        if build and os.path.isdir(self.cache_dir):
+            self._prune()
+        before = sum(r[2] for r in reports)
+        after = sum(r[3] for r in reports)
+        if before:
+            logger.info(
+                "Optimized %d images: %d KB -> %d KB (-%.0f%%)",
+                len(reports), before // 1024, after // 1024, 100.0 * (before - after) / before,
+            )
+        return reports
+
+
+    def _prune(self) -> None:
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if name in self._current:
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                # временный файл может прямо сейчас дописывать другой процесс
+                if name.endswith(".tmp") and now - os.path.getmtime(path) < STALE_TMP_AGE:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def variants_map(reports: List[VariantReport]) -> Dict[str, str]:
+    """исходник -> вариант для MediaCache.use_variants."""
+    return {source: target for source, target, _, _ in reports if target != source}
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="Build Telegram-optimized variants of images/")
+    parser.add_argument("image_dir", nargs="?", default=os.path.join(BASE_DIR, "images"))
+    parser.add_argument("--cache-dir", default=IMAGE_CACHE_DIR)
+    parser.add_argument("--max-side", type=int, default=IMAGE_MAX_SIDE)
+    parser.add_argument("--quality", type=int, default=IMAGE_QUALITY)
+    parser.add_argument("--format", choices=("jpeg", "webp"), default=IMAGE_FORMAT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    optimizer = ImageOptimizer(args.cache_dir, args.max_side, args.quality, args.format)
+    for source, target, before, after in optimizer.prepare_dir(args.image_dir):
+        saved = 100.0 * (before - after) / before if before else 0.0
+        print(f"{os.path.basename(source):<20} {before / 1024:8.1f} KB -> {after / 1024:8.1f} KB  (-{saved:.0f}%)  {target}")
+
+
+if __name__ == "__main__":
+    cli()
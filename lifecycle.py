@@ -0,0 +1,97 @@
+# lifecycle.py
+"""
+Старт и остановка процесса бота.
+
+Старт: шаги прогрева (file_id картинок, оптимизированные варианты, клавиатуры,
+занятость на ближайшие дни, getMe) выполняются параллельно и до того, как бот
+начинает принимать апдейты, — первые пользователи после рестарта не платят за
+холодные кэши. Упавший шаг не мешает старту: кэш заполнится на первом запросе.
+
+Остановка (SIGTERM от docker stop или supervisor.py): приём апдейтов
+прекращается, начатые хендлеры дорабатывают, затем по очереди останавливаются
+фоновые задачи и сбрасываются записи — всё в пределах общего дедлайна
+shutdown_timeout. Он должен быть меньше паузы перед SIGKILL (у docker — 10 с).
+Что не успело уйти, остаётся в bot.db (outbox, reminders) и уйдёт после рестарта.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger("booking-bot.lifecycle")
+
+
+class Lifecycle:
+    def __init__(self, shutdown_timeout: float = 8.0, warmup_timeout: float = 10.0):
+        self.shutdown_timeout = shutdown_timeout
+        # шаг, не уложившийся в warmup_timeout (например, недоступен Bot API), старт не задерживает
+        self.warmup_timeout = warmup_timeout
+        self._warmups: List[Tuple[str, Callable[[], Any]]] = []
+        self._counters: List[Callable[[], int]] = []
+        self._deadline: Optional[float] = None
+
+    # -------------------------------------------------------------------------
+    # Старт
+    # -------------------------------------------------------------------------
+    def on_warmup(self, name: str, step: Callable[[], Any]) -> None:
+        """step() — обычная функция или корутина; все шаги идут параллельно."""
+        self._warmups.append((name, step))
+
+    async def _run_step(self, name: str, step: Callable[[], Any]) -> Optional[float]:
+        started = time.perf_counter()
+        try:
+            result = step()
+            if inspect.isawaitable(result):
+                await asyncio.wait_for(result, self.warmup_timeout)
+        except Exception:
+            logger.warning("Warm-up step %s failed, it will fill on demand", name, exc_info=True)
+            return None
+        return time.perf_counter() - started
+
+    async def warm_up(self) -> None:
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(self._run_step(name, step) for name, step in self._warmups))
+        logger.info(
+            "Warm-up done in %.0f ms (%s)",
+            (time.perf_counter() - started) * 1000,
+            ", ".join(
+                f"{name} {'failed' if t is None else f'{t * 1000:.0f} ms'}"
+                for (name, _), t in zip(self._warmups, timings)
+            ),
+        )
+
+    # -------------------------------------------------------------------------
+    # Остановка
+    # -------------------------------------------------------------------------
+    def track(self, counter: Callable[[], int]) -> None:
+        """counter() — сколько апдейтов сейчас в обработке; drain ждёт, пока все счётчики обнулятся."""
+        self._counters.append(counter)
+
+    @property
+    def in_flight(self) -> int:
+        return sum(counter() for counter in self._counters)
+
+    def begin_shutdown(self) -> None:
+        """Запускает отсчёт дедлайна остановки (повторный вызов ничего не меняет)."""
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.shutdown_timeout
+            logger.info("Shutting down, deadline %.0fs", self.shutdown_timeout)
+
+    def remaining(self) -> float:
+        """Сколько секунд осталось до дедлайна; таймаут для очередного шага остановки."""
+        self.begin_shutdown()
+        return max(0.0, self._deadline - time.monotonic())
+
+    async def drain(self) -> bool:
+        """Ждёт, пока доработают начатые апдейты. False — дедлайн наступил раньше."""
+        self.begin_shutdown()
+        # задачи апдейтов, принятых перед самой остановкой, ещё не дошли до счётчиков
+        await asyncio.sleep(0)
+        while self.in_flight:
+            if not self.remaining():
+                logger.warning("Shutdown deadline reached with %d updates still in flight", self.in_flight)
+                return False
+            await asyncio.sleep(0.05)
+        return True
@@ -0,0 +1,263 @@
+# loadtest.py
+"""
+Офлайн нагрузочный тест хендлеров.
+
+Настоящие dp/bot из main.py работают против fake_bot_api.FakeBotAPI (вместо
+Telegram) и временной базы. Каждый симулированный пользователь проходит
+полный сценарий:
+
+    /start → lang: → svc: → book: → cal: → dt: → submit:now → use_contact:
+
+нажимая кнопки из последнего сообщения, которое бот ему отправил.
+Апдейты подаются в dp.feed_update напрямую — латентность хендлера включает
+все обращения к Bot API и к базе.
+
+Пример:
+    python loadtest.py --users 2000 --concurrency 200 --latency 0.02 --flood 0.01
+
+Отчёт: апдейты/сек, p50/p99 латентности по шагам и в целом, вызовы Bot API
+на одну заявку. Код выхода 1, если доля сценариев, оборванных ошибкой
+(не гонкой за слот), выше --max-failed.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from fake_bot_api import FakeBotAPI
+
+BENCH_TOKEN = "123456:LOADTEST"
+ADMIN_ID = 1
+
+FLOW_STEPS = ["start", "lang", "svc", "book", "cal", "dt", "submit", "contact"]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class LoadTest:
+    def __init__(self, fake: FakeBotAPI, main_module):
+        self.fake = fake
+        self.main = main_module
+        self._update_ids = itertools.count(1)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.abandoned: Counter = Counter()
+        self.updates = 0
+        self.bookings = 0
+
+    # -------------------------------------------------------------------------
+    # Апдейты
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _user(uid: int) -> Dict[str, Any]:
+        return {"id": uid, "is_bot": False, "first_name": "Load", "username": f"load{uid}"}
+
+    def message_update(self, uid: int, text: str):
+        from aiogram.types import Update
+
+        return Update.model_validate({
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": self._user(uid),
+                "text": text,
+            },
+        })
+
+    def callback_update(self, uid: int, data: str):
+        from aiogram.types import Update
+
+        update_id = next(self._update_ids)
+        return Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": str(uid),
+                "from": self._user(uid),
+                "message": self.fake.last[uid],
+                "data": data,
+            },
+        })
+
+    def buttons(self, uid: int, prefix: str) -> List[str]:
+        markup = (self.fake.last.get(uid) or {}).get("reply_markup") or {}
+        return [
+            b["callback_data"]
+            for row in markup.get("inline_keyboard", [])
+            for b in row
+            if b.get("callback_data", "").startswith(prefix)
+        ]
+
+    async def feed(self, step: str, update) -> bool:
+        self.updates += 1
+        started = time.perf_counter()
+        try:
+            await self.main.dp.feed_update(self.main.bot, update)
+        except Exception as e:
+            self.errors[f"{step}: {type(e).__name__}"] += 1
+            return False
+        finally:
+            self.latencies[step].append(time.perf_counter() - started)
+        return True
+
+    # -------------------------------------------------------------------------
+    # Сценарий
+    # -------------------------------------------------------------------------
+    async def press(self, uid: int, step: str, prefix: str) -> Optional[str]:
+        """Нажимает случайную кнопку с данным префиксом в последнем сообщении."""
+        options = self.buttons(uid, prefix)
+        if not options:
+            self.abandoned[step] += 1
+            return None
+        data = random.choice(options)
+        if not await self.feed(step, self.callback_update(uid, data)):
+            return None
+        return data
+
+    async def run_user(self, uid: int) -> None:
+        if not await self.feed("start", self.message_update(uid, "/start")):
+            return
+        if not await self.press(uid, "lang", "lang:"):
+            return
+        svc = await self.press(uid, "svc", "svc:")
+        if not svc:
+            return
+        if not await self.press(uid, "book", "book:"):
+            return
+        # «cal:full» — заполненный день, его не нажимаем
+        if not await self.press(uid, "cal", "cal:2"):
+            return
+        slot = await self.press(uid, "dt", "dt:")
+        if not slot:
+            return
+        if not self.buttons(uid, "submit:") and self.buttons(uid, "dt:"):
+            # слот заняли, пока пользователь смотрел на список
+            self.abandoned["slot_taken"] += 1
+            return
+        # длительность сеанса — из корзины: после отправки заявки её уже не прочитать
+        state = self.main.dp.fsm.resolve_context(self.main.bot, chat_id=uid, user_id=uid)
+        duration_min = int((await state.get_data()).get("duration_min", 60))
+        if not await self.press(uid, "submit", "submit:now"):
+            return
+        if not await self.press(uid, "contact", "use_contact:"):
+            return
+        if self.buttons(uid, "dt:") or self.buttons(uid, "cal:"):
+            # слот заняли параллельно — бот предложил другое время
+            self.abandoned["slot_taken"] += 1
+            return
+        self.bookings += 1
+        # освобождаем слот, чтобы тысячи пользователей не исчерпали календарь
+        date_iso, timestr = slot[len("dt:"):].split("|", 1)
+        self.main.availability.release(date_iso, timestr, duration_min)
+
+    async def run(self, users: int, concurrency: int) -> float:
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(uid: int) -> None:
+            async with sem:
+                await self.run_user(uid)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(10_000_000 + i) for i in range(users)))
+        return time.perf_counter() - started
+
+    # -------------------------------------------------------------------------
+    # Отчёт
+    # -------------------------------------------------------------------------
+    def report(self, users: int, elapsed: float) -> None:
+        all_latencies = [x for values in self.latencies.values() for x in values]
+        api_calls = sum(self.fake.calls.values())
+        print(f"users:              {users}, completed bookings: {self.bookings}")
+        print(f"elapsed:            {elapsed:.2f}s")
+        print(f"updates:            {self.updates} ({self.updates / elapsed:.0f} updates/s)")
+        print(
+            f"handler latency:    p50 {percentile(all_latencies, 0.5) * 1000:.1f} ms, "
+            f"p99 {percentile(all_latencies, 0.99) * 1000:.1f} ms"
+        )
+        for step in FLOW_STEPS:
+            values = self.latencies.get(step)
+            if values:
+                print(
+                    f"  {step:<10} p50 {percentile(values, 0.5) * 1000:7.1f} ms  "
+                    f"p99 {percentile(values, 0.99) * 1000:7.1f} ms  n={len(values)}"
+                )
+        per_booking = api_calls / self.bookings if self.bookings else 0.0
+        print(f"Bot API calls:      {api_calls} ({per_booking:.1f} per booking)")
+        for method, count in self.fake.calls.most_common():
+            print(f"  {method:<22} {count}")
+        if self.fake.flooded:
+            print(f"429 injected:       {dict(self.fake.flooded)}")
+        if self.errors:
+            print(f"handler errors:     {dict(self.errors)}")
+        if self.abandoned:
+            print(f"abandoned at:       {dict(self.abandoned)}")
+
+
+async def run(args: argparse.Namespace) -> int:
+    fake = FakeBotAPI(latency=args.latency, jitter=args.jitter, flood_ratio=args.flood)
+    await fake.start()
+
+    # main читает настройки при импорте — окружение готовим заранее
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "TELEGRAM_API_URL": fake.url,
+        "ADMIN_IDS": str(ADMIN_ID),
+        "DB_PATH": os.path.join(tmp, "bot.db"),
+        "MEDIA_CACHE_PATH": os.path.join(tmp, "media_cache.json"),
+    })
+    import main
+
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    await main.init_db()
+    await main.notifier.start()
+    main.outbox.start()
+    test = LoadTest(fake, main)
+    try:
+        elapsed = await test.run(args.users, args.concurrency)
+        # уведомления админу — часть стоимости заявки, дожидаемся очереди
+        await main.outbox.stop()
+        await main.notifier.stop()
+        test.report(args.users, elapsed)
+    finally:
+        await main.dp.storage.close()
+        await main.close_db()
+        await main.bot.session.close()
+        await fake.stop()
+
+    # проигранная гонка за слот — нормальный исход, провал — ошибки и обрывы сценария
+    failed = sum(test.errors.values()) + sum(n for step, n in test.abandoned.items() if step != "slot_taken")
+    return 1 if failed > args.users * args.max_failed else 0
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="Load test of the booking flow against a fake Bot API")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Bot API response delay, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay up to N seconds")
+    parser.add_argument("--flood", type=float, default=0.0, help="share of send/edit calls answered with 429")
+    parser.add_argument("--max-failed", type=float, default=0.05, help="allowed share of flows broken by errors")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,33 +1,88 @@
 # main.py
 """
 Бот для бронирования массажей (Aiogram 3.x)
-Версия: без базы данных — заявки пересылаются администраторам в личные сообщения.
+Заявки пересылаются администраторам в личные сообщения; состояния FSM хранятся в bot.db.
 Требования:
  - .env с BOT_TOKEN и ADMIN_IDS
- - Папка images/ рядом с main.py с картинками:
-     service1.jpg, service2.jpg, service3.jpg, confirmation.jpg (имена можно менять в константах)
+ - режим получения апдейтов: BOT_MODE=polling (по умолчанию) или webhook;
+   для webhook — WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT;
+   несколько webhook-реплик на одном bot.db — SHARED_DB=1 у всех и RUN_BACKGROUND_JOBS=0 у всех, кроме одной;
+   апдейты одного пользователя должны всегда попадать в одну реплику (кэш FSM и защита от
+   повторов — в памяти процесса), поэтому балансировщик — только с маршрутизацией по user_id;
+   проще запустить python supervisor.py с BOT_MODE=webhook — он делает это сам
+ - метрики Prometheus: /metrics на METRICS_PORT (в webhook-режиме без него — на порту вебхука)
+ - Папка images/ рядом с main.py с картинками (при старте уменьшаются для Telegram, см. imaging.py):
+     service1.jpg, service2.jpg, service3.jpg, confirmation.jpg (картинки услуг задаются в services.json)
+ - BOT_TIMEZONE — часовой пояс салона (время заявок и напоминаний), например Europe/Moscow
+ - services.json — услуги, цены, длительности, рабочие часы; locales/ — тексты.
+   Оба перечитываются при изменении файлов и по команде администратора /reload
+ - несколько процессов: python supervisor.py (WORKERS=N) — main.py запускается воркерами
+   с BOT_MODE=worker, апдейты распределяются по user_id
 """
 
 import asyncio
 import logging
 import os
-from datetime import datetime, timedelta
+import signal
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, ExceptionTypeFilter
 from aiogram.types import (
     Message,
     CallbackQuery,
+    ErrorEvent,
+    FSInputFile,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     KeyboardButton,
-    FSInputFile,
 )
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
 
+from availability import AvailabilityIndex
+from db import (
+    SlotConflictError,
+    add_bookings,
+    cancel_booking,
+    close_db,
+    get_bookings_by_user,
+    init_db,
+    start_stats_backfill,
+    writer,
+)
+from export import EXPORT_USAGE, export_filename, export_to_file, parse_export_args
+from fsm_storage import SQLiteStorage
+from i18n import Catalog
+from imaging import ImageOptimizer, variants_map
+from lifecycle import Lifecycle
+from media import media_cache
+from metrics import (
+    ApiMetricsMiddleware,
+    HandlerMetricsMiddleware,
+    TimedStorage,
+    metrics_handler,
+    registry,
+    start_metrics_server,
+)
+from middlewares import ThrottleMiddleware, UpdateGuardMiddleware, parse_throttle_rules
+from notify import AdminNotifier
+from outbox import OutboxDispatcher
+from reminders import ReminderScheduler, parse_offsets, reminder_times, salon_now
+from services import SERVICES_PATH, ServiceCatalog, ServiceSnapshot, ServiceUnavailableError
+from stats import StatsBackfill, collect_stats, format_stats
+
 # -----------------------------------------------------------------------------
 # Логирование и загрузка .env
 # -----------------------------------------------------------------------------
@@ -44,11 +99,117 @@ ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split() if x]
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN не задан в .env")
 
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")   # публичный https-адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# без секрета webhook-порт принял бы поддельные апдейты — в том числе «от админа»
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise RuntimeError("WEBHOOK_SECRET не задан в .env (обязателен для BOT_MODE=webhook)")
+# Альтернативный адрес Bot API (локальный telegram-bot-api или fake_bot_api.py для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))     # 0 — отдельный сервер метрик не запускается
+
+# BOT_MODE=worker — процесс, запущенный supervisor.py: апдейты приходят от супервизора
+# на unix-сокет WORKER_SOCKET
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_SOCKET = os.getenv("WORKER_SOCKET", "")
+WORKER_SECRET = os.getenv("WORKER_SECRET", "")
+IS_WORKER = BOT_MODE == "worker"
+# SHARED_DB=1 — в bot.db пишут несколько процессов (воркеры supervisor.py или несколько
+# webhook-реплик за балансировщиком): пересечения слотов проверяются в транзакции записи,
+# занятость дня перечитывается раз в AVAILABILITY_TTL секунд. Состояния FSM кэшируются,
+# а повторы апдейтов отсекаются в памяти процесса — поэтому пользователь должен быть
+# закреплён за одним процессом (supervisor.py маршрутизирует по user_id, балансировщик — так же)
+SHARED_DB = os.getenv("SHARED_DB", "1" if IS_WORKER else "0") == "1"
+# фоновые задачи (outbox, напоминания, пересчёт сводок) — ровно в одном процессе на базу:
+# у воркеров — в воркере 0, у webhook-реплик — RUN_BACKGROUND_JOBS=0 у всех, кроме одной
+RUN_BACKGROUND_JOBS = os.getenv("RUN_BACKGROUND_JOBS", "1" if not IS_WORKER or WORKER_INDEX == 0 else "0") == "1"
+if IS_WORKER and METRICS_PORT:
+    # у каждого воркера свой реестр метрик — и свой порт
+    METRICS_PORT += WORKER_INDEX
+
 # -----------------------------------------------------------------------------
 # Инициализация бота и диспетчера
 # -----------------------------------------------------------------------------
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+)
+# FSM переживает рестарты: состояния и корзины лежат в bot.db
+dp = Dispatcher(storage=TimedStorage(SQLiteStorage(flush_delay=float(os.getenv("FSM_FLUSH_DELAY", "0.05")))))
+notifier = AdminNotifier(
+    bot,
+    workers=int(os.getenv("NOTIFY_WORKERS", "4")),
+    queue_size=int(os.getenv("NOTIFY_QUEUE_SIZE", "1000")),
+    global_rate=float(os.getenv("NOTIFY_RATE", "25")),
+)
+# уведомления о заявках пишутся в outbox вместе с заявкой и доставляются отсюда
+outbox = OutboxDispatcher(
+    notifier,
+    batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "100")),
+    # другие процессы не будят доставку в этом — опрашиваем чаще
+    poll_interval=float(os.getenv("OUTBOX_POLL_INTERVAL", "1" if SHARED_DB else "5")),
+    # >0 — digest-режим: не больше одного сообщения админу за окно (сек), остальное — сводкой
+    digest_window=float(os.getenv("NOTIFY_DIGEST_WINDOW", "0")),
+)
+
+# Напоминания клиентам перед сеансом (смещения через запятую: "24h,2h"; пусто — выключены)
+REMINDER_OFFSETS = parse_offsets(os.getenv("REMINDER_OFFSETS", "24h,2h"))
+reminder_scheduler = ReminderScheduler(
+    notifier,
+    render=lambda *args: reminder_text(*args),
+    horizon=float(os.getenv("REMINDER_HORIZON", "21600")),
+    # напоминания заявок из других процессов в кучу этого не попадают — проверяем базу
+    poll_interval=float(os.getenv("REMINDER_POLL_INTERVAL", "30")) if SHARED_DB else None,
+)
+# сводки для /stats по заявкам, сохранённым до их появления (или после /stats rebuild)
+stats_backfill = StatsBackfill(
+    # /stats rebuild в другом процессе только помечает пересчёт — здесь его надо заметить
+    poll_interval=float(os.getenv("STATS_BACKFILL_POLL_INTERVAL", "60")) if SHARED_DB else None,
+)
+# несколько процессов пишут заявки — пересечения проверяются в транзакции записи
+writer.check_conflicts = SHARED_DB
+
+# Лимиты частоты на пользователя (по префиксу команды/кнопки) и общий лимит апдейтов в обработке
+throttle = ThrottleMiddleware(
+    rules=parse_throttle_rules(os.getenv("THROTTLE_RULES", "")),
+    max_in_flight=int(os.getenv("MAX_IN_FLIGHT", "1000")),
+)
+# первой в цепочке: учитывает update_id всех апдейтов (см. run_polling)
+dp.update.outer_middleware(throttle)
+# Повторы апдейтов и двойные нажатия отбрасываются, апдейты одного пользователя
+# обрабатываются по очереди (разные пользователи — параллельно)
+update_guard = UpdateGuardMiddleware(dedup_window=float(os.getenv("DEDUP_WINDOW", "1.0")))
+dp.update.outer_middleware(update_guard)
+
+# Прогрев кэшей до приёма апдейтов и остановка с дедлайном (см. lifecycle.py);
+# SHUTDOWN_TIMEOUT должен быть меньше паузы перед SIGKILL (stop_grace_period в
+# docker-compose.yml, docker stop по умолчанию — 10 с); воркерам его задаёт supervisor.py
+lifecycle = Lifecycle(shutdown_timeout=float(os.getenv("SHUTDOWN_TIMEOUT", "8")))
+# хендлеры, которые надо дождаться при остановке
+lifecycle.track(lambda: throttle.in_flight)
+
+# Метрики: латентность хендлеров, вызовы Bot API, очередь уведомлений
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+bot.session.middleware(ApiMetricsMiddleware())
+registry.gauge_fn("bot_notify_queue_depth", "Admin notifications waiting in the queue", lambda: notifier.queue.qsize())
+registry.gauge_fn("bot_notify_delayed", "Admin notifications waiting for a retry", lambda: notifier.stats()["delayed"])
+registry.counter_fn("bot_notify_sent_total", "Admin notifications delivered", lambda: notifier.sent)
+registry.counter_fn("bot_notify_failed_total", "Admin notifications given up on", lambda: notifier.failed)
+registry.counter_fn("bot_notify_dropped_total", "Admin notifications dropped on a full queue", lambda: notifier.dropped)
+registry.gauge_fn("bot_updates_in_flight", "Updates being processed right now", lambda: throttle.in_flight)
+registry.counter_fn("bot_outbox_delivered_total", "Outbox rows delivered", lambda: outbox.delivered)
+registry.counter_fn("bot_outbox_retried_total", "Outbox rows rescheduled after an error", lambda: outbox.retried)
+registry.counter_fn("bot_outbox_failed_total", "Outbox rows given up on", lambda: outbox.failed)
+registry.gauge_fn("bot_reminders_scheduled", "Reminders in the in-memory timer heap", lambda: reminder_scheduler.scheduled)
+registry.counter_fn("bot_reminders_sent_total", "Reminders delivered to clients", lambda: reminder_scheduler.sent)
+registry.counter_fn("bot_reminders_failed_total", "Reminders given up on", lambda: reminder_scheduler.failed)
+registry.counter_fn("bot_reminders_skipped_total", "Reminders skipped (cancelled or expired)", lambda: reminder_scheduler.skipped)
 
 # -----------------------------------------------------------------------------
 # Путь к локальной папке с картинками
@@ -56,113 +217,44 @@ dp = Dispatcher()
 BASE_DIR = os.path.dirname(__file__)
 IMG_DIR = os.path.join(BASE_DIR, "images")
 # Пути к файлам (если не найдены — бот отправит текст)
-SERVICE_IMG_1 = os.path.join(IMG_DIR, "service1.jpg")
-SERVICE_IMG_2 = os.path.join(IMG_DIR, "service2.jpg")
-SERVICE_IMG_3 = os.path.join(IMG_DIR, "service3.jpg")
 CONFIRM_IMG = os.path.join(IMG_DIR, "confirmation.jpg")
 MAIN_BANNER_IMG = os.path.join(IMG_DIR, "banner.jpg")  # опционально локальный баннер
 
 # -----------------------------------------------------------------------------
-# Данные по услугам: тексты RU/EN, цены, локальные картинки
-# -----------------------------------------------------------------------------
-SERVICES: Dict[str, Dict[str, Any]] = {
-    "classic": {
-        "title_ru": "Классический массаж",
-        "title_en": "Classic massage",
-        "desc_ru": "Классическая техника массажа всего тела — расслабление мышц, проработка зажимов, улучшение кровообращения.",
-        "desc_en": "Basic full-body technique — relaxation, improves circulation.",
-        "base_price_60": 60,
-        "image_path": SERVICE_IMG_1,
-    },
-    "relax": {
-        "title_ru": "Расслабляющий массаж",
-        "title_en": "Relaxing massage",
-        "desc_ru": "Медленные техники, фокус на релаксации и снижении стресса.",
-        "desc_en": "Slow techniques, focus on relaxation and stress relief.",
-        "base_price_60": 55,
-        "image_path": SERVICE_IMG_2,
-    },
-    "deep_trigger": {
-        "title_ru": "Глубокий массаж",
-        "title_en": "Deep tissue massage",
-        "desc_ru": "Глубокая проработка мышц и триггерных точек.",
-        "desc_en": "Deep work with muscle knots and trigger points.",
-        "base_price_60": 70,
-        "image_path": SERVICE_IMG_3,
-    },
-}
-
-# -----------------------------------------------------------------------------
-# Параметры длительностей (добавлен 60 как дефолт)
-# -----------------------------------------------------------------------------
-DURATION_OPTIONS: List[Tuple[int, str, str]] = [
-    (30, "30 мин", "30 min"),
-    (45, "45 мин", "45 min"),
-    (60, "1 час", "1 hour"),
-    (90, "1 ч 30 мин", "1.5 hours"),
-]
-
-# -----------------------------------------------------------------------------
-# Слоты: часы
-# -----------------------------------------------------------------------------
-SLOT_START = 10  # 10:00
-SLOT_END = 19    # 19:00
-
-# -----------------------------------------------------------------------------
-# Тексты (RU / EN)
-# -----------------------------------------------------------------------------
-TEXT: Dict[str, Dict[str, str]] = {
-    "ru": {
-        "greet_both": "🌟 Привет! Я помогу подобрать и забронировать массаж. / Hello! I will help you to select and book a massage.\n\nРусский — 🇷🇺\nEnglish — 🇬🇧",
-        "greet_caption": "🌟 Тут по шагам ты сможешь выбрать массаж, время, дату и оформить бронь.\n\nВыберите подходящий вид массажа:",
-        "choose_service": "Выберите вид массажа:",
-        "duration_prompt": "⏰ Подтверди длительность сеанса:",
-        "calendar_prompt": "📅 Выберите дату (доступно 14 дней):",
-        "slots_prompt": "🕐 Какое желаемое время?:",
-        "summary_title": "📋 Ваш выбор:",
-        "need_date_time": "❗ Сначала выберите дату и время.",
-        "book_now": "📩 Забронировать сейчас",
-        "cancel_back": "◀️ Отменить / Назад в меню",
-        "choose_contact": "📞 Укажите контакт для связи (можно использовать @username или номер +...):",
-        "use_username": "Использовать Telegram @{username}",
-        "enter_contact": "Ввести контакт вручную",
-        "booking_saved": "✅   https://body-mind-harmony-guide.lovable.app/ и канал @itsmartmassage",
-        "booking_confirmed": "✅ Ваш массаж забронирован, с вами свяжется специалист.",
-        "booking_final_message": "Для нового бронирования выберите опцию из меню слева",
-        "updated": "✅ Обновлено",
-        "no_bookings": "📝 У вас пока нет заявок.",
-        "my_bookings_title": "📋 Ваши заявки:",
-        "minutes": "мин",
-        "view_cart": "🛒 Корзина",
-        "added_to_cart": "✅ Добавлено в корзину.",
-        "delete": "❌ Удалить",
-    },
-    "en": {
-        "greet_both": "🌟 Hello! / Привет!\n\nEnglish — press 🇬🇧\nРусский — press 🇷🇺",
-        "greet_caption": "🌟 Here you can step-by-step select a massage, time, date, and make a reservation. \n\nChoose a massage type:",
-        "choose_service": "Choose a massage type:",
-        "duration_prompt": "⏰ Choose duration:",
-        "calendar_prompt": "📅 Choose date (14 days):",
-        "slots_prompt": "🕐 Choose time (slot):",
-        "summary_title": "📋 Your selection:",
-        "need_date_time": "❗ First choose date and time.",
-        "book_now": "📩 Book now",
-        "cancel_back": "◀️ Cancel / Back to menu",
-        "choose_contact": "📞 Provide contact (or use @username or +phone):",
-        "use_username": "Use Telegram @{username}",
-        "enter_contact": "Enter contact manually",
-        "booking_saved": "✅ Booking saved. Await confirmation.",
-        "booking_confirmed": "✅ Thank you, your massage is booked, the specialist will contact you. \n You could learn more about practice: https://body-mind-harmony-guide.lovable.app/",
-        "booking_final_message": "For new booking please select an option from the left menu",
-        "updated": "✅ Updated",
-        "no_bookings": "📝 You have no bookings yet.",
-        "my_bookings_title": "📋 Your bookings:",
-        "minutes": "min",
-        "view_cart": "🛒 View cart",
-        "added_to_cart": "✅ Added to cart.",
-        "delete": "❌ Remove",
-    },
-}
+# Услуги, цены, длительности и рабочие часы: services.json (названия и описания — в locales/)
+# -----------------------------------------------------------------------------
+# Файл можно смонтировать в контейнер и менять без пересборки; снимок каталога
+# подменяется целиком при изменении файла или по /reload
+service_catalog = ServiceCatalog(os.getenv("SERVICES_PATH", SERVICES_PATH))
+service_catalog.load()
+SERVICES_RELOAD_INTERVAL = float(os.getenv("SERVICES_RELOAD_INTERVAL", "5"))
+
+# Заявок на странице «Мои заявки»
+BOOKINGS_PAGE_SIZE = 5
+
+# -----------------------------------------------------------------------------
+# Тексты: locales/<lang>.json, TEXT[lang][key] — готовая строка с учётом fallback
+# -----------------------------------------------------------------------------
+catalog = Catalog(default_lang=os.getenv("DEFAULT_LANG", "ru"))
+catalog.load()
+TEXT: Dict[str, Dict[str, str]] = catalog.tables
+# Раз в N секунд проверяем, не поменялись ли файлы локалей (0 — только при старте)
+I18N_RELOAD_INTERVAL = float(os.getenv("I18N_RELOAD_INTERVAL", "5"))
+
+# -----------------------------------------------------------------------------
+# Занятость: интервалы существующих заявок по дням
+# -----------------------------------------------------------------------------
+availability = AvailabilityIndex(
+    service_catalog.current.slot_start,
+    service_catalog.current.slot_end,
+    service_catalog.current.work_end,
+    # брони других процессов видны только после перечитывания дня
+    ttl=float(os.getenv("AVAILABILITY_TTL", "5")) if SHARED_DB else 0.0,
+)
+
+
+class SlotTakenError(Exception):
+    """Выбранное время заняли, пока пользователь оформлял заявку."""
 
 # -----------------------------------------------------------------------------
 # FSM: состояния
@@ -179,18 +271,29 @@ class Flow(StatesGroup):
 # -----------------------------------------------------------------------------
 # Утилиты
 # -----------------------------------------------------------------------------
-def calc_price(service_key: str, duration_min: int) -> int:
-    base = SERVICES[service_key]["base_price_60"]
-    return int(round(base * duration_min / 60))
+def calc_price(service_key: str, duration_min: int, fallback: Optional[int] = None) -> int:
+    # цены посчитаны при загрузке каталога
+    return service_catalog.current.price(service_key, duration_min, fallback)
+
+def state_price(data: Dict[str, Any]) -> int:
+    # если услугу убрали из каталога — цена, показанная пользователю при выборе
+    return calc_price(data["service"], int(data.get("duration_min", 60)), data.get("price"))
 
 def get_lang_from_state(data: Dict[str, Any]) -> str:
-    return data.get("lang", "ru")
+    # язык могли убрать из locales/, пока пользователь был в середине сценария
+    return catalog.lang(data.get("lang"))
 
 def svc_title(key: str, lang: str) -> str:
-    return SERVICES[key]["title_ru"] if lang == "ru" else SERVICES[key]["title_en"]
+    return TEXT[lang].get(f"svc.{key}.title", key)
 
 def svc_desc(key: str, lang: str) -> str:
-    return SERVICES[key]["desc_ru"] if lang == "ru" else SERVICES[key]["desc_en"]
+    return TEXT[lang].get(f"svc.{key}.desc", "")
+
+def reminder_text(lang: Optional[str], service: str, duration_min: int, date: str, time: str) -> str:
+    lang = catalog.lang(lang)
+    return TEXT[lang]["reminder"].format(
+        service=svc_title(service, lang), date=date, time=time, duration=duration_min, minutes=TEXT[lang]["minutes"],
+    )
 
 def sanitize_contact_input(raw: str) -> str:
     if not raw:
@@ -201,26 +304,53 @@ def sanitize_contact_input(raw: str) -> str:
 # -----------------------------------------------------------------------------
 # Keyboards
 # -----------------------------------------------------------------------------
+# Разметка зависит только от аргументов (язык, услуга, длительность, флаг корзины,
+# дата), поэтому готовые InlineKeyboardMarkup кэшируются и отдаются повторно.
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "512"))
+_render_caches: List[Any] = []
+
+def render_cache(fn):
+    cached = lru_cache(maxsize=RENDER_CACHE_SIZE)(fn)
+    _render_caches.append(cached)
+    return cached
+
+def clear_render_caches() -> None:
+    for cached in _render_caches:
+        cached.cache_clear()
+
+# подписи кнопок берутся из каталога — после перезагрузки локалей кэш устарел
+catalog.on_reload(clear_render_caches)
+
+def apply_service_catalog(snapshot: ServiceSnapshot) -> None:
+    # новые рабочие часы, цены и список услуг — все готовые клавиатуры устарели
+    availability.configure(snapshot.slot_start, snapshot.slot_end, snapshot.work_end)
+    clear_render_caches()
+
+service_catalog.on_reload(apply_service_catalog)
+
+@render_cache
 def lang_kb() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    b.button(text="🇷🇺 Русский", callback_data="lang:ru")
-    b.button(text="🇬🇧 English", callback_data="lang:en")
-    b.adjust(2)
+    for lang in catalog.languages:
+        b.button(text=catalog.names[lang], callback_data=f"lang:{lang}")
+    b.adjust(3)
     return b.as_markup()
 
+@render_cache
 def service_list_kb(lang: str) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    for key in SERVICES.keys():
+    for key in service_catalog.current.services:
         b.button(text=svc_title(key, lang), callback_data=f"svc:{key}")
     b.adjust(1)
     return b.as_markup()
 
+@render_cache
 def service_card_kb(current_key: str, lang: str, cart_exists: bool = False) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     # выделенная кнопка "Забронировать" — помещаем эмодзи и верхний регистр
     b.button(text=f"🎯 {TEXT[lang]['book_now'].upper()}", callback_data=f"book:{current_key}")
     # другие услуги
-    for k in SERVICES.keys():
+    for k in service_catalog.current.services:
         if k != current_key:
             b.button(text=svc_title(k, lang), callback_data=f"svc:{k}")
     # показать корзину, если есть
@@ -229,31 +359,65 @@ def service_card_kb(current_key: str, lang: str, cart_exists: bool = False) -> I
     b.adjust(1)
     return b.as_markup()
 
+@render_cache
 def duration_kb(current_service: str, current_duration: int, lang: str) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    for minutes, label_ru, label_en in DURATION_OPTIONS:
-        label = label_ru if lang == "ru" else label_en
-        price = calc_price(current_service, minutes)
+    snapshot = service_catalog.current
+    for minutes in snapshot.durations:
+        label = TEXT[lang].get(f"dur.{minutes}") or f"{minutes} {TEXT[lang]['minutes']}"
+        price = snapshot.price(current_service, minutes)
         mark = "• " if minutes == current_duration else ""
         b.button(text=f"{mark}{label} — €{price}", callback_data=f"dur:{minutes}")
     b.adjust(1)
     return b.as_markup()
 
-def calendar_kb_4x(start_date: datetime) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=4)
+def _calendar_days(start_day: date, count: int) -> Tuple[Tuple[str, str], ...]:
+    # (iso, подпись) для count дней начиная с start_day
+    days = [start_day + timedelta(days=i) for i in range(count)]
+    return tuple((d.isoformat(), d.strftime("%d %b")) for d in days)
+
+def calendar_dates(start_date: datetime) -> List[str]:
+    return [iso for iso, _ in _calendar_days(start_date.date(), service_catalog.current.calendar_days)]
+
+_calendar_day: Optional[date] = None
+
+def calendar_kb_4x(start_date: datetime, duration_min: int = 60) -> InlineKeyboardMarkup:
+    # дни должны быть загружены в availability (см. calendar_markup)
+    global _calendar_day
+    start_day = start_date.date()
+    if start_day != _calendar_day:
+        # наступили новые сутки — вчерашние календари больше не нужны
+        _calendar_kb.cache_clear()
+        _calendar_day = start_day
+    days = _calendar_days(start_day, service_catalog.current.calendar_days)
+    # версии дней в ключе: бронь/отмена в любом из дней даёт новый ключ
+    versions = tuple(availability.versions.get(iso, 0) for iso, _ in days)
+    return _calendar_kb(start_day, duration_min, versions)
+
+@render_cache
+def _calendar_kb(start_day: date, duration_min: int, versions: Tuple[int, ...]) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    days = [start_date + timedelta(days=i) for i in range(14)]
-    for i, d in enumerate(days):
-        label = d.strftime("%d %b")
-        b.button(text=label, callback_data=f"cal:{d.date().isoformat()}")
+    days = _calendar_days(start_day, len(versions))
+    for i, (iso, label) in enumerate(days):
+        if availability.has_free(iso, duration_min):
+            b.button(text=label, callback_data=f"cal:{iso}")
+        else:
+            # день занят целиком — «серая» кнопка
+            b.button(text=f"✖️ {label}", callback_data="cal:full")
         if (i + 1) % 4 == 0:
             b.adjust(4)
     if len(days) % 4 != 0:
         b.adjust(4)
     return b.as_markup()
 
-def slots_kb_for_date(date_iso: str) -> InlineKeyboardMarkup:
+def slots_kb_for_date(date_iso: str, duration_min: int = 60) -> InlineKeyboardMarkup:
+    return _slots_kb(date_iso, duration_min, availability.versions.get(date_iso, 0))
+
+@render_cache
+def _slots_kb(date_iso: str, duration_min: int, version: int) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    hours = [f"{h:02d}:00" for h in range(SLOT_START, SLOT_END + 1)]
+    hours = availability.free_starts(date_iso, duration_min)
     for i, t in enumerate(hours):
         payload = f"dt:{date_iso}|{t}"
         b.button(text=t, callback_data=payload)
@@ -263,6 +427,42 @@ def slots_kb_for_date(date_iso: str) -> InlineKeyboardMarkup:
         b.adjust(4)
     return b.as_markup()
 
+async def calendar_markup(duration_min: int) -> InlineKeyboardMarkup:
+    # «сегодня» — по часовому поясу салона (BOT_TIMEZONE), а не сервера
+    now = salon_now()
+    await availability.ensure_loaded(calendar_dates(now))
+    return calendar_kb_4x(now, duration_min)
+
+async def slots_markup(date_iso: str, duration_min: int) -> InlineKeyboardMarkup:
+    await availability.ensure_loaded([date_iso])
+    return slots_kb_for_date(date_iso, duration_min)
+
+@render_cache
+def back_kb(lang: str) -> InlineKeyboardMarkup:
+    # из выбора времени обратно в календарь
+    b = InlineKeyboardBuilder()
+    b.button(text=TEXT[lang]["back"], callback_data="nav:calendar")
+    return b.as_markup()
+
+@render_cache
+def contact_kb(lang: str, username: str, with_back: bool) -> InlineKeyboardMarkup:
+    b = InlineKeyboardBuilder()
+    if username:
+        b.button(text=TEXT[lang]["use_username"].format(username=username), callback_data=f"use_contact:@{username}")
+    b.button(text=TEXT[lang]["enter_contact"], callback_data="enter_contact_manual")
+    if with_back:
+        b.button(text=TEXT[lang]["cancel_back"], callback_data="nav:back")
+    b.adjust(1)
+    return b.as_markup()
+
+def join_kb(*markups: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """Склеивает готовые клавиатуры в одну (без InlineKeyboardBuilder)."""
+    rows: List[Any] = []
+    for m in markups:
+        rows.extend(m.inline_keyboard)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@render_cache
 def summary_kb(lang: str, cart_exists: bool = False) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.button(text=TEXT[lang]["book_now"], callback_data="submit:now")
@@ -280,16 +480,74 @@ def cart_items_kb(cart: List[Dict[str, Any]], lang: str) -> InlineKeyboardMarkup
     b.adjust(1)
     return b.as_markup()
 
+def booking_items(data: Dict[str, Any], user: Any, contact: str) -> List[Dict[str, Any]]:
+    """Заявки для сохранения в БД: вся корзина или одиночный выбор из state."""
+    cart = data.get("cart") or []
+    if cart:
+        items = [dict(item) for item in cart]
+    else:
+        duration = int(data.get("duration_min", 60))
+        items = [{
+            "service": data["service"],
+            "duration_min": duration,
+            "price": state_price(data),
+            "date": data["date"],
+            "time": data["time"],
+        }]
+    lang = get_lang_from_state(data)
+    for item in items:
+        item.update(user_id=user.id, username=user.username or "", comment=contact, lang=lang)
+    return items
+
+async def save_bookings(items: List[Dict[str, Any]], notify_text: Optional[str] = None) -> List[int]:
+    """
+    Резервирует время всех заявок в availability (всё или ничего) и сохраняет их
+    вместе с уведомлением админам (outbox) и напоминаниями клиенту — одной транзакцией.
+    SlotTakenError — если хотя бы одно время уже занято.
+    """
+    await availability.ensure_loaded(item["date"] for item in items)
+    reserved: List[Dict[str, Any]] = []
+    for item in items:
+        if not availability.reserve(item["date"], item["time"], item["duration_min"]):
+            for r in reserved:
+                availability.release(r["date"], r["time"], r["duration_min"])
+            raise SlotTakenError(f"{item['date']} {item['time']}")
+        reserved.append(item)
+    notify = [(admin_id, notify_text) for admin_id in ADMIN_IDS] if notify_text else []
+    reminders = [
+        (index, kind, due_at, item.get("lang"))
+        for index, item in enumerate(items)
+        for kind, due_at in reminder_times(item["date"], item["time"], REMINDER_OFFSETS)
+    ]
+    try:
+        return await add_bookings(items, notify, reminders)
+    except SlotConflictError:
+        # время забронировал другой воркер — перечитаем эти дни из БД
+        for r in reserved:
+            availability.forget(r["date"])
+        raise SlotTakenError(", ".join(f"{r['date']} {r['time']}" for r in reserved))
+    except Exception:
+        for r in reserved:
+            availability.release(r["date"], r["time"], r["duration_min"])
+        raise
+
 # -----------------------------------------------------------------------------
 # Формирование текста сводки
 # -----------------------------------------------------------------------------
 def build_summary_text(data: Dict[str, Any], lang: str) -> str:
     svc_key = data.get("service")
+    return _summary_text(
+        lang,
+        svc_key,
+        int(data.get("duration_min", 60)),
+        state_price(data) if svc_key else 0,
+        data.get("date") or "—",
+        data.get("time") or "—",
+    )
+
+@render_cache
+def _summary_text(lang: str, svc_key: Optional[str], duration: int, price: int, date: str, time: str) -> str:
     svc_name = svc_title(svc_key, lang) if svc_key else "—"
-    duration = int(data.get("duration_min", 60))
-    price = calc_price(svc_key, duration) if svc_key else 0
-    date = data.get("date") or "—"
-    time = data.get("time") or "—"
     minutes_label = TEXT[lang].get("minutes", "min")
     return (
         f"{TEXT[lang]['summary_title']}\n"
@@ -299,23 +557,202 @@ def build_summary_text(data: Dict[str, Any], lang: str) -> str:
         f"• {date} {time}"
     )
 
+def confirmation_text(lang: str) -> str:
+    return f"{TEXT[lang]['booking_confirmed']}\n\n{TEXT[lang]['booking_saved']}\n\n{TEXT[lang]['booking_final_message']}"
+
+def admin_notify_text(data: Dict[str, Any], user: Any, contact: str, lang: str) -> str:
+    cart = data.get("cart") or []
+    if cart:
+        svc_lines = []
+        for idx, item in enumerate(cart, start=1):
+            svc_lines.append(f"{idx}. {svc_title(item['service'], lang)}, {item['duration_min']} {TEXT[lang]['minutes']}, €{item['price']}, {item['date']} {item['time']}")
+        return f"📋 New bookings from @{user.username}\nContact: {contact}\n\n" + "\n".join(svc_lines)
+    svc = data.get("service")
+    duration = int(data.get("duration_min", 60))
+    price = state_price(data)
+    return (
+        f"📋 New booking\n"
+        f"👤 @{user.username}\n"
+        f"💆‍♀️ {svc_title(svc, lang)}\n"
+        f"⏰ {duration} {TEXT[lang]['minutes']}, €{price}\n"
+        f"📅 {data['date']} {data['time']}\n"
+        f"📞 {contact}"
+    )
+
+# -----------------------------------------------------------------------------
+# Навигация: одна «карточка бронирования» на пользователя
+# -----------------------------------------------------------------------------
+# edit — шаги бронирования редактируют сообщение, на кнопку которого нажали
+#        (editMessageText/Caption/Media), новое сообщение — только если править нельзя;
+# send — каждый шаг отправляется новым сообщением.
+NAV_MODE = os.getenv("NAV_MODE", "edit")
+
+async def send_card(message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, photo: Optional[str] = None):
+    if photo and os.path.exists(photo):
+        try:
+            await media_cache.answer_photo(message, photo, caption=text, reply_markup=reply_markup)
+            return
+        except Exception:
+            logger.exception("Failed to send card image, sending text")
+    await message.answer(text, reply_markup=reply_markup)
+
+async def show_card(call: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, photo: Optional[str] = None):
+    msg = call.message
+    if photo and not os.path.exists(photo):
+        photo = None
+    if NAV_MODE == "edit":
+        try:
+            if msg.photo:
+                if photo and not media_cache.is_shown(msg, photo):
+                    await media_cache.edit_photo(msg, photo, caption=text, reply_markup=reply_markup)
+                else:
+                    # картинка та же (или шаг без картинки) — меняем только подпись
+                    await msg.edit_caption(caption=text, reply_markup=reply_markup)
+                return
+            if not photo:
+                await msg.edit_text(text, reply_markup=reply_markup)
+                return
+            # текстовое сообщение в фото не превратить — ниже отправим новое
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            logger.info("Cannot edit booking card (%s), sending a new one", e.message)
+    await send_card(msg, text, reply_markup, photo)
+
+async def show_calendar_card(call: CallbackQuery, data: Dict[str, Any], lang: str):
+    # сводка + длительности + календарь в одном сообщении
+    service = data["service"]
+    duration = int(data.get("duration_min", 60))
+    kb = join_kb(duration_kb(service, duration, lang), await calendar_markup(duration))
+    prompt = TEXT[lang]["calendar_prompt"].format(days=service_catalog.current.calendar_days)
+    await show_card(call, f"{build_summary_text(data, lang)}\n\n{prompt}", kb)
+
 # -----------------------------------------------------------------------------
 # Хендлеры
 # -----------------------------------------------------------------------------
+@dp.errors(ExceptionTypeFilter(ServiceUnavailableError))
+async def on_service_unavailable(event: ErrorEvent, state: FSMContext):
+    # услугу убрали из services.json, а в состоянии она осталась и цены для неё нет:
+    # возвращаем к выбору услуги, корзина сохраняется (цены её позиций уже записаны)
+    data = await state.get_data()
+    lang = get_lang_from_state(data)
+    await state.update_data(service=None, price=None, date=None, time=None)
+    await state.set_state(Flow.choosing_service)
+    call = event.update.callback_query
+    message = event.update.message or (call.message if call else None)
+    if call is not None:
+        try:
+            await call.answer()
+        except TelegramBadRequest:
+            pass
+    if message is not None:
+        await message.answer(TEXT[lang]["service_unavailable"], reply_markup=service_list_kb(lang))
+    return True
+
+# -----------------------------------------------------------------------------
+# Команды администратора
+# -----------------------------------------------------------------------------
+# регистрируются раньше хендлеров сценария: иначе команду админа посреди бронирования
+# перехватил бы, например, ввод контакта (Flow.entering_contact)
+@dp.message(Command("cancel"))
+async def cmd_cancel_booking(message: Message, command: CommandObject):
+    # только для администраторов: /cancel <id заявки>
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        booking_id = int((command.args or "").strip())
+    except ValueError:
+        await message.answer("Usage: /cancel <booking id>")
+        return
+    cancelled = await cancel_booking(booking_id)
+    if not cancelled:
+        await message.answer(f"#{booking_id}: not found or already cancelled")
+        return
+    availability.release(*cancelled)
+    await message.answer(f"#{booking_id} cancelled")
+
+@dp.message(Command("reload"))
+async def cmd_reload(message: Message):
+    # только для администраторов: перечитать services.json и locales/ без рестарта
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    services_ok = service_catalog.reload()
+    locales_ok = catalog.reload()
+    await message.answer(
+        f"services: {'v%s' % service_catalog.current.version if services_ok else 'error, see logs'}\n"
+        f"locales: {', '.join(catalog.languages) if locales_ok else 'error, see logs'}"
+    )
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message, command: CommandObject):
+    # только для администраторов: /stats [дней], /stats rebuild — пересчитать сводки
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    arg = (command.args or "").strip()
+    if arg == "rebuild":
+        await start_stats_backfill()
+        if RUN_BACKGROUND_JOBS:
+            stats_backfill.start()
+            await message.answer("Stats rebuild started")
+        elif stats_backfill.poll_interval:
+            # пересчитывает процесс с фоновыми задачами — он заметит отметку в базе
+            await message.answer(
+                f"Stats rebuild scheduled, the background-jobs process starts it within "
+                f"{stats_backfill.poll_interval:.0f}s"
+            )
+        else:
+            await message.answer("Stats rebuild scheduled, it starts on the next restart of the background-jobs process")
+        return
+    try:
+        days = int(arg) if arg else 30
+        if days <= 0:
+            raise ValueError
+    except ValueError:
+        await message.answer("Usage: /stats [days] | /stats rebuild")
+        return
+    report = await collect_stats(days)
+    await message.answer(format_stats(report, lambda key: svc_title(key, "en") if key else "—"))
+
+# Telegram не принимает от ботов документы больше 50 МБ
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+@dp.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    # только для администраторов: выгрузка заявок файлом (см. export.py)
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        fmt, flt = parse_export_args(command.args or "")
+    except ValueError as e:
+        await message.answer(f"{e}\nUsage: {EXPORT_USAGE}")
+        return
+    with tempfile.TemporaryDirectory(prefix="export-") as tmp:
+        filename = export_filename(fmt)
+        path = os.path.join(tmp, filename)
+        count = await export_to_file(path, fmt, flt)
+        if not count:
+            await message.answer("No bookings match the filter")
+            return
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_BYTES:
+            await message.answer(
+                f"Export is {size // (1024 * 1024)} MB, over the Telegram limit: "
+                "narrow the filter or run python export.py on the server"
+            )
+            return
+        # файл уходит с диска потоком — в памяти он целиком не держится
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"{count} bookings")
+
+# -----------------------------------------------------------------------------
+# Команды и шаги бронирования
+# -----------------------------------------------------------------------------
 @dp.message(F.text == "/start")
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
     await state.set_state(Flow.choosing_language)
-    # Показываем двуязычное приветствие с выбором языка
-    # Попытаемся отправить локальный баннер, если есть; иначе отправляем текст + клавиатуру
-    if os.path.exists(MAIN_BANNER_IMG):
-        try:
-            photo = FSInputFile(MAIN_BANNER_IMG)
-            await message.answer_photo(photo=photo, caption=TEXT["ru"]["greet_both"], reply_markup=lang_kb())
-            return
-        except Exception:
-            logger.exception("Failed to send local banner, sending text")
-    await message.answer(TEXT["ru"]["greet_both"], reply_markup=lang_kb())
+    # Показываем двуязычное приветствие с выбором языка (с баннером, если он есть).
+    # Это сообщение и станет карточкой бронирования.
+    await send_card(message, TEXT[catalog.default_lang]["greet_both"], lang_kb(), photo=MAIN_BANNER_IMG)
 
 @dp.message(F.text == "/info")
 async def cmd_info(message: Message, state: FSMContext):
@@ -345,68 +782,51 @@ async def cmd_menu(message: Message, state: FSMContext):
 
 @dp.callback_query(F.data.startswith("lang:"), Flow.choosing_language)
 async def set_language(call: CallbackQuery, state: FSMContext):
-    _, _, lang = call.data.partition(":")
-    if lang not in ("ru", "en"):
-        lang = "ru"
+    lang = catalog.lang(call.data.partition(":")[2])
     await state.update_data(lang=lang, cart=[])
     await state.set_state(Flow.choosing_service)
     await call.answer()
-    # Отправляем баннер (локальный если есть) и список услуг
-    if os.path.exists(MAIN_BANNER_IMG):
-        try:
-            await call.message.answer_photo(photo=FSInputFile(MAIN_BANNER_IMG), caption=TEXT[lang]["greet_caption"], reply_markup=service_list_kb(lang))
-            return
-        except Exception:
-            logger.exception("Failed to send local banner image")
-    await call.message.answer(TEXT[lang]["greet_caption"], reply_markup=service_list_kb(lang))
+    await show_card(call, TEXT[lang]["greet_caption"], service_list_kb(lang), photo=MAIN_BANNER_IMG)
 
 @dp.callback_query(F.data.startswith("svc:"), Flow.choosing_service)
 async def on_service_selected(call: CallbackQuery, state: FSMContext):
     _, _, key = call.data.partition(":")
     data = await state.get_data()
     lang = get_lang_from_state(data)
-    if key not in SERVICES:
+    snapshot = service_catalog.current
+    svc = snapshot.services.get(key)
+    if svc is None:
         await call.answer("Invalid service", show_alert=True)
         return
-    svc = SERVICES[key]
     caption = (
         f"{svc_title(key, lang)}\n\n"
         f"{svc_desc(key, lang)}\n\n"
         f"⏰ 60 {TEXT[lang]['minutes']} \n"
-        f"💰 €{svc['base_price_60']}"
+        f"💰 €{snapshot.price(key, 60)}"
     )
-    # сохраняем выбор услуги
-    await state.update_data(service=key, duration_min=60, username=call.from_user.username or "")
-    cart = (await state.get_data()).get("cart") or []
+    # сохраняем выбор услуги (и цену — на случай, если услугу уберут из каталога)
+    data = await state.update_data(
+        service=key, duration_min=60, price=snapshot.price(key, 60), username=call.from_user.username or ""
+    )
+    cart = data.get("cart") or []
     await call.answer()
-    # Отправляем локальное изображение, если существует
-    image_path = svc.get("image_path")
-    if image_path and os.path.exists(image_path):
-        try:
-            photo = FSInputFile(image_path)
-            await call.message.answer_photo(photo=photo, caption=caption, reply_markup=service_card_kb(key, lang, bool(cart)))
-            return
-        except Exception:
-            logger.exception("Error sending service image")
-    # fallback: текст и inline
-    await call.message.answer(caption, reply_markup=service_card_kb(key, lang, bool(cart)))
+    await show_card(call, caption, service_card_kb(key, lang, bool(cart)), photo=svc.image_path)
 
 @dp.callback_query(F.data.startswith("book:"), Flow.choosing_service)
 async def on_book_click(call: CallbackQuery, state: FSMContext):
     _, _, key = call.data.partition(":")
     data = await state.get_data()
     lang = get_lang_from_state(data)
-    if key not in SERVICES:
+    if key not in service_catalog.current.services:
         await call.answer("Invalid", show_alert=True)
         return
-    await state.update_data(service=key)
+    data = await state.update_data(service=key)
     await state.set_state(Flow.choosing_duration)
     await call.answer()
-    data = await state.get_data()
-    await call.message.answer(build_summary_text(data, lang), reply_markup=duration_kb(key, data.get("duration_min", 60), lang))
-    await call.message.answer(TEXT[lang]["calendar_prompt"], reply_markup=calendar_kb_4x(datetime.now()))
+    await show_calendar_card(call, data, lang)
 
 @dp.callback_query(F.data.startswith("dur:"), Flow.choosing_duration)
+@dp.callback_query(F.data.startswith("dur:"), Flow.choosing_datetime)
 async def on_duration_change(call: CallbackQuery, state: FSMContext):
     _, minutes = call.data.split(":", 1)
     try:
@@ -414,19 +834,30 @@ async def on_duration_change(call: CallbackQuery, state: FSMContext):
     except ValueError:
         await call.answer("Invalid", show_alert=True)
         return
-    await state.update_data(duration_min=minutes_int)
     data = await state.get_data()
+    data = await state.update_data(
+        duration_min=minutes_int, price=calc_price(data["service"], minutes_int)
+    )
     lang = get_lang_from_state(data)
-    await call.answer()
-    await call.message.answer(TEXT[lang]["updated"])
-    await call.message.answer(build_summary_text(data, lang), reply_markup=duration_kb(data["service"], minutes_int, lang))
-    if not data.get("date"):
+    await call.answer(TEXT[lang]["updated"])
+    if not data.get("date") or not data.get("time"):
         await state.set_state(Flow.choosing_datetime)
-        await call.message.answer(TEXT[lang]["calendar_prompt"], reply_markup=calendar_kb_4x(datetime.now()))
+        await show_calendar_card(call, data, lang)
     else:
         await state.set_state(Flow.summary)
         cart = data.get("cart") or []
-        await call.message.answer(build_summary_text(data, lang), reply_markup=summary_kb(lang, bool(cart)))
+        await show_card(call, build_summary_text(data, lang), summary_kb(lang, bool(cart)))
+
+@dp.callback_query(F.data == "cal:full")
+async def pick_full_date(call: CallbackQuery, state: FSMContext):
+    lang = get_lang_from_state(await state.get_data())
+    await call.answer(TEXT[lang]["day_full"], show_alert=True)
+
+@dp.callback_query(F.data == "nav:calendar", Flow.choosing_datetime)
+async def back_to_calendar(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await call.answer()
+    await show_calendar_card(call, data, get_lang_from_state(data))
 
 @dp.callback_query(F.data.startswith("cal:"), Flow.choosing_duration)
 @dp.callback_query(F.data.startswith("cal:"), Flow.choosing_datetime)
@@ -434,10 +865,15 @@ async def pick_date(call: CallbackQuery, state: FSMContext):
     _, _, iso = call.data.partition(":")
     data_prev = await state.get_data()
     lang = get_lang_from_state(data_prev)
-    await state.update_data(date=iso)
+    duration = int(data_prev.get("duration_min", 60))
+    kb = await slots_markup(iso, duration)
+    if not kb.inline_keyboard:
+        await call.answer(TEXT[lang]["day_full"], show_alert=True)
+        return
+    data = await state.update_data(date=iso, time=None)
     await state.set_state(Flow.choosing_datetime)
     await call.answer(f"📅 {iso}")
-    await call.message.answer(TEXT[lang]["slots_prompt"], reply_markup=slots_kb_for_date(iso))
+    await show_card(call, f"{build_summary_text(data, lang)}\n\n{TEXT[lang]['slots_prompt']}", join_kb(kb, back_kb(lang)))
 
 @dp.callback_query(F.data.startswith("dt:"), Flow.choosing_datetime)
 async def pick_datetime_one_step(call: CallbackQuery, state: FSMContext):
@@ -449,12 +885,18 @@ async def pick_datetime_one_step(call: CallbackQuery, state: FSMContext):
         return
     prev = await state.get_data()
     lang = get_lang_from_state(prev)
-    await state.update_data(date=date_iso, time=timestr)
+    duration = int(prev.get("duration_min", 60))
+    await availability.ensure_loaded([date_iso])
+    if not availability.is_free(date_iso, timestr, duration):
+        await call.answer(TEXT[lang]["slot_taken"], show_alert=True)
+        kb = join_kb(slots_kb_for_date(date_iso, duration), back_kb(lang))
+        await show_card(call, f"{build_summary_text(prev, lang)}\n\n{TEXT[lang]['slots_prompt']}", kb)
+        return
+    data = await state.update_data(date=date_iso, time=timestr)
     await state.set_state(Flow.summary)
     await call.answer(f"🕐 {date_iso} {timestr}")
-    data = await state.get_data()
     cart = data.get("cart") or []
-    await call.message.answer(build_summary_text(data, lang), reply_markup=summary_kb(lang, bool(cart)))
+    await show_card(call, build_summary_text(data, lang), summary_kb(lang, bool(cart)))
 
 @dp.callback_query(F.data == "cart:add", F.state.in_({Flow.summary, Flow.choosing_service, Flow.choosing_duration}))
 async def add_current_to_cart(call: CallbackQuery, state: FSMContext):
@@ -468,7 +910,7 @@ async def add_current_to_cart(call: CallbackQuery, state: FSMContext):
         "duration_min": int(data.get("duration_min", 60)),
         "date": data["date"],
         "time": data["time"],
-        "price": calc_price(data["service"], int(data.get("duration_min", 60))),
+        "price": state_price(data),
     }
     cart = data.get("cart") or []
     cart.append(item)
@@ -478,28 +920,30 @@ async def add_current_to_cart(call: CallbackQuery, state: FSMContext):
     kb = InlineKeyboardBuilder()
     kb.button(text=TEXT[lang]["view_cart"], callback_data="cart:view")
     kb.adjust(1)
-    await call.message.answer(TEXT[lang]["added_to_cart"], reply_markup=kb.as_markup())
+    await show_card(call, TEXT[lang]["added_to_cart"], kb.as_markup())
 
-@dp.callback_query(F.data == "cart:view")
-async def view_cart(call: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
+async def show_cart(call: CallbackQuery, state: FSMContext, data: Dict[str, Any]):
     lang = get_lang_from_state(data)
     cart = data.get("cart") or []
     await state.set_state(Flow.viewing_cart)
-    await call.answer()
     if not cart:
-        await call.message.answer(TEXT[lang]["no_bookings"])
+        await show_card(call, TEXT[lang]["no_bookings"])
         return
     lines = [TEXT[lang]["view_cart"], ""]
     for idx, item in enumerate(cart):
         svc_name = svc_title(item["service"], lang)
         lines.append(f"{idx+1}. {svc_name}, {item['duration_min']} {TEXT[lang].get('minutes','min')}, €{item['price']}, {item['date']} {item['time']}")
-    kb = cart_items_kb(cart, lang)
-    await call.message.answer("\n".join(lines), reply_markup=kb)
+    await show_card(call, "\n".join(lines), cart_items_kb(cart, lang))
+
+@dp.callback_query(F.data == "cart:view")
+async def view_cart(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await call.answer()
+    await show_cart(call, state, data)
 
 @dp.callback_query(F.data.startswith("cart:del:"), Flow.viewing_cart)
 async def cart_delete_item(call: CallbackQuery, state: FSMContext):
-    _, _, idx_str = call.data.partition(":")
+    _, _, idx_str = call.data.rpartition(":")
     try:
         idx = int(idx_str)
     except ValueError:
@@ -509,9 +953,9 @@ async def cart_delete_item(call: CallbackQuery, state: FSMContext):
     cart = data.get("cart") or []
     if 0 <= idx < len(cart):
         cart.pop(idx)
-    await state.update_data(cart=cart)
+    data = await state.update_data(cart=cart)
     await call.answer()
-    await view_cart(call, state)
+    await show_cart(call, state, data)
 
 @dp.callback_query(F.data == "cart:checkout", Flow.viewing_cart)
 async def cart_checkout(call: CallbackQuery, state: FSMContext):
@@ -524,13 +968,8 @@ async def cart_checkout(call: CallbackQuery, state: FSMContext):
     username = call.from_user.username or ""
     await state.update_data(username=username)
     await state.set_state(Flow.entering_contact)
-    kb = InlineKeyboardBuilder()
-    if username:
-        kb.button(text=TEXT[lang]["use_username"].format(username=username), callback_data=f"use_contact:@{username}")
-    kb.button(text=TEXT[lang]["enter_contact"], callback_data="enter_contact_manual")
-    kb.adjust(1)
     await call.answer()
-    await call.message.answer(TEXT[lang]["choose_contact"], reply_markup=kb.as_markup())
+    await show_card(call, TEXT[lang]["choose_contact"], contact_kb(lang, username, False))
 
 @dp.callback_query(F.data == "enter_contact_manual", Flow.entering_contact)
 async def enter_contact_manual_cb(call: CallbackQuery, state: FSMContext):
@@ -538,7 +977,7 @@ async def enter_contact_manual_cb(call: CallbackQuery, state: FSMContext):
     lang = get_lang_from_state(data)
     await state.set_state(Flow.entering_contact)
     await call.answer()
-    await call.message.answer(TEXT[lang]["choose_contact"])
+    await show_card(call, TEXT[lang]["choose_contact"])
 
 @dp.callback_query(F.data.startswith("use_contact:"), Flow.entering_contact)
 async def use_contact_cb(call: CallbackQuery, state: FSMContext):
@@ -557,55 +996,43 @@ async def use_contact_cb(call: CallbackQuery, state: FSMContext):
         return
     
     saved_ok = True
+    slot_taken = False
+    # ServiceUnavailableError (услугу убрали из каталога) — вне try: её обрабатывает on_service_unavailable
+    notify_text = admin_notify_text(data, call.from_user, contact_value, lang)
+    items = booking_items(data, call.from_user, contact_value)
     try:
-        if has_cart_items:
-            # Отправляем все позиции из корзины админам
-            svc_lines = []
-            for idx, item in enumerate(cart, start=1):
-                svc_lines.append(f"{idx}. {svc_title(item['service'], lang)}, {item['duration_min']} {TEXT[lang]['minutes']}, €{item['price']}, {item['date']} {item['time']}")
-            notify_text = f"📋 New bookings from @{call.from_user.username}\nContact: {contact_value}\n\n" + "\n".join(svc_lines)
-        else:
-            # Отправляем одиночную заявку
-            svc = data.get("service")
-            duration = int(data.get("duration_min", 60))
-            price = calc_price(svc, duration)
-            notify_text = (
-                f"📋 New booking\n"
-                f"👤 @{call.from_user.username}\n"
-                f"💆‍♀️ {svc_title(svc, lang)}\n"
-                f"⏰ {duration} {TEXT[lang]['minutes']}, €{price}\n"
-                f"📅 {data['date']} {data['time']}\n"
-                f"📞 {contact_value}"
-            )
-        
-        for admin in ADMIN_IDS:
-            try:
-                await bot.send_message(admin, notify_text)
-            except Exception:
-                logger.exception("Failed to notify admin")
+        # вся корзина и уведомления админам сохраняются одной транзакцией;
+        # не ждём Telegram: уведомления доставляет outbox
+        await save_bookings(items, notify_text)
+    except SlotTakenError:
+        slot_taken = True
     except Exception:
         saved_ok = False
         logger.exception("Error sending bookings to admins")
     
     await call.answer()
+    if slot_taken:
+        await offer_other_time(call.message, state, data, lang)
+        return
     if saved_ok:
-        # показать картинку подтверждения, если есть
-        if os.path.exists(CONFIRM_IMG):
-            try:
-                await call.message.answer_photo(photo=FSInputFile(CONFIRM_IMG), caption=TEXT[lang]["booking_confirmed"])
-            except Exception:
-                logger.exception("Failed sending confirmation image")
-                await call.message.answer(TEXT[lang]["booking_confirmed"])
-        else:
-            await call.message.answer(TEXT[lang]["booking_confirmed"])
-        await call.message.answer(TEXT[lang]["booking_saved"])
-        await call.message.answer(TEXT[lang]["booking_final_message"])
-        # очистка корзины
-        await state.update_data(cart=[])
+        # карточка превращается в подтверждение (с картинкой, если есть)
+        await show_card(call, confirmation_text(lang), photo=CONFIRM_IMG)
     else:
-        await call.message.answer("Ошибка при отправке. Попробуйте позже.")
+        await show_card(call, "Ошибка при отправке. Попробуйте позже.")
     await state.clear()
 
+async def offer_other_time(message: Message, state: FSMContext, data: Dict[str, Any], lang: str):
+    """Время заняли между выбором и отправкой: корзину — на редактирование, одиночную заявку — в календарь."""
+    cart = data.get("cart") or []
+    if cart:
+        await state.set_state(Flow.viewing_cart)
+        await message.answer(TEXT[lang]["slot_taken"], reply_markup=cart_items_kb(cart, lang))
+        return
+    await state.update_data(date=None, time=None)
+    await state.set_state(Flow.choosing_datetime)
+    await message.answer(TEXT[lang]["slot_taken"])
+    await message.answer(TEXT[lang]["calendar_prompt"].format(days=service_catalog.current.calendar_days), reply_markup=await calendar_markup(int(data.get("duration_min", 60))))
+
 @dp.message(Flow.entering_contact)
 async def entering_contact_message(message: Message, state: FSMContext):
     data = await state.get_data()
@@ -615,71 +1042,22 @@ async def entering_contact_message(message: Message, state: FSMContext):
     if not contact:
         contact = data.get("username", "")
     cart = data.get("cart") or []
-    if cart:
-        # Отправляем все позиции админам
-        try:
-            svc_lines = []
-            for idx, item in enumerate(cart, start=1):
-                svc_lines.append(f"{idx}. {svc_title(item['service'], lang)}, {item['duration_min']} {TEXT[lang]['minutes']}, €{item['price']}, {item['date']} {item['time']}")
-            notify_text = f"📋 New bookings from @{message.from_user.username}\nContact: {contact}\n\n" + "\n".join(svc_lines)
-            for admin in ADMIN_IDS:
-                try:
-                    await bot.send_message(admin, notify_text)
-                except Exception:
-                    logger.exception("Failed send admin (manual contact, cart)")
-            # подтверждение пользователю
-            if os.path.exists(CONFIRM_IMG):
-                try:
-                    await message.answer_photo(photo=FSInputFile(CONFIRM_IMG), caption=TEXT[lang]["booking_confirmed"])
-                except Exception:
-                    logger.exception("Failed to send confirmation image (manual cart)")
-                    await message.answer(TEXT[lang]["booking_confirmed"])
-            else:
-                await message.answer(TEXT[lang]["booking_confirmed"])
-            await message.answer(TEXT[lang]["booking_saved"])
-            await message.answer(TEXT[lang]["booking_final_message"])
-            await state.update_data(cart=[])
-        except Exception:
-            logger.exception("Error processing cart checkout (manual contact)")
-            await message.answer("Ошибка при отправке. Попробуйте позже.")
-        await state.clear()
-        return
     # Если cart пуст — одиночная заявка (Book now)
-    svc = data.get("service")
-    if not svc or not data.get("date") or not data.get("time"):
+    if not cart and (not data.get("service") or not data.get("date") or not data.get("time")):
         await message.answer(TEXT[lang]["need_date_time"])
         await state.clear()
         return
-    duration = int(data.get("duration_min", 60))
-    price = calc_price(svc, duration)
-    # Отправляем админам уведомление
+    notify_text = admin_notify_text(data, message.from_user, contact, lang)
+    items = booking_items(data, message.from_user, contact)
     try:
-        notify_text = (
-            f"📋 New booking\n"
-            f"👤 @{message.from_user.username}\n"
-            f"💆‍♀️ {svc_title(svc, lang)}\n"
-            f"⏰ {duration} {TEXT['en']['minutes']}, €{price}\n"
-            f"📅 {data['date']} {data['time']}\n"
-            f"📞 {contact}"
-        )
-        for admin in ADMIN_IDS:
-            try:
-                await bot.send_message(admin, notify_text)
-            except Exception:
-                logger.exception("Failed to send admin notification (single manual contact)")
-        # подтверждение пользователю
-        if os.path.exists(CONFIRM_IMG):
-            try:
-                await message.answer_photo(photo=FSInputFile(CONFIRM_IMG), caption=TEXT[lang]["booking_confirmed"])
-            except Exception:
-                logger.exception("Failed to send confirmation image (single manual contact)")
-                await message.answer(TEXT[lang]["booking_confirmed"])
-        else:
-            await message.answer(TEXT[lang]["booking_confirmed"])
-        await message.answer(TEXT[lang]["booking_saved"])
-        await message.answer(TEXT[lang]["booking_final_message"])
+        await save_bookings(items, notify_text)
+        # подтверждение пользователю — одним сообщением
+        await send_card(message, confirmation_text(lang), photo=CONFIRM_IMG)
+    except SlotTakenError:
+        await offer_other_time(message, state, data, lang)
+        return
     except Exception:
-        logger.exception("Error saving single booking (manual contact)")
+        logger.exception("Error saving booking (manual contact)")
         await message.answer("Ошибка при отправке. Попробуйте позже.")
     await state.clear()
 
@@ -693,14 +1071,8 @@ async def submit_now(call: CallbackQuery, state: FSMContext):
     username = call.from_user.username or ""
     await state.update_data(username=username)
     await state.set_state(Flow.entering_contact)
-    kb = InlineKeyboardBuilder()
-    if username:
-        kb.button(text=TEXT[lang]["use_username"].format(username=username), callback_data=f"use_contact:@{username}")
-    kb.button(text=TEXT[lang]["enter_contact"], callback_data="enter_contact_manual")
-    kb.button(text=TEXT[lang]["cancel_back"], callback_data="nav:back")
-    kb.adjust(1)
     await call.answer()
-    await call.message.answer(TEXT[lang]["choose_contact"], reply_markup=kb.as_markup())
+    await show_card(call, TEXT[lang]["choose_contact"], contact_kb(lang, username, True))
 
 @dp.callback_query(F.data == "nav:back")
 async def nav_back(call: CallbackQuery, state: FSMContext):
@@ -708,23 +1080,211 @@ async def nav_back(call: CallbackQuery, state: FSMContext):
     lang = get_lang_from_state(data)
     await state.set_state(Flow.choosing_service)
     await call.answer()
-    await call.message.answer(TEXT[lang]["choose_service"], reply_markup=service_list_kb(lang))
+    await show_card(call, TEXT[lang]["choose_service"], service_list_kb(lang))
+
+async def bookings_page(user_id: int, lang: str, before_id: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    # берём на одну строку больше, чтобы понять, есть ли следующая страница
+    rows = await get_bookings_by_user(user_id, before_id=before_id, limit=BOOKINGS_PAGE_SIZE + 1)
+    has_more = len(rows) > BOOKINGS_PAGE_SIZE
+    rows = rows[:BOOKINGS_PAGE_SIZE]
+    if not rows:
+        return TEXT[lang]["no_bookings"], None
+    lines = [TEXT[lang]["my_bookings_title"], ""]
+    for booking_id, svc, duration, price, date, time, status, _created_at in rows:
+        svc_name = svc_title(svc, lang) if svc in service_catalog.current.services else (svc or "—")
+        lines.append(f"#{booking_id} {svc_name}, {duration} {TEXT[lang]['minutes']}, €{price}, {date} {time} — {status}")
+    b = InlineKeyboardBuilder()
+    if before_id is not None:
+        b.button(text=TEXT[lang]["newest"], callback_data="my:page:")
+    if has_more:
+        b.button(text=TEXT[lang]["older"], callback_data=f"my:page:{rows[-1][0]}")
+    b.adjust(2)
+    return "\n".join(lines), b.as_markup() if (has_more or before_id is not None) else None
 
 @dp.message(F.text.in_({"Мои заявки", "/my", "My bookings", "/mybookings"}))
-async def my_bookings(message: Message):
-    # БД отключена: сообщаем пользователю, что просмотр заявок недоступен
-    await message.answer("📝 Ведение истории заявок локально отключено. Все заявки отправлены администраторам.")
+async def my_bookings(message: Message, state: FSMContext):
+    lang = get_lang_from_state(await state.get_data())
+    text, kb = await bookings_page(message.from_user.id, lang)
+    await message.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("my:page:"))
+async def my_bookings_page(call: CallbackQuery, state: FSMContext):
+    _, _, cursor = call.data.partition("my:page:")
+    try:
+        before_id = int(cursor) if cursor else None
+    except ValueError:
+        await call.answer("Invalid", show_alert=True)
+        return
+    lang = get_lang_from_state(await state.get_data())
+    text, kb = await bookings_page(call.from_user.id, lang, before_id)
+    await call.answer()
+    await call.message.edit_text(text, reply_markup=kb)
 
 # -----------------------------------------------------------------------------
-# Запуск поллинга
+# Запуск: поллинг или webhook
 # -----------------------------------------------------------------------------
+def build_webhook_app(secret_token: Optional[str] = None) -> web.Application:
+    """
+    aiohttp-приложение для webhook-режима. Апдейты обрабатываются в фоне
+    (handle_in_background): Telegram получает ответ сразу, хендлеры разных
+    апдейтов идут параллельно; несколько инстансов можно ставить за балансировщик
+    с маршрутизацией по user_id — кэш FSM и защита от повторов у каждого свои
+    (с SHARED_DB=1, фоновые задачи — только у одного, см. RUN_BACKGROUND_JOBS).
+    Апдейты без верного X-Telegram-Bot-Api-Secret-Token отклоняются (401).
+    """
+    secret_token = secret_token or WEBHOOK_SECRET
+    if not secret_token:
+        raise RuntimeError("Webhook handler requires a secret token")
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+    ).register(app, path=WEBHOOK_PATH)
+    if not METRICS_PORT:
+        app.router.add_get("/metrics", metrics_handler)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def serve(runner: web.AppRunner, site: web.BaseSite) -> None:
+    await site.start()
+    try:
+        await wait_for_signal()
+        # новые соединения не принимаем; апдейты, уже пришедшие по открытым, дорабатывают
+        await site.stop()
+        await lifecycle.drain()
+    finally:
+        await runner.cleanup()
+
+async def run_webhook():
+    runner = web.AppRunner(build_webhook_app())
+    await runner.setup()
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    logger.info("Webhook server listening on %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+    await serve(runner, web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT))
+
+async def run_worker():
+    # тот же обработчик вебхука, но на unix-сокете: апдейты шлёт supervisor.py
+    runner = web.AppRunner(build_webhook_app(WORKER_SECRET), access_log=None)
+    await runner.setup()
+    if os.path.exists(WORKER_SOCKET):
+        os.unlink(WORKER_SOCKET)
+    logger.info("Worker %s listening on %s", WORKER_INDEX, WORKER_SOCKET)
+    await serve(runner, web.UnixSite(runner, WORKER_SOCKET))
+
+async def run_polling():
+    # после webhook-режима Telegram не отдаёт getUpdates, пока вебхук не снят
+    await bot.delete_webhook()
+    # сессию закрываем сами — после того, как доработают хендлеры и уйдут уведомления
+    await dp.start_polling(bot, close_bot_session=False)
+    await lifecycle.drain()
+    # throttle — первая outer-middleware: видит и апдейты, отброшенные лимитами
+    last_update_id = throttle.last_update_id
+    if last_update_id is not None:
+        # offset подтверждается только следующим getUpdates — без него последняя
+        # пачка пришла бы ещё раз после рестарта
+        try:
+            await bot.get_updates(offset=last_update_id + 1, limit=1, timeout=0)
+        except Exception:
+            logger.warning("Failed to confirm the last update offset", exc_info=True)
+
+async def wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    await stop.wait()
+
+# -----------------------------------------------------------------------------
+# Прогрев кэшей при старте
+# -----------------------------------------------------------------------------
+async def warm_images():
+    # уменьшенные копии картинок (пересобираются только изменившиеся); Pillow работает в потоке.
+    # Строит и чистит кэш один процесс на базу, остальные берут готовые варианты
+    reports = await asyncio.to_thread(ImageOptimizer().prepare_dir, IMG_DIR, RUN_BACKGROUND_JOBS)
+    media_cache.use_variants(variants_map(reports))
+
+def warm_keyboards():
+    snapshot = service_catalog.current
+    lang_kb()
+    for lang in catalog.languages:
+        service_list_kb(lang)
+        back_kb(lang)
+        for cart_exists in (False, True):
+            summary_kb(lang, cart_exists)
+        for key in snapshot.services:
+            for cart_exists in (False, True):
+                service_card_kb(key, lang, cart_exists)
+            for minutes in snapshot.durations:
+                duration_kb(key, minutes, lang)
+
+async def warm_calendar():
+    # занятость ближайших дней из базы и календари для всех длительностей
+    for minutes in service_catalog.current.durations:
+        await calendar_markup(minutes)
+
+# file_id картинок, загруженных в прошлых запусках
+lifecycle.on_warmup("media", media_cache.load)
+lifecycle.on_warmup("images", warm_images)
+lifecycle.on_warmup("keyboards", warm_keyboards)
+lifecycle.on_warmup("calendar", warm_calendar)
+# getMe нужен и поллингу, и первому хендлеру — берём заранее
+lifecycle.on_warmup("bot", bot.me)
+
 async def main():
-    # Никакой инициализации БД — она отсутствует
-    logger.info("Starting bot (no DB). Admins: %s", ADMIN_IDS)
-    await dp.start_polling(bot)
+    started = time.perf_counter()
+    await init_db()
+    logger.info("Starting bot (%s). Admins: %s", BOT_MODE, ADMIN_IDS)
+    await lifecycle.warm_up()
+    if RUN_BACKGROUND_JOBS:
+        await notifier.start()
+        # доставка продолжится с того места, где её прервал прошлый запуск
+        outbox.start()
+        reminder_scheduler.start()
+        # незаконченный пересчёт сводок (например, сразу после миграции)
+        stats_backfill.start()
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    i18n_watcher = asyncio.create_task(catalog.watch(I18N_RELOAD_INTERVAL)) if I18N_RELOAD_INTERVAL > 0 else None
+    services_watcher = (
+        asyncio.create_task(service_catalog.watch(SERVICES_RELOAD_INTERVAL)) if SERVICES_RELOAD_INTERVAL > 0 else None
+    )
+    logger.info("Ready in %.0f ms", (time.perf_counter() - started) * 1000)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        elif IS_WORKER:
+            await run_worker()
+        else:
+            await run_polling()
+    finally:
+        # приём апдейтов уже остановлен; если выходим по ошибке — дожидаемся начатых хендлеров
+        await lifecycle.drain()
+        for watcher in (i18n_watcher, services_watcher):
+            if watcher is not None:
+                watcher.cancel()
+        # состояния FSM, записанные дорабатывавшими хендлерами
+        await dp.storage.close()
+        await stats_backfill.stop()
+        await reminder_scheduler.stop(lifecycle.remaining())
+        await outbox.stop(lifecycle.remaining())
+        await notifier.stop(lifecycle.remaining())
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_db(lifecycle.remaining())
+        await bot.session.close()
+        logger.info("Bot stopped")
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
-    except (KeyboardInterrupt, SystemExit):
-        logger.info("Shutting down bot")
+    except KeyboardInterrupt:
+        # Ctrl+C до установки обработчиков сигналов: остановка уже прошла в finally main()
+        pass
@@ -0,0 +1,236 @@
+# media.py
+"""
+Кэш Telegram file_id для локальных картинок.
+
+Каждая картинка из images/ загружается в Telegram один раз; полученный file_id
+сохраняется в JSON-файл (переживает рестарты) и переиспользуется дальше.
+Запись инвалидируется, если у файла поменялись mtime/размер и содержимое (sha1).
+
+Если для картинки собран оптимизированный вариант (imaging.py), вместо исходника
+загружается он: хендлеры по-прежнему передают путь из images/.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto, Message
+
+logger = logging.getLogger("booking-bot.media")
+
+BASE_DIR = os.path.dirname(__file__)
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", os.path.join(BASE_DIR, "runtime", "media_cache.json"))
+
+
+def file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MediaCache:
+    """
+    path -> {"file_id", "file_unique_id", "mtime_ns", "size", "sha1"}.
+    file_id привязан к боту, поэтому в файле хранится и bot_id: при смене токена кэш сбрасывается.
+    """
+
+    def __init__(self, cache_path: str = MEDIA_CACHE_PATH):
+        self.cache_path = cache_path
+        self.bot_id: Optional[int] = None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # путь -> file_id, который этот процесс удалил: при слиянии с файлом
+        # такая запись не должна вернуться из копии другого процесса
+        self._removed: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._loaded = False
+        # исходник -> оптимизированный вариант
+        self._variants: Dict[str, str] = {}
+
+    # -------------------------------------------------------------------------
+    # Персистентность
+    # -------------------------------------------------------------------------
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def load(self) -> None:
+        self._loaded = True
+        try:
+            raw = self._read()
+        except Exception:
+            logger.exception("Failed to read media cache %s, starting empty", self.cache_path)
+            return
+        self.bot_id = raw.get("bot_id")
+        self._entries = raw.get("entries") or {}
+
+    def _save(self) -> None:
+        # файл общий для воркеров supervisor.py: временный файл — свой у каждого процесса,
+        # а записи, сохранённые другими процессами, подмешиваются перед записью
+        # (кроме удалённых здесь — иначе invalidate() откатился бы)
+        tmp = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            try:
+                raw = self._read()
+            except ValueError:
+                raw = {}
+            if raw.get("bot_id") == self.bot_id:
+                merged = dict(raw.get("entries") or {})
+                for path, file_id in self._removed.items():
+                    if (merged.get(path) or {}).get("file_id") == file_id:
+                        del merged[path]
+                merged.update(self._entries)
+                self._entries = merged
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"bot_id": self.bot_id, "entries": self._entries}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.cache_path)
+        except Exception:
+            logger.exception("Failed to persist media cache")
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def _ensure_bot(self, bot_id: int) -> None:
+        if not self._loaded:
+            self.load()
+        if self.bot_id != bot_id:
+            # file_id от другого бота не годится
+            if self._entries:
+                logger.info("Media cache belongs to another bot, dropping %d entries", len(self._entries))
+            self.bot_id = bot_id
+            self._entries = {}
+
+    # -------------------------------------------------------------------------
+    # Поиск / запись
+    # -------------------------------------------------------------------------
+    def get(self, path: str) -> Optional[str]:
+        """Актуальный file_id для файла или None (файл изменился / ещё не загружался)."""
+        entry = self._entries.get(path)
+        if not entry:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_mtime_ns == entry.get("mtime_ns") and st.st_size == entry.get("size"):
+            return entry["file_id"]
+        # mtime поменялся — проверяем, изменилось ли содержимое на самом деле
+        try:
+            digest = file_sha1(path)
+        except OSError:
+            return None
+        if digest == entry.get("sha1"):
+            entry["mtime_ns"] = st.st_mtime_ns
+            entry["size"] = st.st_size
+            self._save()
+            return entry["file_id"]
+        logger.info("Image %s changed, file_id invalidated", path)
+        self._forget(path)
+        self._save()
+        return None
+
+    def put(self, path: str, file_id: str, file_unique_id: Optional[str] = None) -> None:
+        try:
+            st = os.stat(path)
+            digest = file_sha1(path)
+        except OSError:
+            return
+        self._entries[path] = {
+            "file_id": file_id,
+            "file_unique_id": file_unique_id,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "sha1": digest,
+        }
+        self._removed.pop(path, None)
+        self._save()
+
+    def use_variants(self, variants: Dict[str, str]) -> None:
+        """Подменяет исходники оптимизированными вариантами при отправке."""
+        self._variants = dict(variants)
+
+    def _forget(self, path: str) -> bool:
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return False
+        self._removed[path] = entry["file_id"]
+        return True
+
+    def invalidate(self, path: str) -> None:
+        if self._forget(path):
+            self._save()
+
+    # -------------------------------------------------------------------------
+    # Отправка
+    # -------------------------------------------------------------------------
+    async def answer_photo(self, message: Message, path: str, **kwargs: Any) -> Message:
+        """
+        Аналог message.answer_photo(FSInputFile(path)), но файл загружается только
+        при первом вызове, дальше отправляется по file_id.
+        """
+        self._ensure_bot(message.bot.id)
+        path = self._variants.get(path, path)
+        file_id = self.get(path)
+        if file_id:
+            try:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            except TelegramBadRequest:
+                # file_id протух на стороне Telegram — перезагружаем
+                logger.warning("Cached file_id for %s rejected, re-uploading", path)
+                self.invalidate(path)
+
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            # пока ждали, файл мог загрузить параллельный хендлер
+            file_id = self.get(path)
+            if file_id:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            sent = await message.answer_photo(photo=FSInputFile(path), **kwargs)
+            if sent.photo:
+                self.put(path, sent.photo[-1].file_id, sent.photo[-1].file_unique_id)
+            return sent
+
+    def is_shown(self, message: Message, path: str) -> bool:
+        """Показывает ли сообщение уже эту картинку (тогда достаточно править подпись)."""
+        path = self._variants.get(path, path)
+        if not message.photo or not self.get(path):
+            return False
+        unique_id = self._entries[path].get("file_unique_id")
+        return bool(unique_id) and message.photo[-1].file_unique_id == unique_id
+
+    async def edit_photo(self, message: Message, path: str, caption: Optional[str] = None, **kwargs: Any) -> Union[Message, bool]:
+        """Заменяет картинку и подпись в существующем сообщении (editMessageMedia)."""
+        self._ensure_bot(message.bot.id)
+        path = self._variants.get(path, path)
+        file_id = self.get(path)
+        if file_id:
+            try:
+                return await message.edit_media(media=InputMediaPhoto(media=file_id, caption=caption), **kwargs)
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    raise
+                logger.warning("Cached file_id for %s rejected on edit, re-uploading", path)
+                self.invalidate(path)
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            # как и в answer_photo: файл грузим один раз, остальные ждут file_id
+            file_id = self.get(path)
+            if file_id:
+                return await message.edit_media(media=InputMediaPhoto(media=file_id, caption=caption), **kwargs)
+            result = await message.edit_media(media=InputMediaPhoto(media=FSInputFile(path), caption=caption), **kwargs)
+            if isinstance(result, Message) and result.photo:
+                self.put(path, result.photo[-1].file_id, result.photo[-1].file_unique_id)
+            return result
+
+
+media_cache = MediaCache()
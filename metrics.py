@@ -0,0 +1,293 @@
+# metrics.py
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+ - HandlerMetricsMiddleware — латентность и ошибки хендлеров (по имени функции);
+ - ApiMetricsMiddleware — вызовы Bot API: число, латентность, коды ошибок по методам;
+ - TimedStorage — время операций FSM-хранилища;
+ - metrics_handler — aiohttp-эндпоинт /metrics.
+
+Запись метрики — поиск в dict и bisect по границам бакетов, без блокировок:
+всё работает в одном event loop, поэтому накладные расходы копеечные.
+"""
+
+import bisect
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramConflictError,
+    TelegramEntityTooLarge,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+    TelegramUnauthorizedError,
+)
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# -----------------------------------------------------------------------------
+# Типы метрик
+# -----------------------------------------------------------------------------
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_fmt(value)}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по бакетам (последний — +Inf), сумма]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_fmt(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_fmt(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class CallbackMetric:
+    """Значение читается в момент выдачи /metrics (глубина очереди, счётчики других модулей)."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float], type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.type = type
+
+    def samples(self) -> Iterable[str]:
+        yield f"{self.name} {_fmt(self.fn())}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge_fn(self, name: str, help: str, fn: Callable[[], float]) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, fn))
+
+    def counter_fn(self, name: str, help: str, fn: Callable[[], float]) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, fn, type="counter"))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_SECONDS = registry.histogram("bot_handler_seconds", "Handler latency by handler name", ("handler",))
+HANDLER_ERRORS = registry.counter("bot_handler_errors_total", "Exceptions raised by handlers", ("handler", "error"))
+API_SECONDS = registry.histogram("bot_api_request_seconds", "Bot API request latency by method", ("method",))
+API_ERRORS = registry.counter("bot_api_errors_total", "Bot API errors by method and code", ("method", "code"))
+FSM_SECONDS = registry.histogram("bot_fsm_storage_seconds", "FSM storage operation time", ("op",), FAST_BUCKETS)
+
+_started = time.time()
+registry.gauge_fn("bot_start_time_seconds", "Unix time the process started", lambda: _started)
+
+
+# -----------------------------------------------------------------------------
+# Хендлеры
+# -----------------------------------------------------------------------------
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner-middleware (dp.message.middleware / dp.callback_query.middleware):
+    к этому моменту фильтры пройдены и в data["handler"] лежит выбранный хендлер.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+# -----------------------------------------------------------------------------
+# Bot API
+# -----------------------------------------------------------------------------
+ERROR_CODES = (
+    (TelegramRetryAfter, "429"),
+    (TelegramBadRequest, "400"),
+    (TelegramUnauthorizedError, "401"),
+    (TelegramForbiddenError, "403"),
+    (TelegramNotFound, "404"),
+    (TelegramConflictError, "409"),
+    (TelegramEntityTooLarge, "413"),
+    (TelegramServerError, "5xx"),
+    (TelegramNetworkError, "network"),
+)
+
+
+def error_code(e: Exception) -> str:
+    for exc_type, code in ERROR_CODES:
+        if isinstance(e, exc_type):
+            return code
+    return type(e).__name__
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: bot.session.middleware(ApiMetricsMiddleware())."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, error_code(e))
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, name)
+
+
+# -----------------------------------------------------------------------------
+# FSM
+# -----------------------------------------------------------------------------
+class TimedStorage(BaseStorage):
+    """Обёртка над FSM-хранилищем, замеряющая время каждой операции."""
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+
+    def __getattr__(self, name: str) -> Any:
+        # flush() и прочее, чего нет в BaseStorage
+        return getattr(self.storage, name)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        started = time.perf_counter()
+        try:
+            await self.storage.set_state(key, state)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "set_state")
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            return await self.storage.get_state(key)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "get_state")
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        try:
+            await self.storage.set_data(key, data)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "set_data")
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            return await self.storage.get_data(key)
+        finally:
+            FSM_SECONDS.observe(time.perf_counter() - started, "get_data")
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+
+# -----------------------------------------------------------------------------
+# HTTP
+# -----------------------------------------------------------------------------
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный маленький сервер для /metrics (в polling-режиме)."""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,249 @@
+# middlewares.py
+"""
+Middleware диспетчера, защищающие хендлеры от конкурентных и повторных апдейтов.
+
+UpdateGuardMiddleware (dp.update.outer_middleware):
+ - отбрасывает повторно доставленные апдейты (тот же update_id) и повторные
+   нажатия одной и той же кнопки в течение dedup_window секунд;
+ - обрабатывает апдейты одного пользователя строго по очереди (per-user
+   asyncio.Lock), разные пользователи идут параллельно. Хендлеры делают
+   read-modify-write над данными FSM (корзина), так что параллельные апдейты
+   одного пользователя иначе могли бы затирать друг друга.
+
+ThrottleMiddleware (dp.update.outer_middleware, раньше UpdateGuardMiddleware):
+ - token bucket на пользователя и правило: правила задаются по префиксу
+   команды/callback-данных ("/start", "svc:", "cal:", "dt:"), остальное — по "*";
+ - общий лимит апдейтов в обработке: при перегрузке новые апдейты сразу
+   отбрасываются (нажатию отвечаем пустым call.answer()), чтобы один клиент
+   не мог поднять латентность всем остальным;
+ - запоминает наибольший update_id: первой в цепочке она видит и те апдейты,
+   что дальше будут отброшены, — по нему при остановке подтверждается offset.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from metrics import registry
+
+UPDATES_DROPPED = registry.counter("bot_updates_dropped_total", "Updates dropped before reaching handlers", ("reason",))
+
+
+async def answer_silently(update: Update) -> None:
+    """Гасит «часики» на кнопке отброшенного нажатия."""
+    if update.callback_query is None:
+        return
+    try:
+        await update.callback_query.answer()
+    except Exception:
+        # query мог уже протухнуть или быть отвечен первым нажатием
+        pass
+
+
+class _UserLock:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # апдейты, которые держат замок или ждут его; такой замок выбрасывать нельзя
+        self.pending = 0
+
+
+class UpdateGuardMiddleware(BaseMiddleware):
+    def __init__(self, dedup_window: float = 1.0, max_locks: int = 10000, remember_updates: int = 10000):
+        self.dedup_window = dedup_window
+        self.max_locks = max_locks
+        self._locks: "OrderedDict[int, _UserLock]" = OrderedDict()
+        # (user_id, chat_id, message_id, data) -> monotonic-время нажатия
+        self._recent_clicks: "OrderedDict[Tuple[int, int, int, str], float]" = OrderedDict()
+        self._seen_ids: Set[int] = set()
+        self._seen_order: Deque[int] = deque(maxlen=remember_updates)
+
+    # -------------------------------------------------------------------------
+    # Дубликаты
+    # -------------------------------------------------------------------------
+    def _seen_update(self, update_id: int) -> bool:
+        if update_id in self._seen_ids:
+            return True
+        if len(self._seen_order) == self._seen_order.maxlen:
+            self._seen_ids.discard(self._seen_order[0])
+        self._seen_order.append(update_id)
+        self._seen_ids.add(update_id)
+        return False
+
+    def _repeated_click(self, update: Update) -> bool:
+        call = update.callback_query
+        if call is None or not self.dedup_window:
+            return False
+        now = time.monotonic()
+        # записи упорядочены по времени — старые срезаем с головы
+        while self._recent_clicks:
+            key, ts = next(iter(self._recent_clicks.items()))
+            if now - ts < self.dedup_window:
+                break
+            self._recent_clicks.popitem(last=False)
+        message = call.message
+        key = (
+            call.from_user.id,
+            message.chat.id if message else 0,
+            message.message_id if message else 0,
+            call.data or "",
+        )
+        if key in self._recent_clicks:
+            return True
+        self._recent_clicks[key] = now
+        return False
+
+    # -------------------------------------------------------------------------
+    # Очередь на пользователя
+    # -------------------------------------------------------------------------
+    def _lock(self, user_id: int) -> _UserLock:
+        lock = self._locks.get(user_id)
+        if lock is not None:
+            self._locks.move_to_end(user_id)
+            return lock
+        lock = self._locks[user_id] = _UserLock()
+        if len(self._locks) > self.max_locks:
+            # выбрасываем самый старый свободный замок; занятые и ожидаемые не трогаем
+            for uid, old in self._locks.items():
+                if not old.pending and uid != user_id:
+                    del self._locks[uid]
+                    break
+        return lock
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._seen_update(event.update_id):
+            UPDATES_DROPPED.inc("duplicate_update")
+            return None
+        if self._repeated_click(event):
+            UPDATES_DROPPED.inc("repeated_click")
+            await answer_silently(event)
+            return None
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        user_lock = self._lock(user.id)
+        user_lock.pending += 1
+        try:
+            async with user_lock.lock:
+                return await handler(event, data)
+        finally:
+            user_lock.pending -= 1
+
+
+# -----------------------------------------------------------------------------
+# Ограничение частоты и перегрузка
+# -----------------------------------------------------------------------------
+# префикс -> (токенов в секунду, максимум подряд); "*" — всё остальное
+DEFAULT_THROTTLE_RULES: Dict[str, Tuple[float, float]] = {
+    "/start": (0.2, 3),     # каждый /start шлёт баннер
+    "svc:": (2.0, 6),
+    "cal:": (2.0, 6),
+    "dt:": (2.0, 6),
+    "*": (5.0, 15),
+}
+
+
+def parse_throttle_rules(spec: str) -> Dict[str, Tuple[float, float]]:
+    """
+    "/start=0.2:3,svc:=2:6,*=5:15" -> {"/start": (0.2, 3.0), ...}.
+    Пустая строка — правила по умолчанию; указанные правила дополняют их.
+    """
+    rules = dict(DEFAULT_THROTTLE_RULES)
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        prefix, _, limits = item.rpartition("=")
+        rate, _, burst = limits.partition(":")
+        rules[prefix] = (float(rate), float(burst) if burst else max(1.0, float(rate)))
+    return rules
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        rules: Optional[Dict[str, Tuple[float, float]]] = None,
+        max_in_flight: int = 1000,
+        max_buckets: int = 50000,
+    ):
+        self.rules = rules or dict(DEFAULT_THROTTLE_RULES)
+        # длинные префиксы проверяем первыми
+        self._prefixes: List[str] = sorted((p for p in self.rules if p != "*"), key=len, reverse=True)
+        self.max_in_flight = max_in_flight
+        self.max_buckets = max_buckets
+        self.in_flight = 0
+        # наибольший полученный update_id, включая отброшенные (None — апдейтов ещё не было)
+        self.last_update_id: Optional[int] = None
+        self._buckets: "OrderedDict[Tuple[int, str], _Bucket]" = OrderedDict()
+
+    def _rule(self, update: Update) -> str:
+        if update.callback_query is not None:
+            key = update.callback_query.data or ""
+        elif update.message is not None and update.message.text:
+            key = update.message.text.split(maxsplit=1)[0]
+        else:
+            key = ""
+        for prefix in self._prefixes:
+            if key.startswith(prefix):
+                return prefix
+        return "*"
+
+    def _allow(self, user_id: int, rule: str) -> bool:
+        limits = self.rules.get(rule)
+        if limits is None:
+            return True
+        rate, burst = limits
+        now = time.monotonic()
+        k = (user_id, rule)
+        bucket = self._buckets.get(k)
+        if bucket is None:
+            bucket = self._buckets[k] = _Bucket(burst, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(k)
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_id = getattr(event, "update_id", None)
+        if update_id is not None and (self.last_update_id is None or update_id > self.last_update_id):
+            self.last_update_id = update_id
+        if self.in_flight >= self.max_in_flight:
+            UPDATES_DROPPED.inc("overloaded")
+            await answer_silently(event)
+            return None
+        user = data.get("event_from_user")
+        if user is not None and not self._allow(user.id, self._rule(event)):
+            UPDATES_DROPPED.inc("throttled")
+            await answer_silently(event)
+            return None
+        self.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,274 @@
+# notify.py
+"""
+Рассылка уведомлений администраторам.
+
+Хендлер только кладёт сообщения в ограниченную очередь и сразу отвечает
+пользователю; фоновые воркеры отправляют их параллельно, соблюдая общий лимит
+Bot API и лимит на чат, учитывают retry_after из 429 и повторяют отправку при
+сетевых ошибках.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+logger = logging.getLogger("booking-bot.notify")
+
+# Лимит длины текста сообщения Telegram (в UTF-16 code units, как считает Telegram)
+MESSAGE_LIMIT = 4096
+# как часто чистить паузы по чатам, которые уже истекли (секунды)
+CHAT_SWEEP_INTERVAL = 60.0
+
+
+def text_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Режет текст на части не длиннее limit, по возможности — по переводам строк."""
+    parts: List[str] = []
+    while text_length(text) > limit:
+        # самый длинный префикс в пределах лимита (символы вне BMP занимают 2 единицы)
+        lo, hi = 1, min(len(text), limit)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if text_length(text[:mid]) <= limit:
+                lo = mid
+            else:
+                hi = mid - 1
+        cut = lo
+        newline = text.rfind("\n", 0, cut)
+        if newline > 0:
+            cut = newline
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+
+class RateLimiter:
+    """Token bucket: rate токенов в секунду, не больше burst подряд."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass(eq=False)
+class NotifyJob:
+    chat_id: int
+    text: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+    future: Optional[asyncio.Future] = None
+
+
+class AdminNotifier:
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = 4,
+        queue_size: int = 1000,
+        global_rate: float = 25.0,
+        per_chat_interval: float = 1.0,
+        max_attempts: int = 5,
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.queue: "asyncio.Queue[NotifyJob]" = asyncio.Queue(maxsize=queue_size)
+        self._global = RateLimiter(global_rate, burst=max(1, int(global_rate)))
+        # chat_id -> monotonic-время, раньше которого в чат писать нельзя
+        self._chat_ready_at: Dict[int, float] = {}
+        # когда в следующий раз выбросить из _chat_ready_at чаты, которые уже «остыли»
+        self._sweep_at = 0.0
+        self._tasks: List[asyncio.Task] = []
+        self._delayed: Dict[NotifyJob, asyncio.TimerHandle] = {}
+        # счётчики для наблюдаемости
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self._latencies: Deque[float] = deque(maxlen=1000)
+
+    # -------------------------------------------------------------------------
+    # Жизненный цикл
+    # -------------------------------------------------------------------------
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info("Admin notifier started with %d workers", self.workers)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается отправки очереди (не дольше timeout) и останавливает воркеров."""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.queue.qsize() or self._delayed) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        try:
+            await asyncio.wait_for(self.queue.join(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            logger.warning("Notifier stopped with %d undelivered messages", self.queue.qsize() + len(self._delayed))
+        logger.info("Notifier stats: %s", self.stats())
+        for handle in self._delayed.values():
+            handle.cancel()
+        self._delayed.clear()
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # -------------------------------------------------------------------------
+    # Постановка в очередь
+    # -------------------------------------------------------------------------
+    def submit(self, chat_id: int, text: str) -> asyncio.Future:
+        """Ставит одно сообщение в очередь; future завершится после доставки (или с ошибкой)."""
+        future = asyncio.get_running_loop().create_future()
+        job = NotifyJob(chat_id=chat_id, text=text, future=future)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error("Notify queue is full, dropping message to %s", chat_id)
+            future.set_exception(RuntimeError("notify queue is full"))
+            # исключение никто может не забрать — не шумим в логах
+            future.exception()
+        return future
+
+    def notify(self, chat_ids: Iterable[int], text: str) -> int:
+        """Fire-and-forget рассылка одного текста нескольким чатам. Возвращает число принятых."""
+        accepted = 0
+        for chat_id in chat_ids:
+            fut = self.submit(chat_id, text)
+            if not fut.done():
+                accepted += 1
+        return accepted
+
+    # -------------------------------------------------------------------------
+    # Воркеры
+    # -------------------------------------------------------------------------
+    def _requeue_later(self, job: NotifyJob, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+
+        def _put() -> None:
+            self._delayed.pop(job, None)
+            try:
+                self.queue.put_nowait(job)
+            except asyncio.QueueFull:
+                self._finish(job, RuntimeError("notify queue is full"))
+
+        self._delayed[job] = loop.call_later(delay, _put)
+
+    def _finish(self, job: NotifyJob, error: Optional[BaseException] = None) -> None:
+        if error is None:
+            self.sent += 1
+            self._latencies.append(time.monotonic() - job.enqueued_at)
+        else:
+            self.failed += 1
+        if job.future and not job.future.done():
+            if error is None:
+                job.future.set_result(True)
+            else:
+                job.future.set_exception(error)
+                job.future.exception()
+
+    async def _worker(self, idx: int) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.exception("Unexpected notifier error")
+                self._finish(job, e)
+            finally:
+                self.queue.task_done()
+
+    def _sweep_chats(self, now: float) -> None:
+        # без очистки словарь рос бы на каждый чат, куда хоть раз писали
+        if now < self._sweep_at:
+            return
+        self._sweep_at = now + CHAT_SWEEP_INTERVAL
+        for chat_id in [c for c, ready_at in self._chat_ready_at.items() if ready_at <= now]:
+            del self._chat_ready_at[chat_id]
+
+    async def _process(self, job: NotifyJob) -> None:
+        now = time.monotonic()
+        self._sweep_chats(now)
+        ready_at = self._chat_ready_at.get(job.chat_id, 0.0)
+        if ready_at > now:
+            # чат ещё «остывает» — не занимаем воркер, вернём задачу позже
+            self._requeue_later(job, ready_at - now)
+            return
+        self._chat_ready_at[job.chat_id] = now + self.per_chat_interval
+        await self._global.acquire()
+        job.attempts += 1
+        try:
+            await self.bot.send_message(job.chat_id, job.text)
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            self._chat_ready_at[job.chat_id] = time.monotonic() + e.retry_after
+            logger.warning("Flood control for chat %s, retry in %ss", job.chat_id, e.retry_after)
+            self._requeue_later(job, e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if job.attempts >= self.max_attempts:
+                logger.error("Giving up notifying %s after %d attempts: %s", job.chat_id, job.attempts, e)
+                self._finish(job, e)
+                return
+            self.retried += 1
+            self._requeue_later(job, min(60.0, 2 ** job.attempts))
+        except Exception as e:
+            # 400/403 и т.п. — повтор не поможет
+            logger.error("Failed to notify %s: %s", job.chat_id, e)
+            self._finish(job, e)
+        else:
+            self._finish(job)
+
+    # -------------------------------------------------------------------------
+    # Метрики
+    # -------------------------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        lat = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            if not lat:
+                return 0.0
+            return lat[min(len(lat) - 1, int(p * len(lat)))]
+
+        return {
+            "queue_depth": self.queue.qsize(),
+            "delayed": len(self._delayed),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "latency_p50": pct(0.5),
+            "latency_p99": pct(0.99),
+        }
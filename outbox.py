@@ -0,0 +1,209 @@
+# outbox.py
+"""
+Доставка уведомлений из таблицы outbox.
+
+Заявка и уведомления о ней пишутся в bot.db одной транзакцией (db.add_bookings),
+а OutboxDispatcher фоном выбирает недоставленные строки пачками, отдаёт их
+AdminNotifier и отмечает результат. Строка становится delivered только после
+ответа Telegram, поэтому падение процесса не теряет уведомления: после рестарта
+доставка продолжится с того же места (at-least-once — возможен повтор).
+
+Digest-режим (digest_window > 0): в каждый чат уходит не больше одного сообщения
+за окно. Первая заявка в «тихий» чат отправляется сразу; всё, что пришло в
+течение окна после неё, откладывается и уходит одной сводкой (с разбиением по
+лимиту длины Telegram). Число сообщений админам растёт с числом окон, а не
+с числом заявок.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramUnauthorizedError,
+)
+
+import db
+from notify import MESSAGE_LIMIT, AdminNotifier, split_text, text_length
+
+logger = logging.getLogger("booking-bot.outbox")
+
+# Ошибки, которые повтор не исправит (чат удалён, бот заблокирован, кривой текст)
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramUnauthorizedError)
+
+DIGEST_SEPARATOR = "\n\n— — —\n\n"
+# запас под заголовок сводки
+DIGEST_HEADER_RESERVE = 64
+
+# (id, chat_id, text, attempts) — строка outbox
+OutboxRow = Tuple[int, int, str, int]
+
+
+def digest_header(count: int) -> str:
+    return f"📦 {count} new bookings\n\n"
+
+
+def pack_digest(rows: List[OutboxRow], limit: int = MESSAGE_LIMIT) -> List[Tuple[List[OutboxRow], str]]:
+    """
+    Собирает тексты строк в сообщения не длиннее limit.
+    Возвращает [(строки, текст)]; слишком длинный одиночный текст режется на
+    несколько сообщений с одними и теми же строками.
+    """
+    if len(rows) == 1:
+        return [(rows, part) for part in split_text(rows[0][2], limit)]
+    body_limit = limit - DIGEST_HEADER_RESERVE
+    chunks: List[Tuple[List[OutboxRow], List[str]]] = []
+    size = 0
+    for row in rows:
+        for part in split_text(row[2], body_limit):
+            length = text_length(part)
+            if chunks and size + text_length(DIGEST_SEPARATOR) + length <= body_limit:
+                chunks[-1][1].append(part)
+                if chunks[-1][0][-1] is not row:
+                    chunks[-1][0].append(row)
+                size += text_length(DIGEST_SEPARATOR) + length
+            else:
+                chunks.append(([row], [part]))
+                size = length
+    return [
+        (chunk_rows, digest_header(len(chunk_rows)) + DIGEST_SEPARATOR.join(parts) if len(parts) > 1 else parts[0])
+        for chunk_rows, parts in chunks
+    ]
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        notifier: AdminNotifier,
+        batch_size: int = 100,
+        poll_interval: float = 5.0,
+        max_attempts: int = 10,
+        max_backoff: float = 600.0,
+        digest_window: float = 0.0,
+    ):
+        self.notifier = notifier
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.digest_window = digest_window
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # chat_id -> time.time() последней отправки (digest-режим)
+        self._last_sent: Dict[int, float] = {}
+        # ближайший срок отложенных строк — к нему просыпаемся раньше poll_interval
+        self._next_due: Optional[float] = None
+        # счётчики для наблюдаемости
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    # -------------------------------------------------------------------------
+    # Жизненный цикл
+    # -------------------------------------------------------------------------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Даёт текущей пачке доставиться (не дольше timeout); остальное дождётся рестарта."""
+        if self._task is None:
+            return
+        self._stopping = True
+        db.writer.outbox_event.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox batch still in flight on shutdown, will be resent after restart")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    # -------------------------------------------------------------------------
+    # Доставка
+    # -------------------------------------------------------------------------
+    async def _run(self) -> None:
+        event = db.writer.outbox_event
+        while not self._stopping:
+            event.clear()
+            try:
+                while not self._stopping and await self.drain_once() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Outbox delivery failed")
+            if self._stopping:
+                return
+            # новые строки будят сразу, отложенные повторы подбираем по таймеру
+            timeout = self.poll_interval
+            if self._next_due is not None:
+                timeout = max(0.0, min(timeout, self._next_due - time.time()))
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        """Доставляет одну пачку. Возвращает число взятых строк."""
+        rows = await db.fetch_outbox(time.time(), self.batch_size)
+        if not rows:
+            return 0
+        now = time.time()
+        self._next_due = None
+        by_chat: Dict[int, List[OutboxRow]] = defaultdict(list)
+        for row in rows:
+            by_chat[row[1]].append(row)
+
+        messages: List[Tuple[List[OutboxRow], str]] = []
+        deferred: List[Tuple[float, int]] = []
+        for chat_id, chat_rows in by_chat.items():
+            if not self.digest_window:
+                messages.extend(([row], part) for row in chat_rows for part in split_text(row[2]))
+                continue
+            release_at = self._last_sent.get(chat_id, 0.0) + self.digest_window
+            if release_at > now:
+                # чат недавно получал сообщение — копим до конца окна
+                deferred.extend((release_at, row[0]) for row in chat_rows)
+                self._next_due = min(self._next_due or release_at, release_at)
+                continue
+            self._last_sent[chat_id] = now
+            messages.extend(pack_digest(chat_rows))
+
+        futures = [self.notifier.submit(chat_rows[0][1], text) for chat_rows, text in messages]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        # строка доставлена, только если дошли все сообщения с ней
+        errors: Dict[int, BaseException] = {}
+        sent_rows: Dict[int, OutboxRow] = {}
+        for (chat_rows, _), result in zip(messages, results):
+            for row in chat_rows:
+                sent_rows[row[0]] = row
+                if isinstance(result, BaseException):
+                    errors.setdefault(row[0], result)
+
+        delivered: List[int] = []
+        retry: List[Tuple[int, float, str, int]] = []
+        failed: List[Tuple[int, str, int]] = []
+        now = time.time()
+        for row_id, (_, chat_id, _, attempts) in sent_rows.items():
+            result = errors.get(row_id)
+            if result is None:
+                delivered.append(row_id)
+                continue
+            attempts += 1
+            error = f"{type(result).__name__}: {result}"
+            if isinstance(result, PERMANENT_ERRORS) or attempts >= self.max_attempts:
+                logger.error("Outbox message %s to %s failed permanently: %s", row_id, chat_id, error)
+                failed.append((attempts, error, row_id))
+            else:
+                retry.append((attempts, now + min(self.max_backoff, 5.0 * 2 ** attempts), error, row_id))
+        await db.update_outbox(delivered, retry, failed, deferred)
+        self.delivered += len(delivered)
+        self.retried += len(retry)
+        self.failed += len(failed)
+        return len(rows)
@@ -0,0 +1,249 @@
+# reminders.py
+"""
+Напоминания клиентам о записи (за 24 ч и за 2 ч до сеанса — REMINDER_OFFSETS).
+
+Строки reminders создаются в одной транзакции с заявкой (db.add_bookings) и
+живут в bot.db, так что рестарт их не теряет. ReminderScheduler держит в памяти
+кучу (due_at, booking_id, kind) только на ближайшие horizon секунд — это
+диапазонный запрос по частичному индексу idx_reminders_pending — и спит до
+срока вершины кучи: в простое одно пробуждение за horizon/2, без опроса таблицы.
+Новые напоминания внутри горизонта попадают в кучу сразу после коммита
+(db.writer.reminder_listeners), остальные подхватит следующая догрузка.
+
+Отправка идёт через общий AdminNotifier (лимиты Bot API и на чат). Перед
+отправкой статус перепроверяется в базе: напоминания отменённых заявок и
+сеансов, которые уже начались, пропускаются.
+
+Дата и время заявки — местное время салона в часовом поясе BOT_TIMEZONE
+(например, Europe/Moscow); без него — часовой пояс сервера (в контейнере это UTC).
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import db
+from notify import AdminNotifier
+from outbox import PERMANENT_ERRORS
+
+logger = logging.getLogger("booking-bot.reminders")
+
+UNITS = {"d": 86400, "h": 3600, "m": 60}
+
+BOT_TIMEZONE = os.getenv("BOT_TIMEZONE", "")
+# None — часовой пояс сервера
+SALON_TZ: Optional[ZoneInfo] = ZoneInfo(BOT_TIMEZONE) if BOT_TIMEZONE else None
+
+# (kind, секунд до начала сеанса)
+Offset = Tuple[str, float]
+
+
+def parse_offsets(spec: str) -> List[Offset]:
+    """"24h,2h" -> [("24h", 86400.0), ("2h", 7200.0)]. Пустая строка — напоминания выключены."""
+    offsets: List[Offset] = []
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        if item[-1] not in UNITS:
+            raise ValueError(f"reminder offset {item!r}: expected a number with d/h/m suffix")
+        offsets.append((item, float(item[:-1]) * UNITS[item[-1]]))
+    return offsets
+
+
+def salon_now() -> datetime:
+    """Текущее время в часовом поясе салона."""
+    return datetime.now(SALON_TZ)
+
+
+def session_start(date: str, time_str: str) -> float:
+    """Начало сеанса как unix time; дата и время заявки — местное время салона (SALON_TZ)."""
+    return datetime.fromisoformat(f"{date} {time_str}").replace(tzinfo=SALON_TZ).timestamp()
+
+
+def reminder_times(date: str, time_str: str, offsets: List[Offset], now: Optional[float] = None) -> List[Tuple[str, float]]:
+    """[(kind, due_at)] для заявки; напоминания, срок которых уже прошёл, не создаются."""
+    now = time.time() if now is None else now
+    start = session_start(date, time_str)
+    return [(kind, start - seconds) for kind, seconds in offsets if start - seconds > now]
+
+
+class ReminderScheduler:
+    def __init__(
+        self,
+        notifier: AdminNotifier,
+        render: Callable[..., str],
+        horizon: float = 6 * 3600,
+        batch_size: int = 100,
+        max_attempts: int = 5,
+        poll_interval: Optional[float] = None,
+    ):
+        """
+        render(lang, service, duration_min, date, time) -> текст напоминания.
+        horizon — на сколько секунд вперёд держать расписание в памяти.
+        poll_interval — дополнительно проверять базу не реже раза в N секунд: нужно,
+        когда заявки пишут другие процессы и их напоминания не попадают в кучу.
+        """
+        self.notifier = notifier
+        self.render = render
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._heap: List[Tuple[float, int, str]] = []
+        # (booking_id, kind) в куче — догрузка и слушатель writer'а могут принести одно и то же
+        self._queued: Set[Tuple[int, str]] = set()
+        # расписание со сроком раньше этого момента уже в куче
+        self._loaded_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # счётчики для наблюдаемости
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.skipped = 0
+
+    @property
+    def scheduled(self) -> int:
+        return len(self._heap)
+
+    # -------------------------------------------------------------------------
+    # Жизненный цикл
+    # -------------------------------------------------------------------------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            if self.add not in db.writer.reminder_listeners:
+                db.writer.reminder_listeners.append(self.add)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Даёт текущей пачке отправиться (не дольше timeout); остальное продолжится после рестарта."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Reminder batch still in flight on shutdown, will be resent after restart")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self.add in db.writer.reminder_listeners:
+            db.writer.reminder_listeners.remove(self.add)
+
+    # -------------------------------------------------------------------------
+    # Куча
+    # -------------------------------------------------------------------------
+    def _push(self, due_at: float, booking_id: int, kind: str) -> None:
+        key = (booking_id, kind)
+        if key in self._queued:
+            return
+        self._queued.add(key)
+        heapq.heappush(self._heap, (due_at, booking_id, kind))
+
+    def add(self, entries: List[Tuple[float, int, str]]) -> None:
+        """Новые напоминания после коммита заявки (db.writer.reminder_listeners)."""
+        top = self._heap[0][0] if self._heap else None
+        for due_at, booking_id, kind in entries:
+            if due_at < self._loaded_until:
+                self._push(due_at, booking_id, kind)
+        if self._heap and (top is None or self._heap[0][0] < top):
+            # новое напоминание раньше того, до которого мы спим
+            self._wakeup.set()
+
+    async def _refill(self, now: float) -> None:
+        start, end = self._loaded_until, now + self.horizon
+        # границу двигаем до запроса: всё, что закоммитят во время него, придёт через add()
+        self._loaded_until = end
+        for due_at, booking_id, kind in await db.fetch_reminder_schedule(start, end):
+            self._push(due_at, booking_id, kind)
+        logger.debug("Reminder heap refilled up to %s: %d scheduled", datetime.fromtimestamp(end), len(self._heap))
+
+    # -------------------------------------------------------------------------
+    # Отправка
+    # -------------------------------------------------------------------------
+    async def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                now = time.time()
+                if now + self.horizon / 2 >= self._loaded_until:
+                    await self._refill(now)
+                due = bool(self._heap) and self._heap[0][0] <= now
+                while self._heap and self._heap[0][0] <= now:
+                    _, booking_id, kind = heapq.heappop(self._heap)
+                    self._queued.discard((booking_id, kind))
+                if due or self.poll_interval:
+                    while not self._stopping and await self.send_due(now) == self.batch_size:
+                        pass
+            except Exception:
+                logger.exception("Reminder delivery failed")
+            if self._stopping:
+                return
+            now = time.time()
+            timeout = self._loaded_until - self.horizon / 2 - now
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - now)
+            if self.poll_interval:
+                timeout = min(timeout, self.poll_interval)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    async def send_due(self, now: float) -> int:
+        """Отправляет одну пачку наступивших напоминаний. Возвращает число взятых строк."""
+        rows = await db.fetch_due_reminders(now, self.batch_size)
+        if not rows:
+            return 0
+        skipped: List[Tuple[str, int, str]] = []
+        jobs: List[Tuple[Tuple[Any, ...], asyncio.Future]] = []
+        for row in rows:
+            booking_id, kind, chat_id, lang, _, service, duration, date, time_str, status = row
+            if status == "cancelled":
+                skipped.append(("cancelled", booking_id, kind))
+                continue
+            try:
+                started = session_start(date, time_str) <= now
+            except (TypeError, ValueError):
+                started = True
+            if started:
+                # бот лежал дольше, чем оставалось до сеанса — напоминать поздно
+                skipped.append(("expired", booking_id, kind))
+                continue
+            text = self.render(lang, service, duration or 60, date, time_str)
+            jobs.append((row, self.notifier.submit(chat_id, text)))
+
+        results = await asyncio.gather(*(future for _, future in jobs), return_exceptions=True)
+        sent: List[Tuple[int, str]] = []
+        retry: List[Tuple[int, float, str, int, str]] = []
+        failed: List[Tuple[int, str, int, str]] = []
+        now = time.time()
+        for (row, _), result in zip(jobs, results):
+            booking_id, kind, chat_id, attempts = row[0], row[1], row[2], row[4]
+            if not isinstance(result, BaseException):
+                sent.append((booking_id, kind))
+                continue
+            attempts += 1
+            error = f"{type(result).__name__}: {result}"
+            if isinstance(result, PERMANENT_ERRORS) or attempts >= self.max_attempts:
+                # чаще всего клиент заблокировал бота
+                logger.warning("Reminder %s/%s to %s failed permanently: %s", booking_id, kind, chat_id, error)
+                failed.append((attempts, error, booking_id, kind))
+            else:
+                due_at = now + min(600.0, 30.0 * 2 ** attempts)
+                retry.append((attempts, due_at, error, booking_id, kind))
+        await db.update_reminders(sent, retry, failed, skipped)
+        for _, due_at, _, booking_id, kind in retry:
+            if due_at < self._loaded_until:
+                self._push(due_at, booking_id, kind)
+        self.sent += len(sent)
+        self.retried += len(retry)
+        self.failed += len(failed)
+        self.skipped += len(skipped)
+        return len(rows)
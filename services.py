@@ -0,0 +1,196 @@
+# services.py
+"""
+Каталог услуг: services.json → неизменяемый снимок (ServiceSnapshot).
+
+Формат файла:
+    {
+      "services": {"classic": {"price_60": 60, "image": "images/service1.jpg"}, ...},
+      "durations": [30, 45, 60, 90],
+      "hours": {"slot_start": 10, "slot_end": 19, "work_end": 20},
+      "calendar_days": 14
+    }
+
+Цены всех пар (услуга, длительность) считаются один раз при загрузке, так что
+клавиатуры и сводки только читают таблицу. Названия и описания услуг — в locales/.
+
+Перезагрузка собирает новый снимок целиком и подменяет ссылку ServiceCatalog.current
+одной операцией: хендлер, взявший снимок, дорабатывает со старыми ценами, следующий
+апдейт видит новые. Файл с ошибкой не трогает текущий снимок.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger("booking-bot.services")
+
+BASE_DIR = os.path.dirname(__file__)
+SERVICES_PATH = os.path.join(BASE_DIR, "services.json")
+
+
+class ServiceCatalogError(Exception):
+    """Файл каталога услуг не удалось прочитать или он некорректен."""
+
+
+class ServiceUnavailableError(Exception):
+    """Услугу убрали из каталога, пока пользователь оформлял заявку."""
+
+
+@dataclass(frozen=True)
+class Service:
+    key: str
+    base_price_60: float
+    image_path: Optional[str]
+
+
+@dataclass(frozen=True)
+class ServiceSnapshot:
+    # порядок ключей — порядок кнопок
+    services: Mapping[str, Service]
+    durations: Tuple[int, ...]
+    slot_start: int
+    slot_end: int
+    work_end: int
+    calendar_days: int
+    # (услуга, минуты) -> цена, посчитанная при загрузке
+    prices: Mapping[Tuple[str, int], int]
+    version: int
+
+    def price(self, service_key: str, duration_min: int, fallback: Optional[int] = None) -> int:
+        """
+        fallback — цена, которую пользователь уже видел (из состояния или корзины):
+        она используется, если услугу убрали из каталога. Без неё — ServiceUnavailableError.
+        """
+        price = self.prices.get((service_key, duration_min))
+        if price is not None:
+            return price
+        service = self.services.get(service_key)
+        if service is not None:
+            # длительность из старой корзины/состояния, которой уже нет в каталоге
+            return calc_price(service.base_price_60, duration_min)
+        if fallback is not None:
+            return fallback
+        raise ServiceUnavailableError(service_key)
+
+
+def calc_price(base_price_60: float, duration_min: int) -> int:
+    return int(round(base_price_60 * duration_min / 60))
+
+
+def _positive_int(value: Any, what: str) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ServiceCatalogError(f"{what}: expected a positive integer, got {value!r}")
+    return value
+
+
+def _mapping(value: Any, what: str) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        raise ServiceCatalogError(f"{what}: expected an object, got {value!r}")
+    return value
+
+
+def build_snapshot(raw: Dict[str, Any], version: int = 0) -> ServiceSnapshot:
+    # raw — разобранный JSON из файла: форма любого уровня может оказаться не той
+    raw = _mapping(raw, "services.json")
+    services: Dict[str, Service] = {}
+    for key, item in _mapping(raw.get("services") or {}, "services").items():
+        item = _mapping(item, f"services.{key}")
+        price = item.get("price_60")
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or price < 0:
+            raise ServiceCatalogError(f"services.{key}.price_60: expected a non-negative number, got {price!r}")
+        image = item.get("image")
+        if image is not None and not isinstance(image, str):
+            raise ServiceCatalogError(f"services.{key}.image: expected a file name, got {image!r}")
+        services[key] = Service(key, price, os.path.join(BASE_DIR, image) if image else None)
+    if not services:
+        raise ServiceCatalogError("no services defined")
+
+    raw_durations = raw.get("durations") or []
+    if not isinstance(raw_durations, list):
+        raise ServiceCatalogError(f"durations: expected a list, got {raw_durations!r}")
+    durations = tuple(_positive_int(m, "durations") for m in raw_durations)
+    if not durations:
+        raise ServiceCatalogError("no durations defined")
+
+    hours = _mapping(raw.get("hours") or {}, "hours")
+    slot_start = _positive_int(hours.get("slot_start"), "hours.slot_start")
+    slot_end = _positive_int(hours.get("slot_end"), "hours.slot_end")
+    work_end = _positive_int(hours.get("work_end"), "hours.work_end")
+    if not slot_start <= slot_end < work_end <= 24:
+        raise ServiceCatalogError(f"hours: need slot_start <= slot_end < work_end <= 24, got {hours}")
+
+    prices = {
+        (key, minutes): calc_price(service.base_price_60, minutes)
+        for key, service in services.items()
+        for minutes in durations
+    }
+    return ServiceSnapshot(
+        services=MappingProxyType(services),
+        durations=durations,
+        slot_start=slot_start,
+        slot_end=slot_end,
+        work_end=work_end,
+        calendar_days=_positive_int(raw.get("calendar_days", 14), "calendar_days"),
+        prices=MappingProxyType(prices),
+        version=version,
+    )
+
+
+class ServiceCatalog:
+    def __init__(self, path: str = SERVICES_PATH):
+        self.path = path
+        self.current: Optional[ServiceSnapshot] = None
+        self._mtime: Optional[float] = None
+        self._callbacks: List[Callable[[ServiceSnapshot], None]] = []
+
+    def load(self) -> ServiceSnapshot:
+        """Читает файл и подменяет снимок. При ошибке бросает ServiceCatalogError."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ServiceCatalogError(f"{self.path}: {e}") from e
+        version = self.current.version + 1 if self.current else 1
+        snapshot = build_snapshot(raw, version)
+        self.current = snapshot
+        self._mtime = mtime
+        logger.info(
+            "Loaded service catalog v%s: %s services, durations %s",
+            version, len(snapshot.services), list(snapshot.durations),
+        )
+        for callback in self._callbacks:
+            callback(snapshot)
+        return snapshot
+
+    def reload(self) -> bool:
+        try:
+            self.load()
+        except ServiceCatalogError as e:
+            logger.error("Service catalog not reloaded, keeping v%s: %s", self.current.version if self.current else 0, e)
+            return False
+        return True
+
+    def on_reload(self, callback: Callable[[ServiceSnapshot], None]) -> None:
+        """callback(snapshot) после каждой успешной загрузки."""
+        self._callbacks.append(callback)
+
+    async def watch(self, interval: float) -> None:
+        """Перечитывает каталог, когда меняется mtime файла."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = os.stat(self.path).st_mtime != self._mtime
+            except OSError:
+                continue
+            if not changed:
+                continue
+            try:
+                self.reload()
+            except Exception:
+                # ошибка в подписчике on_reload не должна останавливать слежение за файлом
+                logger.exception("Service catalog watcher failed to reload %s", self.path)
@@ -0,0 +1,217 @@
+# stats.py
+"""
+Отчёт по заявкам для администратора (/stats) из сводной таблицы booking_stats.
+
+Сводка — счётчики по (день сеанса, услуга, длительность, час начала): сколько
+заявок создано, сколько отменено и выручка по неотменённым. Writer обновляет её
+в транзакции вставки, cancel_booking — в транзакции отмены, так что отчёт за
+30 дней читает несколько сотен строк сводки, а не всю таблицу bookings.
+
+Для заявок, сохранённых до появления сводки (или после /stats rebuild), сводку
+досчитывает StatsBackfill: пачками по STATS_BACKFILL_BATCH заявок, каждая — своя
+короткая транзакция, с паузой между ними, чтобы не задерживать запись новых
+заявок. Прогресс хранится в bot.db — прерванный пересчёт продолжится после рестарта.
+
+Из консоли:
+    python stats.py --days 30
+    python stats.py --rebuild
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import db
+from reminders import salon_now
+
+logger = logging.getLogger("booking-bot.stats")
+
+STATS_BACKFILL_BATCH = int(os.getenv("STATS_BACKFILL_BATCH", "5000"))
+STATS_BACKFILL_PAUSE = float(os.getenv("STATS_BACKFILL_PAUSE", "0.05"))
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+# -----------------------------------------------------------------------------
+# Пересчёт сводки
+# -----------------------------------------------------------------------------
+class StatsBackfill:
+    def __init__(
+        self,
+        batch_size: int = STATS_BACKFILL_BATCH,
+        pause: float = STATS_BACKFILL_PAUSE,
+        poll_interval: Optional[float] = None,
+    ):
+        """
+        poll_interval — после пересчёта проверять базу раз в N секунд: нужно, когда
+        /stats rebuild может поставить пересчёт другой процесс (SHARED_DB).
+        """
+        self.batch_size = batch_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Продолжает незаконченный пересчёт (если его нет — задача сразу завершится)."""
+        if self.running:
+            # задача ждёт следующей проверки — пусть проверит сейчас
+            self._wake.set()
+        else:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        # прогресс уже в базе — оставшиеся пачки досчитаются после рестарта
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def run(self) -> None:
+        while True:
+            await self.catch_up()
+            if not self.poll_interval:
+                return
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def catch_up(self) -> None:
+        """Досчитывает сводку до конца; если пересчёт не нужен — один короткий запрос."""
+        started = time.perf_counter()
+        steps = 0
+        try:
+            while True:
+                state = await db.stats_backfill_step(self.batch_size)
+                steps += 1
+                if state is None:
+                    break
+                if steps % 20 == 0:
+                    logger.info("Stats backfill: booking #%s of #%s", *state)
+                await asyncio.sleep(self.pause)
+        except Exception:
+            # прогресс в базе — продолжим со следующей проверки или после рестарта
+            logger.exception("Stats backfill failed")
+            return
+        if steps > 1:
+            logger.info("Stats backfill done: %d batches in %.1fs", steps, time.perf_counter() - started)
+
+
+# -----------------------------------------------------------------------------
+# Отчёт
+# -----------------------------------------------------------------------------
+# [заявок без отменённых, отменено, выручка]
+Counts = List[int]
+Totals = Dict[object, Counts]
+
+
+@dataclass
+class StatsReport:
+    since: str
+    until: str
+    days: int
+    total: Counts = field(default_factory=lambda: [0, 0, 0])
+    by_service: Totals = field(default_factory=dict)
+    by_duration: Totals = field(default_factory=dict)
+    by_weekday: Totals = field(default_factory=dict)
+    by_hour: Totals = field(default_factory=dict)
+    # (done_id, upto_id), пока сводка пересчитывается
+    backfill: Optional[Tuple[int, int]] = None
+
+
+def _add(acc: Counts, active: int, cancelled: int, revenue: int) -> None:
+    acc[0] += active
+    acc[1] += cancelled
+    acc[2] += revenue
+
+
+async def collect_stats(days: int = 30, today: Optional[date] = None) -> StatsReport:
+    """
+    Сеансы за последние days дней по сегодняшний включительно (день — по часам салона):
+    записи на будущие дни в отчёт не попадают.
+    """
+    today = today or salon_now().date()
+    since = (today - timedelta(days=days - 1)).isoformat()
+    until = today.isoformat()
+    rows, backfill = await db.fetch_stats(since, until)
+    report = StatsReport(since=since, until=until, days=days, backfill=backfill)
+    for day, service, duration_min, hour, booked, cancelled, revenue in rows:
+        active = booked - cancelled
+        try:
+            weekday = date.fromisoformat(day).weekday()
+        except ValueError:
+            weekday = -1
+        for acc in (
+            report.total,
+            report.by_service.setdefault(service, [0, 0, 0]),
+            report.by_duration.setdefault(duration_min, [0, 0, 0]),
+            report.by_weekday.setdefault(weekday, [0, 0, 0]),
+            report.by_hour.setdefault(hour, [0, 0, 0]),
+        ):
+            _add(acc, active, cancelled, revenue)
+    return report
+
+
+def format_stats(report: StatsReport, service_title: Callable[[str], str] = lambda key: key or "—") -> str:
+    active, cancelled, revenue = report.total
+    lines = [
+        f"Sessions {report.since} – {report.until} ({report.days} days)",
+        f"Bookings: {active} (+{cancelled} cancelled), revenue €{revenue}",
+    ]
+    if report.backfill:
+        done_id, upto_id = report.backfill
+        lines.append(f"⚠️ Stats are being rebuilt: {done_id}/{upto_id} bookings counted")
+
+    def section(title: str, totals: Totals, label: Callable[[object], str], order=None) -> None:
+        if not totals:
+            return
+        lines.append("")
+        lines.append(title)
+        keys = sorted(totals, key=order) if order else sorted(totals, key=lambda k: -totals[k][2])
+        for key in keys:
+            count, cancelled, revenue = totals[key]
+            lines.append(f"  {label(key)}: {count}, €{revenue}" + (f" ({cancelled} cancelled)" if cancelled else ""))
+
+    section("By service:", report.by_service, lambda k: service_title(k))
+    section("By duration:", report.by_duration, lambda k: f"{k} min" if k else "—", order=lambda k: k)
+    section("By weekday:", report.by_weekday, lambda k: WEEKDAYS[k] if k >= 0 else "—", order=lambda k: k)
+    section("By start hour:", report.by_hour, lambda k: f"{k:02d}:00" if k >= 0 else "—", order=lambda k: k)
+    return "\n".join(lines)
+
+
+def cli() -> None:
+    parser = argparse.ArgumentParser(description="Booking stats from the booking_stats rollup")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--rebuild", action="store_true", help="recount the rollup from all bookings first")
+    parser.add_argument("--batch", type=int, default=STATS_BACKFILL_BATCH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    async def run() -> str:
+        try:
+            await db.init_db()
+            if args.rebuild:
+                await db.start_stats_backfill()
+            # без --rebuild досчитывает только незаконченный пересчёт
+            await StatsBackfill(args.batch, pause=0).run()
+            return format_stats(await collect_stats(args.days))
+        finally:
+            await db.close_db()
+
+    print(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,484 @@
+# supervisor.py
+"""
+Горизонтальное масштабирование: один процесс принимает апдейты, N воркеров их
+обрабатывают.
+
+    WORKERS=4 python supervisor.py
+
+Супервизор получает апдейты так же, как бот в одиночку (BOT_MODE=polling —
+getUpdates, BOT_MODE=webhook — HTTP-сервер на WEBAPP_HOST:WEBAPP_PORT), и
+раскладывает их по воркерам: user_id % WORKERS (без пользователя — update_id).
+Все апдейты одного пользователя попадают в один процесс, поэтому per-user
+очередь, дедупликация и лимиты частоты из middlewares.py работают как раньше.
+
+Воркер — это main.py с BOT_MODE=worker: тот же webhook-обработчик aiogram, но
+на unix-сокете WORKER_SOCKET и с одноразовым WORKER_SECRET. Каждому воркеру
+апдейты пересылаются строго по очереди, в порядке получения. Упавший воркер
+перезапускается с нарастающей паузой; его апдейты ждут в очереди и пересылаются
+повторно, пока воркер их не примет (at-least-once: повтор уже принятого апдейта
+отсечёт дедупликация по update_id в воркере). Воркер, недоступный дольше
+WORKER_STALL_TIMEOUT, считается зависшим: его апдейты отбрасываются с ошибкой в
+логе, пока он не ответит снова (проба — раз в секунду). Другому воркеру они не
+передаются: состояние FSM и порядок апдейтов пользователя живут в «его» процессе.
+
+В режиме polling offset подтверждается только до первого апдейта, который ещё не
+принят воркером: если супервизор остановится раньше, Telegram отдаст эти апдейты
+снова. Апдейты других воркеров при этом обслуживаются дальше — getUpdates
+повторно возвращает ожидающие (они пропускаются) и новые; ожидающих не больше,
+чем придёт за WORKER_STALL_TIMEOUT, дальше offset снова движется. В режиме webhook
+Telegram получает ответ сразу, очереди живут в памяти супервизора.
+
+Общее у воркеров — только bot.db (WAL): заявки на пересекающиеся слоты из
+разных процессов отсекаются в транзакции записи (db.writer.check_conflicts),
+доставку outbox и напоминания ведёт воркер 0.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+import db
+from imaging import ImageOptimizer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+)
+logger = logging.getLogger("booking-bot.supervisor")
+
+load_dotenv()
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "") or "https://api.telegram.org"
+
+WORKERS = int(os.getenv("WORKERS", "0")) or os.cpu_count() or 1
+# каталог для unix-сокетов воркеров; по умолчанию — временный
+WORKER_SOCKET_DIR = os.getenv("WORKER_SOCKET_DIR", "")
+# сколько секунд ждать ответа воркера на одну пересылку (потом — повтор)
+FORWARD_TIMEOUT = float(os.getenv("WORKER_FORWARD_TIMEOUT", "10"))
+# воркер отвечает ошибкой на один и тот же апдейт столько раз подряд — апдейт отбрасывается
+FORWARD_REJECTS = 5
+# воркер недоступен дольше стольких секунд — его апдейты отбрасываются, пока он не ответит:
+# иначе offset стоит на первом из них и после пачки ожидающих встаёт приём всех апдейтов
+WORKER_STALL_TIMEOUT = float(os.getenv("WORKER_STALL_TIMEOUT", "60"))
+# как часто пробовать зависший воркер
+STALL_PROBE_INTERVAL = 1.0
+# общий дедлайн остановки — меньше паузы перед SIGKILL (stop_grace_period в
+# docker-compose.yml, у docker stop по умолчанию — 10 с). Делится между шагами:
+# пересылка очередей — не дольше доли DRAIN_SHARE, остальное — остановка воркеров
+# (их собственный SHUTDOWN_TIMEOUT — с запасом внутри этой доли) и подтверждение offset
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "8"))
+DRAIN_SHARE = 0.4
+CONFIRM_TIMEOUT = 1.0
+# паузы перед перезапуском упавшего воркера: 1, 2, 4 … 30 с; после RESTART_RESET с работы — снова 1
+RESTART_DELAY_MAX = 30.0
+RESTART_RESET = 60.0
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+IMG_DIR = os.path.join(os.path.dirname(__file__), "images")
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Пользователь апдейта (from/user), иначе чат; None — апдейт ни к кому не привязан."""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+class Worker:
+    def __init__(self, index: int, socket_path: str, secret: str):
+        self.index = index
+        self.socket_path = socket_path
+        self.secret = secret
+        # (update_id, тело апдейта в JSON) в порядке получения
+        self.queue: "asyncio.Queue[Tuple[int, bytes]]" = asyncio.Queue()
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.forwarded = 0
+        self.dropped = 0
+        # с какого момента воркер не принимает апдейты (None — доступен) и когда пробовали последний раз
+        self.unavailable_since: Optional[float] = None
+        self.probed_at = 0.0
+
+    @property
+    def stalled(self) -> bool:
+        return (
+            self.unavailable_since is not None
+            and time.monotonic() - self.unavailable_since > WORKER_STALL_TIMEOUT
+        )
+
+
+class Supervisor:
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        socket_dir: str = WORKER_SOCKET_DIR,
+        shutdown_timeout: float = SHUTDOWN_TIMEOUT,
+    ):
+        self.shutdown_timeout = shutdown_timeout
+        self._own_socket_dir = not socket_dir
+        self.socket_dir = socket_dir or tempfile.mkdtemp(prefix="booking-bot-")
+        # секрет только для связи супервизор → воркер, наружу не уходит
+        self.secret = secrets.token_urlsafe(32)
+        self.workers = [
+            Worker(i, os.path.join(self.socket_dir, f"worker-{i}.sock"), self.secret)
+            for i in range(workers)
+        ]
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        # update_id, переданные в очереди, но ещё не принятые воркерами
+        self._undelivered: Set[int] = set()
+        self.last_routed: Optional[int] = None
+
+    # -------------------------------------------------------------------------
+    # Процессы
+    # -------------------------------------------------------------------------
+    async def _spawn(self, worker: Worker) -> asyncio.subprocess.Process:
+        env = dict(
+            os.environ,
+            BOT_MODE="worker",
+            WORKER_INDEX=str(worker.index),
+            WORKER_SOCKET=worker.socket_path,
+            WORKER_SECRET=worker.secret,
+            SHARED_DB="1",
+            # фоновые задачи — только в воркере 0 (RUN_BACKGROUND_JOBS=0 у супервизора выключает и их)
+            RUN_BACKGROUND_JOBS=os.getenv("RUN_BACKGROUND_JOBS", "1") if worker.index == 0 else "0",
+            # воркер должен уложиться в свою часть дедлайна супервизора, иначе получит SIGKILL
+            SHUTDOWN_TIMEOUT=str(self.worker_shutdown_timeout),
+        )
+        # своя сессия — Ctrl+C в терминале не бьёт по воркерам в обход stop()
+        process = await asyncio.create_subprocess_exec(sys.executable, MAIN_PATH, env=env, start_new_session=True)
+        logger.info("Worker %s started (pid %s)", worker.index, process.pid)
+        return process
+
+    async def _keep_alive(self, worker: Worker) -> None:
+        delay = 1.0
+        while not self._stopping:
+            started = time.monotonic()
+            worker.process = await self._spawn(worker)
+            # новый процесс — отсчёт недоступности заново, пока он стартует
+            worker.unavailable_since = None
+            code = await worker.process.wait()
+            if self._stopping:
+                return
+            if time.monotonic() - started > RESTART_RESET:
+                delay = 1.0
+            worker.restarts += 1
+            logger.error("Worker %s exited with code %s, restarting in %.0fs", worker.index, code, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+
+    # -------------------------------------------------------------------------
+    # Пересылка апдейтов
+    # -------------------------------------------------------------------------
+    def route(self, body: bytes, update: Dict[str, Any]) -> None:
+        update_id = update.get("update_id", 0)
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else update_id
+        self._undelivered.add(update_id)
+        if self.last_routed is None or update_id > self.last_routed:
+            self.last_routed = update_id
+        self.workers[key % len(self.workers)].queue.put_nowait((update_id, body))
+
+    def confirmed_offset(self) -> Optional[int]:
+        """offset для getUpdates: все апдейты до него приняты воркерами (None — апдейтов не было)."""
+        if self._undelivered:
+            return min(self._undelivered)
+        return self.last_routed + 1 if self.last_routed is not None else None
+
+    async def _post(self, session: aiohttp.ClientSession, worker: Worker, body: bytes) -> bool:
+        """
+        Пересылает апдейт, пока воркер его не примет. False — воркер отвечает ошибкой
+        FORWARD_REJECTS раз подряд или недоступен дольше WORKER_STALL_TIMEOUT.
+        """
+        rejects = 0
+        warned = False
+        while True:
+            if worker.stalled and time.monotonic() - worker.probed_at < STALL_PROBE_INTERVAL:
+                logger.error(
+                    "Update dropped, worker %s unavailable for %.0fs",
+                    worker.index, time.monotonic() - worker.unavailable_since,
+                )
+                return False
+            worker.probed_at = time.monotonic()
+            try:
+                async with session.post(
+                    f"http://worker{WEBHOOK_PATH}",
+                    data=body,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-Telegram-Bot-Api-Secret-Token": worker.secret,
+                    },
+                ) as resp:
+                    if worker.unavailable_since is not None:
+                        logger.info(
+                            "Worker %s is back after %.0fs", worker.index, time.monotonic() - worker.unavailable_since
+                        )
+                        worker.unavailable_since = None
+                    if resp.status == 200:
+                        return True
+                    rejects += 1
+                    if rejects >= FORWARD_REJECTS:
+                        logger.error("Update dropped, worker %s rejects it: HTTP %s", worker.index, resp.status)
+                        return False
+                    error = f"HTTP {resp.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # воркер ещё стартует, перезапускается или завис — повторяем
+                error = f"{type(e).__name__}: {e}"
+                if worker.unavailable_since is None:
+                    worker.unavailable_since = time.monotonic()
+            if worker.stalled:
+                logger.error(
+                    "Update dropped, worker %s unavailable for %.0fs (%s)",
+                    worker.index, time.monotonic() - worker.unavailable_since, error,
+                )
+                return False
+            down_for = time.monotonic() - worker.unavailable_since if worker.unavailable_since is not None else 0.0
+            if not warned and down_for > FORWARD_TIMEOUT:
+                warned = True
+                logger.warning(
+                    "Worker %s unavailable (%s), %d updates waiting",
+                    worker.index, error, worker.queue.qsize() + 1,
+                )
+            await asyncio.sleep(0.2)
+
+    async def _forward(self, worker: Worker) -> None:
+        connector = aiohttp.UnixConnector(path=worker.socket_path)
+        timeout = aiohttp.ClientTimeout(total=FORWARD_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while True:
+                update_id, body = await worker.queue.get()
+                try:
+                    delivered = await self._post(session, worker, body)
+                except Exception:
+                    delivered = False
+                    logger.exception("Failed to forward update to worker %s", worker.index)
+                finally:
+                    # при отмене (остановка) апдейт остаётся в _undelivered — offset его не пропустит
+                    worker.queue.task_done()
+                if delivered:
+                    worker.forwarded += 1
+                else:
+                    worker.dropped += 1
+                self._undelivered.discard(update_id)
+
+    async def drain(self, timeout: float) -> bool:
+        """Ждёт, пока все полученные апдейты переданы воркерам. False — не успели за timeout."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(worker.queue.join() for worker in self.workers)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Worker queues not drained: %s", [w.queue.qsize() for w in self.workers])
+            return False
+        return True
+
+    # -------------------------------------------------------------------------
+    # Жизненный цикл
+    # -------------------------------------------------------------------------
+    def start(self) -> None:
+        for worker in self.workers:
+            self._tasks.append(asyncio.create_task(self._keep_alive(worker)))
+            self._tasks.append(asyncio.create_task(self._forward(worker)))
+        logger.info("Supervisor started %d workers, sockets in %s", len(self.workers), self.socket_dir)
+
+    @property
+    def worker_shutdown_timeout(self) -> float:
+        """Дедлайн остановки для воркера: доля после пересылки очередей минус секунда на выход процесса."""
+        return max(1.0, self.shutdown_timeout * (1 - DRAIN_SHARE) - 1.0)
+
+    async def stop(self) -> None:
+        """
+        Останавливается за shutdown_timeout: очереди пересылаются воркерам (не дольше
+        доли DRAIN_SHARE), затем SIGTERM воркерам; не успевшие к дедлайну — SIGKILL.
+        """
+        deadline = time.monotonic() + self.shutdown_timeout
+        await self.drain(self.shutdown_timeout * DRAIN_SHARE)
+        self._stopping = True
+        processes = [w.process for w in self.workers if w.process is not None and w.process.returncode is None]
+        for process in processes:
+            process.terminate()
+        timeout = max(0.0, deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(asyncio.gather(*(p.wait() for p in processes)), timeout)
+        except asyncio.TimeoutError:
+            for process in processes:
+                if process.returncode is None:
+                    logger.warning("Worker pid %s did not stop in %.0fs, killing", process.pid, timeout)
+                    process.kill()
+            await asyncio.gather(*(p.wait() for p in processes))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._own_socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+        for worker in self.workers:
+            logger.info(
+                "Worker %s: %d updates forwarded, %d dropped, %d restarts",
+                worker.index, worker.forwarded, worker.dropped, worker.restarts,
+            )
+
+
+# -----------------------------------------------------------------------------
+# Приём апдейтов
+# -----------------------------------------------------------------------------
+async def api_call(session: aiohttp.ClientSession, method: str, **params: Any) -> Any:
+    async with session.post(f"{TELEGRAM_API_URL.rstrip('/')}/bot{BOT_TOKEN}/{method}", json=params) as resp:
+        payload = await resp.json(content_type=None)
+    if not payload.get("ok"):
+        raise RuntimeError(f"{method}: {payload.get('description')}")
+    return payload["result"]
+
+
+async def run_polling(supervisor: Supervisor, stop: asyncio.Event) -> None:
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # после webhook-режима Telegram не отдаёт getUpdates, пока вебхук не снят
+        await api_call(session, "deleteWebhook")
+        offset = 0
+        delay = 1.0
+        while not stop.is_set():
+            poll = asyncio.create_task(api_call(session, "getUpdates", offset=offset, timeout=30, limit=100))
+            stopped = asyncio.create_task(stop.wait())
+            await asyncio.wait((poll, stopped), return_when=asyncio.FIRST_COMPLETED)
+            stopped.cancel()
+            if not poll.done():
+                poll.cancel()
+                await asyncio.gather(poll, return_exceptions=True)
+                break
+            try:
+                updates = poll.result()
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, ValueError) as e:
+                logger.warning("getUpdates failed, retrying in %.0fs: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            delay = 1.0
+            # апдейты, ждущие недоступного воркера, приходят повторно — они уже в очереди
+            last_routed = supervisor.last_routed
+            fresh = [u for u in updates if last_routed is None or u["update_id"] > last_routed]
+            for update in fresh:
+                supervisor.route(json.dumps(update).encode(), update)
+            # offset — первый апдейт, ещё не принятый воркером: упадём раньше — получим его снова
+            offset = supervisor.confirmed_offset() or offset
+            if updates and not fresh:
+                # новых апдейтов нет, а ожидающие getUpdates отдаёт сразу — не крутимся впустую
+                try:
+                    await asyncio.wait_for(stop.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def confirm_offset(supervisor: Supervisor) -> None:
+    """
+    После остановки супервизора: Telegram считает offset подтверждённым только со
+    следующим getUpdates — без этого последняя пачка пришла бы снова после рестарта.
+    Апдейты, не дошедшие до воркеров, не подтверждаются и придут снова.
+    """
+    offset = supervisor.confirmed_offset()
+    if offset is None:
+        return
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CONFIRM_TIMEOUT)) as session:
+            await api_call(session, "getUpdates", offset=offset, limit=1, timeout=0)
+    except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, ValueError) as e:
+        logger.warning("Failed to confirm the last update offset: %s", e)
+
+
+def build_webhook_app(supervisor: Supervisor) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET
+        ):
+            return web.Response(status=401, text="Unauthorized")
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400, text="Bad Request")
+        supervisor.route(body, update)
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    return app
+
+
+async def run_webhook(supervisor: Supervisor, stop: asyncio.Event) -> None:
+    runner = web.AppRunner(build_webhook_app(supervisor))
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    if WEBHOOK_BASE_URL:
+        async with aiohttp.ClientSession() as session:
+            await api_call(
+                session, "setWebhook", url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET
+            )
+    logger.info("Webhook server listening on %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main() -> None:
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN не задан в .env")
+    # без секрета webhook-порт принял бы поддельные апдейты — в том числе «от админа»
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET не задан в .env (обязателен для BOT_MODE=webhook)")
+    # схема базы и картинки готовятся один раз, до воркеров — им остаётся только открыть готовое
+    await db.init_db()
+    await db.close_db()
+    await asyncio.to_thread(ImageOptimizer().prepare_dir, IMG_DIR)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    # после воркеров остаётся время подтвердить offset
+    supervisor = Supervisor(shutdown_timeout=max(1.0, SHUTDOWN_TIMEOUT - CONFIRM_TIMEOUT))
+    supervisor.start()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(supervisor, stop)
+        else:
+            await run_polling(supervisor, stop)
+    finally:
+        await supervisor.stop()
+    if BOT_MODE != "webhook":
+        await confirm_offset(supervisor)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Shutting down supervisor")
@@ -0,0 +1,19 @@
+# tests/conftest.py
+"""
+Модули бота лежат в корне репозитория; тесты запускаются оттуда:
+
+    python -m pytest -q
+
+db.py читает DB_PATH при импорте — до него подставляем временный файл, чтобы
+ни один тест не открыл рабочий bot.db.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="booking-bot-tests-"), "bot.db")
@@ -0,0 +1,118 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    """Свой bot.db и writer на тест; flush_interval побольше — параллельные заявки попадают в одну пачку."""
+    pool = db.ConnectionPool(str(tmp_path / "bot.db"), size=1)
+    writer = db.BookingWriter(pool, flush_interval=0.05)
+    monkeypatch.setattr(db, "pool", pool)
+    monkeypatch.setattr(db, "writer", writer)
+    return writer
+
+
+def run(coro):
+    async def with_db():
+        await db.init_db()
+        try:
+            return await coro
+        finally:
+            await db.close_db()
+    return asyncio.run(with_db())
+
+
+def booking(time_str, duration_min=60, date="2026-05-04", user_id=1):
+    return {
+        "user_id": user_id,
+        "username": "client",
+        "service": "classic",
+        "duration_min": duration_min,
+        "price": duration_min,
+        "comment": "",
+        "date": date,
+        "time": time_str,
+    }
+
+
+async def count(sql):
+    async with db.pool.acquire() as conn:
+        cur = await conn.execute(sql)
+        (value,) = await cur.fetchone()
+    return value
+
+
+def test_conflict_with_saved_booking(writer):
+    writer.check_conflicts = True
+
+    async def scenario():
+        await db.add_bookings([booking("12:00")])
+        with pytest.raises(db.SlotConflictError):
+            await db.add_bookings([booking("12:30", 30, user_id=2)])
+        # впритык — не пересечение; другой день — тоже
+        await db.add_bookings([booking("13:00", user_id=3)])
+        await db.add_bookings([booking("12:00", date="2026-05-05", user_id=4)])
+        return await count("SELECT COUNT(*) FROM bookings")
+
+    assert run(scenario()) == 3
+
+
+def test_conflicts_inside_one_batch(writer):
+    writer.check_conflicts = True
+
+    async def scenario():
+        results = await asyncio.gather(
+            db.add_bookings([booking("10:00", 90, user_id=1)]),
+            db.add_bookings([booking("11:00", user_id=2)]),
+            # корзина целиком: конфликт одной заявки отклоняет всю группу
+            db.add_bookings([booking("15:00", user_id=3), booking("10:30", 30, user_id=3)]),
+            db.add_bookings([booking("11:30", user_id=4)]),
+            return_exceptions=True,
+        )
+        return results, await count("SELECT COUNT(*) FROM bookings")
+
+    results, saved = run(scenario())
+    assert isinstance(results[0], list)
+    assert isinstance(results[1], db.SlotConflictError)
+    assert isinstance(results[2], db.SlotConflictError)
+    assert isinstance(results[3], list)
+    assert saved == 2
+
+
+def test_no_conflict_check_by_default(writer):
+    async def scenario():
+        await db.add_bookings([booking("12:00")])
+        await db.add_bookings([booking("12:00", user_id=2)])
+        return await count("SELECT COUNT(*) FROM bookings")
+
+    assert run(scenario()) == 2
+
+
+def test_failed_group_does_not_roll_back_others(writer, caplog):
+    async def scenario():
+        results = await asyncio.gather(
+            db.add_bookings([booking("09:00")], notify=[(100, "booking 1")]),
+            # outbox.chat_id NOT NULL: executemany пачки падает, группы пишутся по SAVEPOINT
+            db.add_bookings([booking("10:00", user_id=2)], notify=[(None, "broken")]),
+            db.add_bookings([booking("11:00", user_id=3)], notify=[(100, "booking 3")]),
+            return_exceptions=True,
+        )
+        counts = [
+            await count(sql)
+            for sql in (
+                "SELECT COUNT(*) FROM bookings",
+                "SELECT COUNT(*) FROM outbox",
+                "SELECT SUM(booked) FROM booking_stats",
+            )
+        ]
+        return results, counts
+
+    results, counts = run(scenario())
+    assert "retrying group by group" in caplog.text
+    assert isinstance(results[0], list) and isinstance(results[2], list)
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert counts == [2, 2, 2]
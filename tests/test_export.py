@@ -0,0 +1,14 @@
+import pytest
+
+from export import FORMULA_PREFIXES, _csv_safe
+
+
+@pytest.mark.parametrize("prefix", FORMULA_PREFIXES)
+def test_csv_safe_escapes_formula_prefixes(prefix):
+    value = prefix + "HYPERLINK(\"http://example.com\")"
+    assert _csv_safe((1, value)) == (1, "'" + value)
+
+
+def test_csv_safe_keeps_other_values():
+    row = (42, "Anna", "", None, 60, "2026-01-01", "a=b")
+    assert _csv_safe(row) == row
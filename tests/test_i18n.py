@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from i18n import Catalog, CatalogError, _flatten
+
+
+def test_flatten():
+    raw = {
+        "_meta": {"name": "English"},
+        "text": {"hello": "Hello, {name}"},
+        "services": {"classic": {"title": "Classic massage"}},
+        "durations": {"60": "60 min"},
+    }
+    assert _flatten(raw) == {
+        "hello": "Hello, {name}",
+        "svc.classic.title": "Classic massage",
+        "dur.60": "60 min",
+    }
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        [],
+        {"_meta": ["en"]},
+        {"text": ["hello"]},
+        {"text": {"hello": 1}},
+        {"services": {"classic": "Classic massage"}},
+        {"durations": "60 min"},
+    ],
+)
+def test_flatten_rejects_bad_shape(raw):
+    with pytest.raises(CatalogError):
+        _flatten(raw)
+
+
+def _write(path, name, data):
+    (path / name).write_text(json.dumps(data), encoding="utf-8")
+
+
+def test_reload_keeps_previous_tables_on_bad_file(tmp_path):
+    _write(tmp_path, "ru.json", {"text": {"hello": "Привет"}})
+    _write(tmp_path, "en.json", {"_meta": {"fallback": "ru"}, "text": {}})
+    catalog = Catalog(str(tmp_path))
+    catalog.load()
+    # непереведённое берётся из fallback-языка
+    assert catalog.t("en", "hello") == "Привет"
+
+    _write(tmp_path, "en.json", [])
+    assert catalog.reload() is False
+    assert catalog.t("en", "hello") == "Привет"
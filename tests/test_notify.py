@@ -0,0 +1,53 @@
+from notify import split_text, text_length
+from outbox import DIGEST_SEPARATOR, digest_header, pack_digest
+
+
+def test_split_text_short_text_is_one_part():
+    assert split_text("hello", limit=10) == ["hello"]
+    assert split_text("", limit=10) == []
+
+
+def test_split_text_prefers_newlines():
+    text = "line one\nline two\nline three"
+    parts = split_text(text, limit=20)
+    assert parts == ["line one\nline two", "line three"]
+
+
+def test_split_text_cuts_long_lines_at_limit():
+    parts = split_text("x" * 25, limit=10)
+    assert parts == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_split_text_counts_utf16_units():
+    # эмодзи вне BMP — две единицы UTF-16, как считает Telegram
+    text = "😀" * 7
+    parts = split_text(text, limit=4)
+    assert "".join(parts) == text
+    assert all(text_length(part) <= 4 for part in parts)
+
+
+def test_pack_digest_single_row_is_sent_as_is():
+    rows = [(1, 100, "one booking", 0)]
+    assert pack_digest(rows, limit=100) == [(rows, "one booking")]
+
+
+def test_pack_digest_single_long_row_is_split():
+    rows = [(1, 100, "a" * 250, 0)]
+    packed = pack_digest(rows, limit=100)
+    assert [chunk_rows for chunk_rows, _ in packed] == [rows, rows, rows]
+    assert "".join(text for _, text in packed) == "a" * 250
+
+
+def test_pack_digest_joins_rows_under_header():
+    rows = [(i, 100, f"booking {i}", 0) for i in range(3)]
+    [(chunk_rows, text)] = pack_digest(rows, limit=4096)
+    assert chunk_rows == rows
+    assert text == digest_header(3) + DIGEST_SEPARATOR.join(f"booking {i}" for i in range(3))
+
+
+def test_pack_digest_respects_limit_and_keeps_every_row():
+    rows = [(i, 100, f"{i}:" + "b" * 60, 0) for i in range(10)]
+    packed = pack_digest(rows, limit=200)
+    assert len(packed) > 1
+    assert all(text_length(text) <= 200 for _, text in packed)
+    assert [row for chunk_rows, _ in packed for row in chunk_rows] == rows
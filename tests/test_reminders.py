@@ -0,0 +1,42 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import reminders
+from reminders import parse_offsets, reminder_times
+
+
+def test_parse_offsets():
+    assert parse_offsets("24h, 2h,30m,1d") == [
+        ("24h", 86400.0), ("2h", 7200.0), ("30m", 1800.0), ("1d", 86400.0),
+    ]
+
+
+def test_parse_offsets_empty_disables_reminders():
+    assert parse_offsets("") == []
+    assert parse_offsets(" , ") == []
+
+
+@pytest.mark.parametrize("spec", ["24", "2w", "h"])
+def test_parse_offsets_rejects_bad_items(spec):
+    with pytest.raises(ValueError):
+        parse_offsets(spec)
+
+
+def test_reminder_times_skips_past_reminders(monkeypatch):
+    monkeypatch.setattr(reminders, "SALON_TZ", ZoneInfo("UTC"))
+    start = datetime(2026, 3, 10, 12, 0, tzinfo=ZoneInfo("UTC")).timestamp()
+    offsets = parse_offsets("24h,2h")
+    assert reminder_times("2026-03-10", "12:00", offsets, now=start - 3 * 86400) == [
+        ("24h", start - 86400), ("2h", start - 7200),
+    ]
+    assert reminder_times("2026-03-10", "12:00", offsets, now=start - 3 * 3600) == [("2h", start - 7200)]
+    assert reminder_times("2026-03-10", "12:00", offsets, now=start) == []
+
+
+def test_reminder_times_use_salon_timezone(monkeypatch):
+    # время заявки — местное время салона, а не сервера
+    monkeypatch.setattr(reminders, "SALON_TZ", ZoneInfo("Asia/Tokyo"))
+    start = datetime(2026, 3, 10, 12, 0, tzinfo=ZoneInfo("Asia/Tokyo")).timestamp()
+    assert reminder_times("2026-03-10", "12:00", parse_offsets("2h"), now=0) == [("2h", start - 7200)]
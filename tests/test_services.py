@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+from services import SERVICES_PATH, ServiceCatalogError, build_snapshot
+
+
+@pytest.fixture
+def raw():
+    with open(SERVICES_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_build_snapshot_from_shipped_catalog(raw):
+    snapshot = build_snapshot(raw, version=3)
+    assert snapshot.version == 3
+    assert set(snapshot.services) == set(raw["services"])
+    assert snapshot.durations == tuple(raw["durations"])
+    key = next(iter(raw["services"]))
+    assert snapshot.price(key, 60) == round(raw["services"][key]["price_60"])
+
+
+@pytest.mark.parametrize(
+    "patch",
+    [
+        lambda raw: [],
+        lambda raw: "services",
+        lambda raw: {**raw, "services": ["classic"]},
+        lambda raw: {**raw, "services": {"classic": 5}},
+        lambda raw: {**raw, "services": {"classic": {"price_60": "60"}}},
+        lambda raw: {**raw, "services": {"classic": {"price_60": 60, "image": 1}}},
+        lambda raw: {**raw, "services": {}},
+        lambda raw: {**raw, "durations": {"60": 60}},
+        lambda raw: {**raw, "durations": [60, 0]},
+        lambda raw: {**raw, "hours": [10, 20, 21]},
+        lambda raw: {**raw, "hours": {"slot_start": 20, "slot_end": 10, "work_end": 21}},
+        lambda raw: {**raw, "calendar_days": -1},
+    ],
+)
+def test_build_snapshot_rejects_bad_catalog(raw, patch):
+    with pytest.raises(ServiceCatalogError):
+        build_snapshot(patch(raw))